@@ -0,0 +1,262 @@
+import argparse
+import csv
+import time
+from pathlib import Path
+
+import numpy as np
+
+from evaluation import (PreparedCloud, directed_nearest_neighbor_distances, evaluate_pointcloud_multi,
+                        metrics_from_sq_dists)
+from loading_things import load_dataset_relations, load_ply_pointcloud
+from results_store import open_results
+
+# Approximate metrics for quick exploratory sweeps: each cloud is downsampled to a target size, and only the sampled
+# points are matched against the other (full) cloud. Matching against the full cloud keeps every distance exact, so
+# the metrics are unbiased estimates (matching against a downsampled cloud too would push every distance up).
+# Each metric gets a bootstrap standard error next to it ("<metric>_error").
+# Farthest-point and voxel sampling spread the sample evenly over the surface, which over-weights sparse regions
+# (stray points of a noisy reconstruction): on noisy clouds their F-scores are biased well beyond the error estimate.
+# Uniform random sampling is unbiased and its error estimates hold up, so it is the default. Run this file for a
+# calibration report of the speed/accuracy of each method and sample size.
+
+SAMPLING_METHODS = ("fps", "voxel", "random")
+DEFAULT_APPROXIMATE = dict(size=1024, method="random", bootstrap=200, seed=0)
+ERROR_KEYS = ("chamfer_distance", "precision", "recall", "fscore")
+
+
+def farthest_point_sample(points: np.ndarray, size: int) -> np.ndarray:
+    """Indices of size points picked by farthest-point sampling (starting from the point farthest from the centroid)"""
+    if size >= len(points):
+        return np.arange(len(points))
+    chosen = np.empty(size, dtype=np.int64)
+    chosen[0] = int(np.argmax(np.sum((points - points.mean(axis=0)) ** 2, axis=1)))
+    dist = np.full(len(points), np.inf, dtype=np.float32)
+    for i in range(1, size):
+        np.minimum(dist, np.sum((points - points[chosen[i - 1]]) ** 2, axis=1), out=dist)
+        chosen[i] = int(np.argmax(dist))
+    return np.sort(chosen)
+
+
+def voxel_sample(points: np.ndarray, size: int) -> np.ndarray:
+    """
+    Indices of about size points, one per occupied voxel (the first in each), with the voxel size found by bisection
+    so that the number of occupied voxels is as close to size as possible without going over.
+    """
+    if size >= len(points):
+        return np.arange(len(points))
+    offset = points - points.min(axis=0)
+    extent = float(offset.max())
+
+    def first_per_voxel(voxel_size):
+        cells = np.floor(offset / voxel_size).astype(np.int64)
+        return np.unique(cells, axis=0, return_index=True)[1]
+
+    low, high = extent / len(points), extent  # (a voxel per point at most, one voxel at least)
+    best = first_per_voxel(high)
+    for _ in range(20):
+        middle = (low + high) / 2
+        indices = first_per_voxel(middle)
+        if len(indices) > size:
+            low = middle
+        else:
+            high, best = middle, indices
+            if len(indices) >= size * 0.98:
+                break
+    return np.sort(best)
+
+
+def random_sample(points: np.ndarray, size: int, seed: int = 0) -> np.ndarray:
+    """Indices of size points picked uniformly at random (without replacement)"""
+    if size >= len(points):
+        return np.arange(len(points))
+    return np.sort(np.random.default_rng(seed).choice(len(points), size=size, replace=False))
+
+
+def sample_indices(points: np.ndarray, size: int, method: str = "fps", seed: int = 0) -> np.ndarray:
+    if method == "fps":
+        return farthest_point_sample(points, size)
+    if method == "voxel":
+        return voxel_sample(points, size)
+    if method == "random":
+        return random_sample(points, size, seed)
+    raise ValueError(f"Unknown sampling method '{method}', expected one of {SAMPLING_METHODS}")
+
+
+def _bootstrap_errors(min_ab: np.ndarray, min_ba: np.ndarray, taus: list[float], rounds: int, seed: int,
+                      whole_ab: bool = False, whole_ba: bool = False) -> list[dict]:
+    """
+    Bootstrap standard errors of every metric (resampling the sampled points of each cloud), one dict per tau.
+    whole_ab/whole_ba say that a direction used the whole cloud rather than a sample, so it has no sampling error.
+    """
+    rng = np.random.default_rng(seed)
+
+    def resample(values, whole):
+        if whole:
+            return np.broadcast_to(values, (rounds, len(values)))
+        return values[rng.integers(0, len(values), size=(rounds, len(values)))]
+
+    sample_ab, sample_ba = resample(min_ab, whole_ab), resample(min_ba, whole_ba)
+    chamfer_error = float(np.std(sample_ab.mean(axis=1) + sample_ba.mean(axis=1), ddof=1))
+    dist_ab, dist_ba = np.sqrt(sample_ab), np.sqrt(sample_ba)
+
+    errors = []
+    for tau in taus:
+        precision = (dist_ab < tau).mean(axis=1)
+        recall = (dist_ba < tau).mean(axis=1)
+        total = precision + recall
+        f = np.divide(2 * precision * recall, total, out=np.zeros_like(total), where=total > 0)
+
+        # A sample where every point (or none) is within tau has no spread to resample, so precision and recall get
+        # at least the binomial error of (k + 0.5) / (n + 1), carried over to the F-score
+        p, p_error = _proportion_error(np.sqrt(min_ab) < tau, float(np.std(precision, ddof=1)), whole_ab)
+        r, r_error = _proportion_error(np.sqrt(min_ba) < tau, float(np.std(recall, ddof=1)), whole_ba)
+        f_error = 2 * np.hypot(r ** 2 * p_error, p ** 2 * r_error) / (p + r) ** 2
+        errors.append(dict(
+            chamfer_distance=chamfer_error,
+            precision=p_error,
+            recall=r_error,
+            fscore=max(float(np.std(f, ddof=1)), float(f_error)),
+        ))
+    return errors
+
+
+def _proportion_error(within: np.ndarray, bootstrap_error: float, whole: bool) -> tuple[float, float]:
+    """The (smoothed) proportion of True in within, and its standard error (at least the binomial one if sampled)"""
+    if whole:
+        return float(within.mean()), 0.0
+    p = (within.sum() + 0.5) / (len(within) + 1)
+    return float(p), max(bootstrap_error, float(np.sqrt(p * (1 - p) / len(within))))
+
+
+def approximate_metrics(pred: PreparedCloud, gt: PreparedCloud, taus: list[float], backend: str = "torch",
+                        size: int = DEFAULT_APPROXIMATE["size"], method: str = DEFAULT_APPROXIMATE["method"],
+                        bootstrap: int = DEFAULT_APPROXIMATE["bootstrap"], seed: int = DEFAULT_APPROXIMATE["seed"],
+                        memory_budget_mb: float | None = None) -> list[dict]:
+    """
+    Metrics (one dict per tau, as from evaluate_pointcloud_multi) estimated from size sampled points of each cloud,
+    each with its bootstrap standard error ("<metric>_error") and an "approximate" block saying how it was made.
+    Clouds no bigger than size are used whole (so small clouds give the exact metrics, with zero error).
+    """
+    pred_idx = sample_indices(pred.points, size, method, seed)
+    gt_idx = gt.sample(size, method, seed)
+
+    # Match the sampled points of each cloud against the whole other cloud (one direction each)
+    kwargs = {} if memory_budget_mb is None else dict(memory_budget_mb=memory_budget_mb)
+    min_ab, device = directed_nearest_neighbor_distances(PreparedCloud(pred.points[pred_idx], normalize=False), gt,
+                                                         backend, **kwargs)
+    min_ba, _ = directed_nearest_neighbor_distances(PreparedCloud(gt.points[gt_idx], normalize=False), pred,
+                                                    backend, **kwargs)
+
+    results = metrics_from_sq_dists(min_ab, min_ba, taus, device)
+    errors = _bootstrap_errors(min_ab.cpu().numpy(), min_ba.cpu().numpy(), taus, bootstrap, seed,
+                               whole_ab=len(pred_idx) == len(pred), whole_ba=len(gt_idx) == len(gt))
+    for metrics, error in zip(results, errors):
+        for key in ERROR_KEYS:
+            metrics[f"{key}_error"] = error[key]
+        metrics["approximate"] = dict(method=method, size=size, pred_points=len(pred_idx), gt_points=len(gt_idx))
+    return results
+
+
+def approximate_settings(approximate: int | dict) -> dict:
+    """The full settings for an approximate= option: a sample size, or a dict overriding DEFAULT_APPROXIMATE"""
+    settings = dict(DEFAULT_APPROXIMATE, **(approximate if isinstance(approximate, dict) else dict(size=approximate)))
+    if settings["method"] not in SAMPLING_METHODS:
+        raise ValueError(f"Unknown sampling method '{settings['method']}', expected one of {SAMPLING_METHODS}")
+    return settings
+
+
+# Calibration
+
+def sweep_pairs(results_path: Path, spar3d_outputs_root: Path, object_relations_path: Path) -> list[tuple[Path, Path]]:
+    """(reconstruction PLY, ground truth PLY) for every record of a sweep whose PLY is still in spar3d_outputs"""
+    grouped_data = load_dataset_relations(object_relations_path)
+    pairs = []
+    with open_results(results_path) as results:
+        for record in results.distortions():
+            distortion = record["distortion"]
+            ply_path = Path(spar3d_outputs_root) / record["object_id"] / (
+                f"pts_img{record['image_idx']}_blur{distortion['blur']}_noise{distortion['noise']}"
+                f"_exp{distortion['exposure']}.ply"
+            )
+            fields = grouped_data.get(record["category"], {}).get(record["object_id"])
+            if fields is not None and ply_path.exists():
+                pairs.append((ply_path, Path(fields["point_cloud"])))
+    return pairs
+
+
+def calibrate(pairs: list[tuple[Path, Path]], sizes: list[int], taus: list[float],
+              methods: tuple[str, ...] = SAMPLING_METHODS, backend: str = "torch", bootstrap: int = 200) -> list[dict]:
+    """
+    Compares approximate metrics against the exact ones for every pair of clouds, sample size, and method.
+    Returns one row per (pair, method, size, tau) with the times, the actual and estimated errors, and whether the
+    actual error is within two estimated standard errors.
+    """
+    rows = []
+    for pred_path, gt_path in pairs:
+        pred, gt = PreparedCloud(load_ply_pointcloud(pred_path)), PreparedCloud(load_ply_pointcloud(gt_path))
+        start_time = time.perf_counter()
+        exact = evaluate_pointcloud_multi(pred, gt, taus, backend=backend)
+        exact_time = time.perf_counter() - start_time
+
+        for method in methods:
+            for size in sizes:
+                # (the ground truth's sample is made once and reused for every distortion, so it isn't timed)
+                gt.sample(size, method)
+                start_time = time.perf_counter()
+                approx = approximate_metrics(pred, gt, taus, backend, size, method, bootstrap)
+                approx_time = time.perf_counter() - start_time
+
+                for tau, e, a in zip(taus, exact, approx):
+                    row = dict(pred=str(pred_path), gt=str(gt_path), method=method, size=size, tau=tau,
+                               exact_s=exact_time, approx_s=approx_time)
+                    for key in ("chamfer_distance", "fscore"):
+                        row[f"{key}_abs_error"] = abs(a[key] - e[key])
+                        row[f"{key}_est_error"] = a[f"{key}_error"]
+                        row[f"{key}_covered"] = row[f"{key}_abs_error"] <= 2 * a[f"{key}_error"] + 1e-12
+                    rows.append(row)
+    return rows
+
+
+def print_calibration(rows: list[dict]):
+    """Per method and sample size: speedup, mean actual vs estimated error, and how often the estimate covers it"""
+    print(f"\n{'method':<7} {'size':>6} {'speedup':>8} {'CD err':>10} {'CD est':>10} {'CD cov':>7} "
+          f"{'F err':>8} {'F est':>8} {'F cov':>6}")
+    groups = {}
+    for row in rows:
+        groups.setdefault((row["method"], row["size"]), []).append(row)
+    for (method, size), group in groups.items():
+        def mean(key):
+            return float(np.mean([row[key] for row in group]))
+        print(f"{method:<7} {size:>6} {mean('exact_s') / mean('approx_s'):7.1f}x "
+              f"{mean('chamfer_distance_abs_error'):10.2e} {mean('chamfer_distance_est_error'):10.2e} "
+              f"{mean('chamfer_distance_covered'):7.0%} {mean('fscore_abs_error'):8.4f} "
+              f"{mean('fscore_est_error'):8.4f} {mean('fscore_covered'):6.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Speed/accuracy calibration of the approximate metrics")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[128, 256, 512, 1024, 2048, 4096])
+    parser.add_argument("--methods", nargs="+", choices=SAMPLING_METHODS, default=list(SAMPLING_METHODS))
+    parser.add_argument("--taus", type=float, nargs="+", default=[0.1, 0.2, 0.5])
+    parser.add_argument("--backend", default="torch")
+    parser.add_argument("--results", type=Path, help="Sweep results (.json or .sqlite) whose outputs to calibrate on")
+    parser.add_argument("--outputs-root", type=Path, help="The sweep's spar3d_outputs folder")
+    parser.add_argument("--relations", type=Path, help="The dataset's object_relations.json")
+    parser.add_argument("--max-pairs", type=int, default=20, help="Calibrate on at most this many sweep outputs")
+    parser.add_argument("--csv", type=Path, help="Save every calibration row here")
+    args = parser.parse_args()
+
+    # The example pair, plus the outputs of an earlier sweep if given
+    examples = Path("examples_for_testing")
+    pairs = [(examples / "spar3d_ball_013.ply", examples / "db_ball_013.ply")]
+    if args.results is not None:
+        pairs += sweep_pairs(args.results, args.outputs_root, args.relations)[:args.max_pairs]
+
+    rows = calibrate(pairs, args.sizes, args.taus, tuple(args.methods), args.backend)
+    print_calibration(rows)
+    if args.csv is not None:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"Saved calibration to {args.csv}")
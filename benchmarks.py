@@ -0,0 +1,362 @@
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+from plyfile import PlyData, PlyElement
+
+from distortion import distort_image, distort_image_levels
+from evaluation import BACKENDS, PreparedCloud, evaluate_pointcloud_multi
+from instrumentation import current_rss_mb
+from loading_things import load_ply_pointcloud
+
+# Benchmarks for the evaluation, distortion, and PLY loading hot paths, and for how long the entry modules take to
+# import.
+#   python benchmarks.py run -o baseline.json             (save a baseline)
+#   python benchmarks.py run -o new.json -c baseline.json (run again and compare against it)
+#   python benchmarks.py compare baseline.json new.json   (compare two saved runs)
+
+CLOUD_SIZES = [1_000, 10_000, 100_000]
+IMAGE_SIZES = [256, 512, 1024]
+TAUS = [0.1, 0.2, 0.5]
+DISTORTION_LEVELS = [  # (the levels main.py sweeps)
+    {"blur": 0, "noise": 0, "exposure": 1.0},
+    {"blur": 4, "noise": 0, "exposure": 1.0},
+    {"blur": 10, "noise": 0, "exposure": 1.0},
+    {"blur": 0, "noise": 60, "exposure": 1.0},
+    {"blur": 0, "noise": 150, "exposure": 1.0},
+    {"blur": 0, "noise": 0, "exposure": 2.5},
+    {"blur": 0, "noise": 0, "exposure": 7.0},
+]
+
+# Modules that only load when their backend is used. Importing an entry module must not pull any of them in (e.g.
+# parse_results shouldn't wait seconds for torch); the startup suite fails if one does.
+HEAVY_MODULES = ("torch", "plyfile", "PIL", "scipy")
+STARTUP_MODULES = ["pipeline", "staged_pipeline", "parse_results", "experiment_plan", "results_store", "gt_cache",
+                   "recon_cache", "distortion", "loading_things"]
+
+
+def _release_free_memory():
+    """Returns freed heap memory to the OS (glibc only), so the next allocations show up as RSS growth again"""
+    libc_name = ctypes.util.find_library("c")
+    if libc_name is None or platform.system() != "Linux":
+        return
+    try:
+        ctypes.CDLL(libc_name).malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def _peak_memory_mb(fn) -> tuple[float | None, float | None]:
+    """
+    Peak memory of one fn() call: how far the RSS grew above where it started (sampled every millisecond from a
+    thread, so it covers numpy and torch buffers, which tracemalloc doesn't see), and the peak CUDA memory
+    (None without a GPU).
+    """
+    cuda = torch.cuda.is_available()
+    if cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        start_gpu = torch.cuda.memory_allocated()
+    _release_free_memory()
+    start_rss = current_rss_mb()
+    if start_rss is None:
+        fn()
+        rss_peak = None
+    else:
+        peak = [start_rss]
+        done = threading.Event()
+
+        def sample():
+            while not done.is_set():
+                peak[0] = max(peak[0], current_rss_mb())
+                time.sleep(0.001)
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        try:
+            fn()
+        finally:
+            done.set()
+            sampler.join()
+        rss_peak = max(peak[0], current_rss_mb()) - start_rss
+
+    gpu_peak = None
+    if cuda:
+        torch.cuda.synchronize()
+        gpu_peak = (torch.cuda.max_memory_allocated() - start_gpu) / 1024 ** 2
+    return rss_peak, gpu_peak
+
+
+def measure(fn, repeats: int, warmup: int = 1, work: float = 1.0, unit: str = "calls") -> dict:
+    """
+    Times fn() over `repeats` runs (after `warmup` untimed ones) and measures the peak memory of one more run.
+    work is how much fn does per call (e.g. points), for the throughput.
+    """
+    for _ in range(warmup):
+        fn()
+
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start_time)
+
+    # Peak memory is measured separately, since sampling it slows the call down a little
+    peak_mb, peak_gpu_mb = _peak_memory_mb(fn)
+
+    times_ms = np.array(times) * 1000
+    return {
+        "repeats": repeats,
+        "mean_ms": float(times_ms.mean()),
+        "p50_ms": float(np.percentile(times_ms, 50)),
+        "p90_ms": float(np.percentile(times_ms, 90)),
+        "p99_ms": float(np.percentile(times_ms, 99)),
+        "throughput": float(work / np.median(times)),
+        "throughput_unit": f"{unit}/s",
+        "peak_mb": peak_mb if peak_mb is not None else 0.0,
+        "peak_gpu_mb": peak_gpu_mb,
+    }
+
+
+def _repeats(seconds_per_call_estimate: float, budget: float = 2.0, minimum: int = 3, maximum: int = 50) -> int:
+    return int(min(maximum, max(minimum, budget / max(seconds_per_call_estimate, 1e-6))))
+
+
+def _timed_once(fn) -> float:
+    start_time = time.perf_counter()
+    fn()
+    return time.perf_counter() - start_time
+
+
+def _auto_measure(fn, **kwargs) -> dict:
+    """measure with the number of repeats picked from one warmup run (so every case takes a couple of seconds)"""
+    return measure(fn, repeats=_repeats(_timed_once(fn)), warmup=0, **kwargs)
+
+
+def _cloud(n: int, seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(n, 3)).astype(np.float32)
+
+
+def bench_evaluation(sizes: list[int]) -> dict:
+    results = {}
+    for n in sizes:
+        pred, gt = _cloud(n, 0), _cloud(n, 1)
+        results[f"normalize/{n}"] = _auto_measure(lambda: PreparedCloud(gt), work=n, unit="points")
+
+        # The GT is prepared once per object in the pipeline, so it's shared across calls here too
+        prepared_gt = PreparedCloud(gt)
+        for backend in BACKENDS:
+            results[f"evaluate/{backend}/{n}"] = _auto_measure(
+                lambda: evaluate_pointcloud_multi(pred, prepared_gt, TAUS, backend=backend), work=n, unit="points"
+            )
+    return results
+
+
+def bench_loading(sizes: list[int], work_dir: Path) -> dict:
+    results = {}
+    for n in sizes:
+        points = _cloud(n, 2)
+        layouts = {
+            "xyz": [("x", "<f4"), ("y", "<f4"), ("z", "<f4")],
+            "xyzrgba": [("x", "<f4"), ("y", "<f4"), ("z", "<f4"),
+                        ("red", "u1"), ("green", "u1"), ("blue", "u1"), ("alpha", "u1")],
+        }
+        for name, dtype in layouts.items():
+            vertices = np.zeros(n, dtype=dtype)
+            vertices["x"], vertices["y"], vertices["z"] = points.T
+            path = work_dir / f"{name}_{n}.ply"
+            PlyData([PlyElement.describe(vertices, "vertex")]).write(str(path))
+            results[f"load_ply/binary_{name}/{n}"] = _auto_measure(
+                lambda: np.asarray(load_ply_pointcloud(path)).sum(), work=n, unit="points"
+            )
+
+        # ASCII (like the ground truths), with and without the .npy sidecar
+        path = work_dir / f"ascii_{n}.ply"
+        vertices = np.zeros(n, dtype=layouts["xyz"])
+        vertices["x"], vertices["y"], vertices["z"] = points.T
+        PlyData([PlyElement.describe(vertices, "vertex")], text=True).write(str(path))
+        results[f"load_ply/ascii/{n}"] = _auto_measure(lambda: load_ply_pointcloud(path), work=n, unit="points")
+        load_ply_pointcloud(path, sidecar=True)
+        results[f"load_ply/ascii_sidecar/{n}"] = _auto_measure(
+            lambda: np.asarray(load_ply_pointcloud(path, sidecar=True)).sum(), work=n, unit="points"
+        )
+    return results
+
+
+def bench_distortion(sizes: list[int]) -> dict:
+    results = {}
+    for size in sizes:
+        pixels = np.random.default_rng(3).integers(0, 256, size=(size, size, 3), dtype=np.uint8)
+        img = Image.fromarray(pixels)
+        for level in DISTORTION_LEVELS[1:]:
+            name = f"blur{level['blur']}_noise{level['noise']}_exp{level['exposure']}"
+            results[f"distort/{name}/{size}"] = _auto_measure(
+                lambda: distort_image(img, **level, seed=0), work=size * size, unit="pixels"
+            )
+        results[f"distort_levels/all/{size}"] = _auto_measure(
+            lambda: distort_image_levels(img, DISTORTION_LEVELS, seeds=[0] * len(DISTORTION_LEVELS)),
+            work=size * size * len(DISTORTION_LEVELS), unit="pixels",
+        )
+    return results
+
+
+def _import_once(module: str) -> tuple[float, list[str]]:
+    """Imports a module in a fresh interpreter: its cumulative import time (s, from -X importtime) and the heavy
+    modules it loaded"""
+    code = f"import sys; import {module}; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                            cwd=Path(__file__).parent, check=True)
+    # (lines look like "import time:  self [us] | cumulative | module", nested modules indented)
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1e6, result.stdout.split()
+    raise RuntimeError(f"No import time reported for {module}")
+
+
+def bench_startup(modules: list[str], repeats: int) -> dict:
+    results = {}
+    for module in modules:
+        _import_once(module)  # (warm the file system cache and __pycache__)
+        runs = [_import_once(module) for _ in range(repeats)]
+        times_ms = np.array([t for t, _ in runs]) * 1000
+        results[f"startup/{module}"] = {
+            "repeats": repeats,
+            "mean_ms": float(times_ms.mean()),
+            "p50_ms": float(np.percentile(times_ms, 50)),
+            "p90_ms": float(np.percentile(times_ms, 90)),
+            "p99_ms": float(np.percentile(times_ms, 99)),
+            "throughput": float(1000 / np.median(times_ms)),
+            "throughput_unit": "imports/s",
+            "peak_mb": 0.0,  # (in another process)
+            "heavy_imports": runs[-1][1],
+        }
+    return results
+
+
+def run_benchmarks(quick: bool = False, only: list[str] | None = None) -> dict:
+    """Runs every benchmark (quick: the smallest sizes only) and returns the results with the environment they ran in"""
+    cloud_sizes = CLOUD_SIZES[:2] if quick else CLOUD_SIZES
+    image_sizes = IMAGE_SIZES[:2] if quick else IMAGE_SIZES
+
+    cases = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        suites = {
+            "evaluation": lambda: bench_evaluation(cloud_sizes),
+            "loading": lambda: bench_loading(cloud_sizes, Path(work_dir)),
+            "distortion": lambda: bench_distortion(image_sizes),
+            "startup": lambda: bench_startup(STARTUP_MODULES, repeats=3 if quick else 10),
+        }
+        for suite, run in suites.items():
+            if only and suite not in only:
+                continue
+            print(f"Running {suite} benchmarks...")
+            for name, result in run().items():
+                cases[name] = result
+                print(f"  {name:<45} p50 {result['p50_ms']:10.3f} ms   "
+                      f"{result['throughput']:14.1f} {result['throughput_unit']:<10} peak {result['peak_mb']:8.1f} MB")
+                if result.get("heavy_imports"):
+                    print(f"  WARNING: Importing {name.split('/')[-1]} loaded {', '.join(result['heavy_imports'])}")
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "torch": torch.__version__,
+            "cpu_count": os.cpu_count(),
+            "cuda": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+            "quick": quick,
+        },
+        "cases": cases,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1, memory_threshold: float = 0.2) -> list[str]:
+    """
+    Compares two runs case by case and returns the cases that regressed: median latency more than `threshold`
+    (a fraction) slower, or peak memory (RSS growth, or CUDA memory on a GPU) more than `memory_threshold` higher.
+    A startup case that loads a heavy module always counts as a regression.
+    """
+    regressions = []
+    print(f"{'case':<45} {'base p50':>12} {'new p50':>12} {'change':>9} {'base MB':>9} {'new MB':>9}")
+    for name, new in current["cases"].items():
+        old = baseline["cases"].get(name)
+        if old is None:
+            print(f"{name:<45} {'(new case)':>12}")
+            continue
+
+        change = new["p50_ms"] / old["p50_ms"] - 1
+        memory_change = (new["peak_mb"] - old["peak_mb"]) / max(old["peak_mb"], 1.0)
+        flags = []
+        if change > threshold:
+            flags.append("SLOWER")
+        if memory_change > memory_threshold:
+            flags.append("MORE MEMORY")
+        if old.get("peak_gpu_mb") is not None and new.get("peak_gpu_mb") is not None:
+            if (new["peak_gpu_mb"] - old["peak_gpu_mb"]) / max(old["peak_gpu_mb"], 1.0) > memory_threshold:
+                flags.append("MORE GPU MEMORY")
+        if new.get("heavy_imports"):
+            flags.append("IMPORTS " + ",".join(new["heavy_imports"]))
+        if flags:
+            regressions.append(name)
+        print(f"{name:<45} {old['p50_ms']:10.3f}ms {new['p50_ms']:10.3f}ms {change:+8.1%} "
+              f"{old['peak_mb']:9.1f} {new['peak_mb']:9.1f}  {' '.join(flags)}")
+
+    if baseline["meta"].get("platform") != current["meta"].get("platform"):
+        print("WARNING: The runs are from different platforms, so the comparison may not mean much")
+    print(f"{len(regressions)} regressions (threshold {threshold:.0%} latency, {memory_threshold:.0%} memory)")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for evaluation, distortion, and PLY loading")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--output", "-o", type=Path, help="Save the results (e.g. as a baseline)")
+    run_parser.add_argument("--compare", "-c", type=Path, help="Baseline to compare the results against")
+    run_parser.add_argument("--quick", action="store_true", help="Skip the largest clouds and images")
+    run_parser.add_argument("--only", nargs="+", choices=["evaluation", "loading", "distortion", "startup"])
+    run_parser.add_argument("--threshold", type=float, default=0.1, help="Allowed slowdown (fraction)")
+
+    compare_parser = commands.add_parser("compare", help="Compare two saved runs")
+    compare_parser.add_argument("baseline", type=Path)
+    compare_parser.add_argument("current", type=Path)
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="Allowed slowdown (fraction)")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        current = run_benchmarks(quick=args.quick, only=args.only)
+        if args.output is not None:
+            with open(args.output, "w") as f:
+                json.dump(current, f, indent=2)
+            print(f"Saved results → {args.output}")
+        baseline_path = args.compare
+    else:
+        with open(args.current, "r") as f:
+            current = json.load(f)
+        baseline_path = args.baseline
+
+    if baseline_path is not None:
+        with open(baseline_path, "r") as f:
+            baseline = json.load(f)
+        if compare(baseline, current, threshold=args.threshold):
+            raise SystemExit(1)
+    elif any(result.get("heavy_imports") for result in current["cases"].values()):
+        # (needs no baseline: an entry module loading torch/PIL/plyfile at import is always a regression)
+        raise SystemExit(1)
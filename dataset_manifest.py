@@ -0,0 +1,255 @@
+import errno
+import json
+import os
+import shutil
+from pathlib import Path
+
+from download_drive_images import extraction_covers, read_extracted_marker
+
+MANIFEST_VERSION = 1
+
+
+def _move(src: str, dst: Path):
+    """Moves a file by renaming it (no copy) when src and dst are on the same filesystem, copying otherwise"""
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(src, dst)
+
+
+def _scan_images(image_dir: Path) -> list[dict]:
+    """The PNGs in a folder, sorted by name, with their sizes and mtimes (one scandir, no per-file stat calls)"""
+    images = []
+    for entry in os.scandir(image_dir):
+        if entry.name.endswith(".png") and entry.is_file():
+            stat = entry.stat()
+            images.append(dict(name=entry.name, size=stat.st_size, mtime_ns=stat.st_mtime_ns))
+    return sorted(images, key=lambda image: image["name"])
+
+
+class DatasetManifest:
+    """
+    Persistent record of the restructured dataset: for every object, its category, image folder, images (name, size,
+    mtime), and ground truth (path, size, mtime), plus which extracted download folders have already been moved in.
+    It is updated incrementally (only new download folders are processed), and the relations file, the images to
+    process, and pruning are all computed from it rather than by walking the image tree.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        # extracted folder name -> {objects: number moved from it, images_per_object: renders it was extracted with}
+        self.sources = {}
+        self.objects = {}  # object_id -> entry (in the order objects were added)
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.sources = data["sources"]
+                self.objects = data["objects"]
+            else:
+                print(f"WARNING: {self.path} is from another manifest version, starting a new one")
+
+    def save(self):
+        """Writes the manifest (aside first, so a crash never leaves it half-written)."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(dict(version=MANIFEST_VERSION, sources=self.sources, objects=self.objects), f)
+        os.replace(tmp_path, self.path)
+
+    # Building
+
+    def ingest_extracted(self, source_root: Path, dest_root: Path) -> list[str]:
+        """
+        Moves the images of every extracted download folder under source_root that hasn't been ingested yet into
+        dest_root/<category>/<object_id>/ (renamed, not copied, on the same filesystem), records them, and deletes the
+        extracted folder (the .tar.gz files are kept). The manifest is saved after each folder.
+        A folder counts as ingested only if it was ingested with at least as many renders per object as it was now
+        extracted with (see download_drive_images.download_files), so re-extracting with more renders adds them.
+        Returns the ids of the objects that were added (or got more images).
+        """
+        os.makedirs(dest_root, exist_ok=True)
+        added = []
+
+        for img_folder in sorted(os.scandir(source_root), key=lambda e: e.name):
+            # Don't try to process the zipped folders (or unfinished extractions)
+            if not img_folder.is_dir() or img_folder.name.endswith(".partial"):
+                continue
+            marker = read_extracted_marker(source_root, img_folder.name)
+            images_per_object = marker["images_per_object"] if marker is not None else None
+            ingested = self.sources.get(img_folder.name)
+            # (manifests from before this was recorded only have the object count, so those folders are ingested again)
+            if isinstance(ingested, dict) and extraction_covers(ingested["images_per_object"], images_per_object):
+                print(f"Already ingested: {img_folder.name}")
+                shutil.rmtree(img_folder.path, ignore_errors=True)
+                continue
+
+            print(f"Handling folder: {img_folder.name}")
+            moved = 0
+            for object_folder in sorted(os.scandir(img_folder.path), key=lambda e: e.name):
+                # Don't try to process the alignment files
+                if not object_folder.is_dir():
+                    continue
+
+                # Handle the inconsistent database file structure
+                object_id = object_folder.name
+                nested_images_dir = os.path.join(object_folder.path, "render", "images")
+                src_dir = nested_images_dir if os.path.isdir(nested_images_dir) else object_folder.path
+                pngs = [entry.path for entry in os.scandir(src_dir) if entry.name.endswith(".png")]
+                if not pngs:
+                    print(f"WARNING: No PNGs found for {object_id}")
+                    continue
+
+                # Move the images into the object's folder
+                final_dir = Path(dest_root) / object_id.split("_")[0] / object_id
+                final_dir.mkdir(parents=True, exist_ok=True)
+                for png in pngs:
+                    _move(png, final_dir / os.path.basename(png))
+
+                self._record_images(object_id, final_dir)
+                added.append(object_id)
+                moved += 1
+
+            # Delete extracted folder, and remember that it's done
+            shutil.rmtree(img_folder.path, ignore_errors=True)
+            print(f"Moved {moved} objects from {img_folder.name}")
+            self.sources[img_folder.name] = dict(objects=moved, images_per_object=images_per_object)
+            self.save()
+
+        return added
+
+    def _record_images(self, object_id: str, image_dir: Path, category: str | None = None):
+        entry = self.objects.setdefault(object_id, dict(
+            category=category or "_".join(object_id.split("_")[:-1]),
+            point_cloud=None,
+        ))
+        entry["image_dir"] = str(image_dir)
+        entry["image_dir_mtime_ns"] = os.stat(image_dir).st_mtime_ns
+        entry["images"] = _scan_images(image_dir)
+
+    def link_point_clouds(self, pointcloud_root: Path, gt_archive=None):
+        """
+        Finds the ground truth of every object that doesn't have one yet (from gt_archive's index when it has the
+        object, otherwise <pointcloud_root>/<category>/<object_id>/*.ply).
+        """
+        for object_id, entry in self.objects.items():
+            if entry["point_cloud"] is not None:
+                continue
+            if gt_archive is not None and object_id in gt_archive:
+                ply_path = gt_archive.source_path(object_id)
+            else:
+                object_dir = Path(pointcloud_root) / entry["category"] / object_id
+                if not object_dir.is_dir():
+                    print(f"WARNING: No point cloud directory for {object_id}")
+                    continue
+                ply_files = sorted(e.name for e in os.scandir(object_dir) if e.name.endswith(".ply"))
+                if not ply_files:
+                    print(f"WARNING: No .ply files for {object_id}")
+                    continue
+                ply_path = object_dir / ply_files[0]
+
+            stat = os.stat(ply_path)
+            entry.update(point_cloud=str(ply_path), point_cloud_size=stat.st_size,
+                         point_cloud_mtime_ns=stat.st_mtime_ns)
+        self.save()
+
+    def adopt(self, grouped_data: dict):
+        """Records objects from loaded relations (load_dataset_relations) that the manifest doesn't have yet"""
+        for group_name, group_objs in grouped_data.items():
+            for object_id, fields in group_objs.items():
+                if object_id in self.objects or not Path(fields["images"]).is_dir():
+                    continue
+                self._record_images(object_id, Path(fields["images"]), category=group_name)
+                stat = os.stat(fields["point_cloud"])
+                self.objects[object_id].update(point_cloud=str(fields["point_cloud"]), point_cloud_size=stat.st_size,
+                                               point_cloud_mtime_ns=stat.st_mtime_ns)
+        self.save()
+
+    def refresh(self) -> list[str]:
+        """
+        Re-lists the images of objects whose image folder changed since it was recorded (one stat per object),
+        and returns their ids.
+        """
+        changed = []
+        for object_id, entry in self.objects.items():
+            try:
+                mtime_ns = os.stat(entry["image_dir"]).st_mtime_ns
+            except FileNotFoundError:
+                if entry["images"]:
+                    entry["images"] = []
+                    changed.append(object_id)
+                continue
+            if mtime_ns != entry["image_dir_mtime_ns"]:
+                self._record_images(object_id, Path(entry["image_dir"]))
+                changed.append(object_id)
+        if changed:
+            self.save()
+        return changed
+
+    # Using
+
+    def relations(self) -> dict:
+        """The object relations ({category: {object_id: {point_cloud, images}}}, as in object_relations.json)"""
+        relations = {}
+        for object_id, entry in self.objects.items():
+            if entry["point_cloud"] is None or not entry["images"]:
+                continue
+            relations.setdefault(entry["category"], {})[object_id] = {
+                "point_cloud": entry["point_cloud"],
+                "images": entry["image_dir"],
+            }
+        return relations
+
+    def write_relations(self, output_path: Path):
+        with open(output_path, "w") as f:
+            json.dump(self.relations(), f, indent=4)
+        print(f"\nFinal dataset map saved to {output_path}")
+
+    def image_paths(self, object_id: str, images_per_object: int | None = None) -> list[Path]:
+        """The object's images in the order the pipeline takes them (sorted by name), without listing the folder"""
+        entry = self.objects[object_id]
+        images = entry["images"] if images_per_object is None else entry["images"][:images_per_object]
+        return [Path(entry["image_dir"]) / image["name"] for image in images]
+
+    def select(self, grouped_data: dict, objects_per_group: int, images_per_object: int) -> dict[str, list[str]]:
+        """The image names the pipeline will process for each object, as {object_id: [names]}"""
+        selection = {}
+        for group_objs in grouped_data.values():
+            for obj_id in list(group_objs)[:objects_per_group]:
+                if obj_id in self.objects:
+                    selection[obj_id] = [image["name"] for image in self.objects[obj_id]["images"][:images_per_object]]
+        return selection
+
+    def prune(self, selection: dict[str, list[str]]) -> int:
+        """
+        Deletes every image that isn't in selection (from select), using the manifest's listing rather than walking
+        the image tree, then removes emptied folders. Returns the number of images deleted.
+        """
+        deleted = 0
+        for object_id, entry in self.objects.items():
+            keep = set(selection.get(object_id, ()))
+            remaining = []
+            for image in entry["images"]:
+                if image["name"] in keep:
+                    remaining.append(image)
+                    continue
+                Path(entry["image_dir"], image["name"]).unlink(missing_ok=True)
+                deleted += 1
+            if len(remaining) == len(entry["images"]):
+                continue
+
+            entry["images"] = remaining
+            image_dir = Path(entry["image_dir"])
+            if not remaining:
+                # Delete empty folders after purging unused images
+                for folder in (image_dir, image_dir.parent):
+                    try:
+                        folder.rmdir()
+                    except OSError:
+                        break
+            else:
+                entry["image_dir_mtime_ns"] = os.stat(image_dir).st_mtime_ns
+        self.save()
+        return deleted
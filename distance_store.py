@@ -0,0 +1,84 @@
+from pathlib import Path
+
+import numpy as np
+
+NN_STORE_SUFFIX = ".nn.npz"
+
+
+def nn_store_path(ply_path: Path) -> Path:
+    """Path of the nearest-neighbour distance file saved next to a SPAR3D output .ply"""
+    ply_path = Path(ply_path)
+    return ply_path.with_name(ply_path.stem + NN_STORE_SUFFIX)
+
+
+def save_nn_distances(path: Path, min_ab_sq, min_ba_sq, chamfer: float, dtype=np.float32):
+    """
+    Save the directed nearest-neighbour distances (pred→gt and gt→pred) of one evaluation.
+    Inputs are the squared distances from evaluation.nearest_neighbor_distances; they are stored as plain distances
+    along with the Chamfer distance. float32 reproduces the live metrics exactly; float16 halves the size but can
+    flip points lying within rounding error of a tau.
+    """
+    # Accept torch tensors or numpy arrays
+    min_ab_sq = np.asarray(min_ab_sq.cpu() if hasattr(min_ab_sq, "cpu") else min_ab_sq, dtype=np.float32)
+    min_ba_sq = np.asarray(min_ba_sq.cpu() if hasattr(min_ba_sq, "cpu") else min_ba_sq, dtype=np.float32)
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        np.savez(
+            f,
+            pred_to_gt=np.sqrt(min_ab_sq).astype(dtype),
+            gt_to_pred=np.sqrt(min_ba_sq).astype(dtype),
+            chamfer_distance=np.float64(chamfer),
+        )
+
+
+def load_nn_distances(path: Path) -> tuple[np.ndarray, np.ndarray, float]:
+    """Load (pred→gt distances, gt→pred distances, Chamfer distance) saved by save_nn_distances"""
+    with np.load(path) as data:
+        return (
+            data["pred_to_gt"].astype(np.float32),
+            data["gt_to_pred"].astype(np.float32),
+            float(data["chamfer_distance"]),
+        )
+
+
+def metrics_from_nn_distances(d_ab: np.ndarray, d_ba: np.ndarray, chamfer: float, taus: list[float]) -> list[dict]:
+    """Chamfer distance and precision/recall/F-score for every tau, from stored nearest-neighbour distances."""
+    results = []
+    for tau in taus:
+        # (float32 throughout, matching evaluation.scores_from_sq_dists)
+        precision = np.mean(d_ab < tau, dtype=np.float32)
+        recall = np.mean(d_ba < tau, dtype=np.float32)
+        if precision + recall == 0:
+            f = np.float32(0.0)
+        else:
+            f = np.float32(2) * precision * recall / (precision + recall)
+
+        results.append({
+            "chamfer_distance": chamfer,
+            "precision": float(precision),
+            "recall": float(recall),
+            "fscore": float(f),
+            "device_used": "nn_store",
+        })
+    return results
+
+
+def evaluate_from_store(path: Path, taus: list[float]) -> list[dict]:
+    """Metrics for every tau, computed from a saved distance file without touching the point clouds."""
+    d_ab, d_ba, chamfer = load_nn_distances(path)
+    return metrics_from_nn_distances(d_ab, d_ba, chamfer, taus)
+
+
+def precision_recall_curve(path: Path, taus: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Precision and recall over a whole sweep of taus, using sorted distances and binary search."""
+    d_ab, d_ba, _ = load_nn_distances(path)
+    d_ab.sort()
+    d_ba.sort()
+
+    # Number of distances strictly below each tau
+    taus = np.asarray(taus, dtype=np.float32)
+    precision = np.searchsorted(d_ab, taus, side="left") / len(d_ab)
+    recall = np.searchsorted(d_ba, taus, side="left") / len(d_ba)
+    return precision, recall
@@ -1,8 +1,43 @@
+import hashlib
+from typing import TYPE_CHECKING
+
 import numpy as np
-from PIL import Image, ImageFilter, ImageEnhance
 
-def distort_image(img: Image.Image, blur=0, noise=0, exposure=1.0) -> Image.Image:
-    """Apply blur, noise, exposure shifts. Returns new PIL image."""
+from tracing import traced
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# PIL is imported inside the functions that use it, so importing this module (e.g. for DISTORTION_VERSION or
+# derive_seed) stays cheap
+
+# Bump whenever distort_image's output changes for the same inputs (invalidates cached reconstructions)
+DISTORTION_VERSION = 2
+
+
+def derive_seed(base_seed: int, *parts) -> int:
+    """Stable per-item seed from a base seed and identifying parts (e.g. object id, image index, distortion)"""
+    digest = hashlib.sha256(repr((base_seed, *parts)).encode()).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+def add_noise(img: "Image.Image", noise: float, seed: int | None = None) -> "Image.Image":
+    """Adds Gaussian noise (std = noise, in pixel values) in float32, using a seeded np.random.Generator."""
+    from PIL import Image
+
+    pixels = np.asarray(img, dtype=np.float32)
+    arr = np.random.default_rng(seed).standard_normal(pixels.shape, dtype=np.float32)
+    arr *= noise
+    arr += pixels
+    np.clip(arr, 0, 255, out=arr)
+    return Image.fromarray(arr.astype(np.uint8))
+
+
+@traced("blur", "noise", "exposure")
+def distort_image(img: "Image.Image", blur=0, noise=0, exposure=1.0, seed: int | None = None) -> "Image.Image":
+    """Apply blur, noise, exposure shifts. Returns new PIL image. A seed makes the noise reproducible."""
+    from PIL import ImageEnhance, ImageFilter
+
     # Apply blur
     if blur > 0:
         img = img.filter(ImageFilter.GaussianBlur(radius=blur))
@@ -11,14 +46,50 @@ def distort_image(img: Image.Image, blur=0, noise=0, exposure=1.0) -> Image.Imag
         img = ImageEnhance.Brightness(img).enhance(exposure)
     # Apply noise
     if noise > 0:
-        arr = np.array(img).astype(np.float32)
-        noise_arr = np.random.normal(0, noise, arr.shape)
-        arr = np.clip(arr + noise_arr, 0, 255).astype(np.uint8)
-        img = Image.fromarray(arr)
+        img = add_noise(img, noise, seed)
 
     return img
 
+
+@traced("levels")
+def distort_image_levels(img: "Image.Image", levels: list[dict], seeds: list[int | None] | None = None,
+                         ) -> list["Image.Image"]:
+    """
+    Apply every distortion level to one (already decoded) image. Returns one PIL image per level, each identical
+    to distort_image(img, **level, seed=seed).
+    Intermediate results are shared: each blur radius is computed once, and each (blur, exposure) pair once, no
+    matter how many noise levels use them.
+    """
+    from PIL import ImageEnhance, ImageFilter
+
+    if seeds is None:
+        seeds = [None] * len(levels)
+
+    blurred = {0: img}
+    exposed = {}
+    distorted = []
+    for level, seed in zip(levels, seeds):
+        blur, noise, exposure = level.get("blur", 0), level.get("noise", 0), level.get("exposure", 1.0)
+        blur = blur if blur > 0 else 0
+
+        # Apply blur
+        if blur not in blurred:
+            blurred[blur] = img.filter(ImageFilter.GaussianBlur(radius=blur))
+        # Apply exposure
+        if (blur, exposure) not in exposed:
+            base = blurred[blur]
+            exposed[blur, exposure] = ImageEnhance.Brightness(base).enhance(exposure) if exposure != 1.0 else base
+        # Apply noise
+        out = exposed[blur, exposure]
+        if noise > 0:
+            out = add_noise(out, noise, seed)
+
+        distorted.append(out)
+    return distorted
+
 if __name__ == "__main__":
+    from PIL import Image
+
     # Load a test image
     test_image_path = r"C:\Users\joshu\PycharmProjects\CS5404-Final-Project\stable-point-aware-3d\demo_files\examples\fish.png"  # replace with your test image path
     img = Image.open(test_image_path)
@@ -31,6 +102,5 @@ if __name__ == "__main__":
         {"blur": 0, "noise": 0, "exposure": 7.0},
     ]
 
-    for i, params in enumerate(distortions):
-        distorted = distort_image(img, **params)
+    for i, distorted in enumerate(distort_image_levels(img, distortions)):
         distorted.show(title=f"Distortion {i}")  # Show each image
\ No newline at end of file
@@ -1,41 +1,180 @@
+import json
 import os
+import shutil
 import tarfile
-
-import gdown
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path, PurePosixPath
 
 from paths import fix_path
 
+DRIVE_URL_PREFIX = "https://drive.google.com/file/d/"
+EXTRACTED_MARKER_SUFFIX = ".extracted.json"  # <archive name>.extracted.json, next to the .tar.gz
+
+
+def _archive_name(url: str) -> str:
+    """Name of a download (without .tar.gz): the start of the Drive file id, or the file name of any other URL"""
+    url = url.strip()
+    if url.startswith(DRIVE_URL_PREFIX):
+        return url.replace(DRIVE_URL_PREFIX, "")[:10]
+    name = url.rstrip("/").rsplit("/", 1)[-1]
+    return name[:-len(".tar.gz")] if name.endswith(".tar.gz") else name
+
+
+def fetch(url: str, out_path: str):
+    """Downloads one file: through gdown for Google Drive links, or a plain HTTP(S) GET otherwise"""
+    url = url.strip()
+    tmp_path = out_path + ".part"  # (so an interrupted download isn't mistaken for a finished one)
+    if url.startswith(DRIVE_URL_PREFIX):
+        import gdown
+        gdown.download(url=url, output=tmp_path, fuzzy=True)
+    else:
+        with urllib.request.urlopen(url) as response, open(tmp_path, "wb") as f:
+            shutil.copyfileobj(response, f, length=1 << 20)
+    os.replace(tmp_path, out_path)
+
+
+def read_extracted_marker(out_dir, extract_name: str) -> dict | None:
+    """
+    How an archive was last extracted ({"images_per_object": ...}, None meaning every file), or None if it wasn't.
+    The marker is kept next to the .tar.gz, since the extracted folder itself is deleted once it is ingested.
+    """
+    try:
+        with open(os.path.join(out_dir, extract_name + EXTRACTED_MARKER_SUFFIX), "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _write_extracted_marker(out_dir, extract_name: str, images_per_object: int | None):
+    marker_path = os.path.join(out_dir, extract_name + EXTRACTED_MARKER_SUFFIX)
+    with open(marker_path + ".tmp", "w") as f:
+        json.dump(dict(images_per_object=images_per_object), f)
+    os.replace(marker_path + ".tmp", marker_path)
+
+
+def extraction_covers(done: int | None, wanted: int | None) -> bool:
+    """Whether an extraction limited to `done` renders per object (None: all) has every render `wanted` needs"""
+    return done is None or (wanted is not None and done >= wanted)
+
+
+def _object_key(member_path: PurePosixPath) -> PurePosixPath:
+    """The object folder a render belongs to (renders are in <object>/ or <object>/render/images/)"""
+    folder = member_path.parent
+    if folder.name == "images" and folder.parent.name == "render":
+        return folder.parent.parent
+    return folder
 
-def download_files(urls: list[str], out_dir, unzip=False):
-    """Download selected Google Drive files to out_dir"""
+
+def extract_archive(archive_path: str, extract_dir: str, images_per_object: int | None = None) -> int:
+    """
+    Extracts a .tar.gz in one streaming pass and returns the number of bytes written.
+    With images_per_object, only the PNGs that the pipeline will use are written: the first images_per_object renders
+    (by sorted name) of each object. Members arrive in archive order, so a render that sorts before the ones kept so
+    far replaces the last of them.
+    """
+    extract_dir = Path(extract_dir)
+    root = extract_dir.resolve()
+    kept = {}  # object folder -> sorted names of the renders written so far
+    written = 0
+
+    with tarfile.open(archive_path, "r|gz") as tar:
+        for member in tar:
+            member_path = PurePosixPath(member.name)
+            target = (extract_dir / member_path).resolve()
+            if root not in target.parents:
+                print(f"WARNING: Skipping {member.name} (outside the extract directory)")
+                continue
+
+            if member.isdir():
+                if images_per_object is None:
+                    target.mkdir(parents=True, exist_ok=True)
+                continue
+            if not member.isfile():
+                continue
+
+            if images_per_object is not None:
+                if member_path.suffix != ".png":
+                    continue
+                names = kept.setdefault(_object_key(member_path), [])
+                if len(names) == images_per_object and member_path.name >= names[-1]:
+                    continue
+
+                # Keep this render (dropping the last kept one if it now sorts past the first images_per_object)
+                names.append(member_path.name)
+                names.sort()
+                if len(names) > images_per_object:
+                    dropped = target.parent / names.pop()
+                    written -= dropped.stat().st_size
+                    dropped.unlink()
+
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with tar.extractfile(member) as src, open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst, length=1 << 20)
+            written += member.size
+    return written
+
+
+def download_files(urls: list[str], out_dir, unzip=False, images_per_object: int | None = None, max_workers: int = 4):
+    """
+    Download selected Google Drive files to out_dir, max_workers at a time.
+    With unzip, each archive is extracted (streamed, see extract_archive) as soon as its download finishes, while the
+    other downloads carry on. images_per_object limits extraction to the renders the pipeline will use; an archive is
+    extracted again (from the kept .tar.gz) when images_per_object is raised past what it was extracted with.
+    Returns {archive name: bytes extracted}.
+    """
     os.makedirs(out_dir, exist_ok=True)
+    print_lock = threading.Lock()
+
+    def log(message: str):
+        with print_lock:
+            print(message)
 
-    for url in urls:
+    def download_and_extract(url: str) -> int:
         # Clean up the URL and build paths
-        extract_name = url.replace("https://drive.google.com/file/d/", "")[:10]
+        extract_name = _archive_name(url)
         fname = extract_name + ".tar.gz"
         extract_dir = fix_path(os.path.join(out_dir, extract_name))
         out_path = os.path.join(out_dir, fname)
 
         # If the file doesn't exist, download it
         if os.path.exists(out_path):
-            print(f"{fname} already exists, skipping download.")
+            log(f"{fname} already exists, skipping download.")
         else:
-            print(f"Downloading {fname} ({url})...")
-            gdown.download(url=url, output=out_path, fuzzy=True)
-
-        if unzip:
-            # Unzip the downloaded file (if it exists)
-            if os.path.exists(extract_dir):
-                print(f"Extract directory {extract_dir} already exists, skipping.")
-            else:
-                print(f"Extracting into {extract_dir}...")
-                os.makedirs(extract_dir, exist_ok=True)
-
-                try:
-                    # Extract the .tar file
-                    with tarfile.open(out_path, "r:gz") as tar:
-                        tar.extractall(path=extract_dir)
-                    print(f"Extracted {fname}")
-                except Exception as e:
-                    print(f"ERROR: Failed to extract {fname}: {e}")
+            log(f"Downloading {fname} ({url.strip()})...")
+            fetch(url, out_path)
+
+        if not unzip:
+            return 0
+
+        # Unzip the downloaded file, unless it was already extracted with at least as many renders per object
+        marker = read_extracted_marker(out_dir, extract_name)
+        if marker is not None and extraction_covers(marker["images_per_object"], images_per_object):
+            log(f"{fname} was already extracted, skipping.")
+            return 0
+        log(f"Extracting into {extract_dir}...")
+        tmp_dir = str(extract_dir) + ".partial"  # (renamed once complete, so a crash doesn't leave a half extraction)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        try:
+            written = extract_archive(out_path, tmp_dir, images_per_object)
+        except Exception as e:
+            log(f"ERROR: Failed to extract {fname}: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return 0
+        shutil.rmtree(extract_dir, ignore_errors=True)  # (an earlier extraction with fewer renders, not ingested yet)
+        os.replace(tmp_dir, extract_dir)
+        _write_extracted_marker(out_dir, extract_name, images_per_object)
+        log(f"Extracted {fname} ({written / 1024 ** 2:.1f} MB written)")
+        return written
+
+    written = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(download_and_extract, url): _archive_name(url) for url in urls}
+        for future in as_completed(futures):
+            try:
+                written[futures[future]] = future.result()
+            except Exception as e:
+                log(f"ERROR: Failed to download {futures[future]}: {e}")
+    return written
@@ -1,13 +1,16 @@
 import os
+import time
 
 import torch
 import numpy as np
 from loading_things import load_ply_pointcloud
+from tracing import traced
 
 
 def to_tensor(x: np.ndarray, device=None):
     """Converts numpy array to a torch tensor."""
-    x = torch.from_numpy(x)
+    if not isinstance(x, torch.Tensor):
+        x = torch.from_numpy(x)
     x = x.float()
     # If there's a device, convert to that device's format
     if device is not None:
@@ -15,90 +18,641 @@ def to_tensor(x: np.ndarray, device=None):
     return x
 
 
-def chamfer_distance(pcl_a: np.ndarray, pcl_b: np.ndarray, device) -> float:
-    """Calculate Chamfer Distance between two point clouds using the provided device."""
+BACKENDS = ("torch", "kdtree", "grid")
+DEFAULT_MEMORY_BUDGET_MB = 64  # Peak memory for one tile of the pairwise distance matrix
+
+
+def _tile_rows(n_cols: int, memory_budget_mb: float) -> int:
+    """Number of distance-matrix rows that fit in the memory budget."""
+    # Each row holds an (n_cols x 3) difference, its square, and n_cols distances (all float32)
+    bytes_per_row = n_cols * 4 * 7
+    return max(1, int(memory_budget_mb * 1024 ** 2) // bytes_per_row)
+
+
+def nearest_neighbor_sq_dists(pcl_a, pcl_b, device,
+                              memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    Squared nearest-neighbour distances a→b and b→a.
+    Streams row tiles of the pairwise distance matrix instead of building it in full, so peak memory is bounded
+    by memory_budget_mb regardless of the cloud sizes.
+    """
     # Convert to tensors
     pcl_a = to_tensor(pcl_a, device)
     pcl_b = to_tensor(pcl_b, device)
+    tile = _tile_rows(len(pcl_b), memory_budget_mb)
+
+    min_ab = torch.empty(len(pcl_a), device=pcl_a.device)
+    min_ba = torch.full((len(pcl_b),), float("inf"), device=pcl_b.device)
+    for start in range(0, len(pcl_a), tile):
+        # Pairwise distances for this tile of rows
+        diff = pcl_a[start:start + tile].unsqueeze(1) - pcl_b.unsqueeze(0)
+        dist = torch.sum(diff ** 2, dim=2)
+
+        # Reduce the tile: rows are final, columns keep a running minimum
+        min_ab[start:start + tile] = torch.min(dist, dim=1)[0]
+        torch.minimum(min_ba, torch.min(dist, dim=0)[0], out=min_ba)
+        del diff, dist
+
+    return min_ab, min_ba
 
-    # Compute pairwise distances
-    diff = pcl_a.unsqueeze(1) - pcl_b.unsqueeze(0)
-    dist = torch.sum(diff ** 2, dim=2)
+
+def chamfer_distance(pcl_a: np.ndarray, pcl_b: np.ndarray, device,
+                     memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB) -> float:
+    """Calculate Chamfer Distance between two point clouds using the provided device."""
+    min_ab, min_ba = nearest_neighbor_sq_dists(pcl_a, pcl_b, device, memory_budget_mb)
 
     # CD = mean(min(dist(a→b))) + mean(min(dist(b→a)))
-    cd_ab = torch.mean(torch.min(dist, dim=1)[0])
-    cd_ba = torch.mean(torch.min(dist, dim=0)[0])
+    cd_ab = torch.mean(min_ab)
+    cd_ba = torch.mean(min_ba)
 
     return float(cd_ab + cd_ba)
 
 
-def fscore(pcl_a, pcl_b, tau=0.01, device="cuda") -> tuple[float, float, float]:
-    """Computes precision, recall, and F-score between two point clouds."""
-    # Convert to tensors
-    pcl_a = to_tensor(pcl_a, device)
-    pcl_b = to_tensor(pcl_b, device)
+def kdtree_nearest_neighbor_sq_dists(pcl_a: np.ndarray, pcl_b: np.ndarray, workers: int = -1,
+                                     tree_a=None, tree_b=None) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    Squared nearest-neighbour distances a→b and b→a using a KD-tree built once per cloud (CPU only).
+    Queries are O(N log M) and run on `workers` cores (-1 uses all of them). Already-built trees can be passed in.
+    """
+    from scipy.spatial import cKDTree
+
+    pcl_a = np.ascontiguousarray(pcl_a, dtype=np.float32)
+    pcl_b = np.ascontiguousarray(pcl_b, dtype=np.float32)
+
+    # Find the nearest neighbour indices in each direction
+    tree_a = cKDTree(pcl_a) if tree_a is None else tree_a
+    tree_b = cKDTree(pcl_b) if tree_b is None else tree_b
+    _, idx_ab = tree_b.query(pcl_a, k=1, workers=workers)
+    _, idx_ba = tree_a.query(pcl_b, k=1, workers=workers)
+
+    # Recompute the distances in float32, exactly as the torch path does
+    min_ab = torch.sum((to_tensor(pcl_a) - to_tensor(pcl_b[idx_ab])) ** 2, dim=1)
+    min_ba = torch.sum((to_tensor(pcl_b) - to_tensor(pcl_a[idx_ba])) ** 2, dim=1)
+    return min_ab, min_ba
+
+
+GRID_OFFSETS = np.array([(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)])
+GRID_SHRINK = 1e-4  # A match counts only if it is this (relative) amount inside the cell size, so rounding can't flip it
+
+
+class SpatialGrid:
+    """
+    A uniform voxel grid (spatial hash) over a point cloud: points are sorted by cell, so the points of any cell are
+    one contiguous slice found by binary search. Any point within cell_size of a query lies in the 3x3x3 block of
+    cells around the query's cell.
+    """
+
+    def __init__(self, points: np.ndarray, cell_size: float):
+        self.cell_size = float(cell_size)
+        self.origin = points.min(axis=0) if len(points) else np.zeros(3, dtype=np.float32)
+
+        # Cells are shifted by 2, and the grid padded by 2 on each side, so a query's neighbouring cells never wrap
+        cells = self._cells(points)
+        self.dims = (cells.max(axis=0) if len(points) else np.zeros(3, dtype=np.int64)) + 3
+        keys = self._keys(cells)
+        order = np.argsort(keys, kind="stable")
+        self.points = np.ascontiguousarray(points[order])
+        self.order = order
+        self.offset_keys = self._keys(GRID_OFFSETS)
+
+        # The occupied cells, with where their points start and how many there are
+        self.cell_keys, self.cell_starts, self.cell_counts = np.unique(keys[order], return_index=True,
+                                                                       return_counts=True)
+
+    def _cells(self, points: np.ndarray) -> np.ndarray:
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64) + 2
+
+    def _keys(self, cells: np.ndarray) -> np.ndarray:
+        return (cells[:, 0] * self.dims[1] + cells[:, 1]) * self.dims[2] + cells[:, 2]
+
+    def candidates(self, queries: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Start and end (in self.points) of the points in each of the 27 cells around each query, as (M, 27) arrays.
+        Queries more than one cell outside the grid get empty ranges.
+        """
+        cells = self._cells(queries)
+        inside = np.all((cells >= 1) & (cells <= self.dims - 2), axis=1)
+        neighbor_keys = self._keys(np.where(inside[:, None], cells, 1))[:, None] + self.offset_keys[None, :]
+
+        # Look the cells up among the occupied ones (empty cells get empty ranges)
+        cell = np.minimum(np.searchsorted(self.cell_keys, neighbor_keys), len(self.cell_keys) - 1)
+        occupied = (self.cell_keys[cell] == neighbor_keys) & inside[:, None]
+        starts = self.cell_starts[cell]
+        ends = starts + np.where(occupied, self.cell_counts[cell], 0)
+        return starts, ends
+
+    @property
+    def nbytes(self) -> int:
+        return self.points.nbytes + self.order.nbytes + 3 * self.cell_keys.nbytes
+
 
-    diff = pcl_a.unsqueeze(1) - pcl_b.unsqueeze(0)
-    dist = torch.sqrt(torch.sum(diff ** 2, dim=2))
+GRID_POINTS_PER_CELL = 4  # Target average number of points in an occupied cell of the finest grid level
 
+
+def grid_levels(points: np.ndarray) -> list[float]:
+    """
+    Cell sizes for the multi-resolution grid over a cloud: from a size that puts about GRID_POINTS_PER_CELL points in
+    each occupied cell, doubling up to the cloud's extent. The finest size is found from the number of occupied cells
+    rather than the bounding box, since the clouds are surfaces (points per cell grow with the cell size squared).
+    """
+    if len(points) == 0:
+        return []
+    extent = float(np.max(points.max(axis=0) - points.min(axis=0)))
+    if extent == 0:
+        return [1.0]
+    cell_size = extent / np.sqrt(len(points) / GRID_POINTS_PER_CELL)
+    for _ in range(2):
+        occupied = len(np.unique(np.floor((points - points.min(axis=0)) / cell_size).astype(np.int64), axis=0))
+        cell_size *= np.sqrt(GRID_POINTS_PER_CELL / (len(points) / occupied))
+    cell_size = max(float(cell_size), extent * 1e-4)
+    levels = [cell_size]
+    while levels[-1] < extent:
+        levels.append(levels[-1] * 2)
+    return levels
+
+
+def _grid_nearest(queries: np.ndarray, grid: SpatialGrid, memory_budget_mb: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Nearest point of the grid (index into the grid's cloud) and its squared distance for every query, searching only
+    the 27 cells around it. Queries with nothing in those cells get index -1 and an infinite distance.
+    """
+    starts, ends = grid.candidates(queries)
+    counts = ends - starts
+    per_query = counts.sum(axis=1)
+
+    nearest = np.full(len(queries), -1, dtype=np.int64)
+    best_sq = np.full(len(queries), np.inf, dtype=np.float32)
+
+    # Chunks of queries whose candidate pairs fit in the memory budget (about 64 bytes per pair)
+    max_pairs = max(1, int(memory_budget_mb * 1024 ** 2) // 64)
+    cumulative = np.cumsum(per_query)
+    chunk_start = 0
+    while chunk_start < len(queries):
+        done_before = cumulative[chunk_start - 1] if chunk_start > 0 else 0
+        chunk_end = max(chunk_start + 1, int(np.searchsorted(cumulative, done_before + max_pairs, side="right")))
+        chunk = slice(chunk_start, chunk_end)
+        chunk_start = chunk_end
+
+        chunk_counts = counts[chunk].ravel()
+        total = int(chunk_counts.sum())
+        if total == 0:
+            continue
+
+        # Every (query, candidate) pair of the chunk, grouped by query
+        query_idx = np.repeat(np.arange(chunk.start, chunk.stop), per_query[chunk])
+        run_starts = np.cumsum(chunk_counts) - chunk_counts
+        candidate_idx = np.repeat(starts[chunk].ravel() - run_starts, chunk_counts) + np.arange(total)
+
+        # Squared distances in float32, summed in the same order as the torch path
+        diff = queries[query_idx] - grid.points[candidate_idx]
+        sq = (diff ** 2).sum(axis=1, dtype=np.float32)
+
+        # Minimum per query (the first candidate at the minimum, if there are ties)
+        has_pairs = per_query[chunk] > 0
+        seg_starts = np.cumsum(per_query[chunk]) - per_query[chunk]
+        chunk_queries = np.arange(chunk.start, chunk.stop)[has_pairs]
+        seg_min = np.minimum.reduceat(sq, seg_starts[has_pairs])
+        best_sq[chunk_queries] = seg_min
+        at_min = np.flatnonzero(sq == best_sq[query_idx])
+        first = at_min[np.r_[True, query_idx[at_min[1:]] != query_idx[at_min[:-1]]]]
+        nearest[query_idx[first]] = grid.order[candidate_idx[first]]
+
+    return nearest, best_sq
+
+
+def grid_nearest_neighbor_indices(queries: np.ndarray, targets: np.ndarray, grids=None,
+                                  memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB) -> np.ndarray:
+    """
+    Index of the nearest target of every query, using a multi-resolution grid over the targets: a query is resolved
+    at the first level where the closest point in its 27 cells is within the cell size (it is then the true nearest
+    neighbour), and the rest move on to the next, coarser level. Queries left over after the coarsest level (far
+    outside the targets) are brute-forced. grids is the list of SpatialGrids to use (one per level), if already built.
+    """
+    if grids is None:
+        grids = [SpatialGrid(targets, cell_size) for cell_size in grid_levels(targets)]
+
+    nearest = np.full(len(queries), -1, dtype=np.int64)
+    pending = np.arange(len(queries))
+    for grid in grids:
+        if len(pending) == 0:
+            break
+        found, found_sq = _grid_nearest(queries[pending], grid, memory_budget_mb)
+        resolved = found_sq <= np.float32((grid.cell_size * (1 - GRID_SHRINK)) ** 2)
+        nearest[pending[resolved]] = found[resolved]
+        pending = pending[~resolved]
+
+    if len(pending) and len(targets):
+        # Brute force (in float32 like the torch path) for whatever the grid levels didn't resolve
+        for start in range(0, len(pending), 1024):
+            rows = pending[start:start + 1024]
+            sq = ((queries[rows, None, :] - targets[None, :, :]) ** 2).sum(axis=2, dtype=np.float32)
+            nearest[rows] = np.argmin(sq, axis=1)
+    return nearest
+
+
+def grid_nearest_neighbor_sq_dists(pcl_a: np.ndarray, pcl_b: np.ndarray, grids_a=None, grids_b=None,
+                                   memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB,
+                                   ) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    Squared nearest-neighbour distances a→b and b→a using a uniform-grid spatial hash (CPU only, near-linear time
+    for point clouds that are spread out like surfaces). The nearest neighbours are exact, so the distances (and
+    every metric derived from them) are the same as the dense computation. Already-built grids can be passed in.
+    """
+    pcl_a = np.ascontiguousarray(pcl_a, dtype=np.float32)
+    pcl_b = np.ascontiguousarray(pcl_b, dtype=np.float32)
+    idx_ab = grid_nearest_neighbor_indices(pcl_a, pcl_b, grids_b, memory_budget_mb)
+    idx_ba = grid_nearest_neighbor_indices(pcl_b, pcl_a, grids_a, memory_budget_mb)
+
+    # Recompute the distances in float32, exactly as the torch path does
+    min_ab = torch.sum((to_tensor(pcl_a) - to_tensor(pcl_b[idx_ab])) ** 2, dim=1)
+    min_ba = torch.sum((to_tensor(pcl_b) - to_tensor(pcl_a[idx_ba])) ** 2, dim=1)
+    return min_ab, min_ba
+
+
+def scores_from_sq_dists(min_ab: torch.Tensor, min_ba: torch.Tensor, tau: float) -> tuple[float, float, float]:
+    """Precision, recall, and F-score from the squared nearest-neighbour distances in each direction."""
     # Precision: fraction of predicted points close to GT
-    precision = (torch.min(dist, dim=1)[0] < tau).float().mean()
+    precision = (torch.sqrt(min_ab) < tau).float().mean()
 
     # Recall: fraction of GT points close to predicted
-    recall = (torch.min(dist, dim=0)[0] < tau).float().mean()
+    recall = (torch.sqrt(min_ba) < tau).float().mean()
 
     if precision + recall == 0:
-        f = torch.tensor(0.0, device=device)
+        f = torch.tensor(0.0, device=precision.device)
     else:
         f = 2 * precision * recall / (precision + recall)
 
     return precision.item(), recall.item(), f.item()
 
 
+def fscore(pcl_a, pcl_b, tau=0.01, device="cuda",
+           memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB) -> tuple[float, float, float]:
+    """Computes precision, recall, and F-score between two point clouds."""
+    min_ab, min_ba = nearest_neighbor_sq_dists(pcl_a, pcl_b, device, memory_budget_mb)
+    return scores_from_sq_dists(min_ab, min_ba, tau)
+
+
 def normalize_points(pts: np.ndarray) -> np.ndarray:
     """Normalize points from a point cloud (for consistent positioning)."""
-    pts = pts - pts.mean(axis=0)   # center at origin
+    # (each coordinate's mean is taken over its column on its own, so numpy sums it pairwise whatever the layout: a
+    # mean along axis 0 of a C-ordered (N, 3) float32 array accumulates row by row and drifts in the last digits)
+    mean = np.array([pts[:, axis].mean() for axis in range(pts.shape[1])], dtype=pts.dtype)
+    pts = pts - mean   # center at origin
     scale = np.max(np.linalg.norm(pts, axis=1))
     pts = pts / scale
     return pts
 
-def evaluate_pointcloud(pred_pts: np.ndarray, gt_pts: np.ndarray, tau=0.01) -> dict:
-    """Main evaluation function; calculates metrics between pred_pts and gt_pts."""
-    device = "cuda" if torch.cuda.is_available() else "cpu"
 
-    # Normalize point clouds to match the coordinates
-    pred_pts, gt_pts = normalize_points(pred_pts), normalize_points(gt_pts)
+class PreparedCloud:
+    """
+    A normalized point cloud that keeps its device tensors, KD-tree, and spatial grids once they are built.
+    Used to prepare a ground truth once and reuse it for every distortion and tau (see gt_cache).
+    """
+
+    def __init__(self, points: np.ndarray, normalize: bool = True):
+        self.points = np.ascontiguousarray(normalize_points(points) if normalize else points, dtype=np.float32)
+        self._tensors = {}
+        self._kdtree = None
+        self._grids = None
+        self._samples = {}
+
+    def __len__(self):
+        return len(self.points)
+
+    def tensor(self, device) -> torch.Tensor:
+        """The points as a float32 tensor on the given device (uploaded once per device)."""
+        key = str(device)
+        if key not in self._tensors:
+            self._tensors[key] = to_tensor(self.points, device)
+        return self._tensors[key]
+
+    def kdtree(self):
+        """A scipy KD-tree over the points (built once)."""
+        if self._kdtree is None:
+            from scipy.spatial import cKDTree
+            self._kdtree = cKDTree(self.points)
+        return self._kdtree
+
+    def grids(self) -> list[SpatialGrid]:
+        """The multi-resolution spatial grids over the points (built once, see grid_levels)."""
+        if self._grids is None:
+            self._grids = [SpatialGrid(self.points, cell_size) for cell_size in grid_levels(self.points)]
+        return self._grids
 
+    def sample(self, size: int, method: str | None = None, seed: int = 0) -> np.ndarray:
+        """
+        Indices of a downsampled subset of the points (picked once per size and method, see approximate.py; the
+        method defaults to approximate.DEFAULT_APPROXIMATE's).
+        """
+        if method is None:
+            from approximate import DEFAULT_APPROXIMATE
+            method = DEFAULT_APPROXIMATE["method"]
+        key = (size, method, seed)
+        if key not in self._samples:
+            from approximate import sample_indices
+            self._samples[key] = sample_indices(self.points, size, method, seed)
+        return self._samples[key]
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the points, tensors, KD-tree, and grids."""
+        total = self.points.nbytes
+        total += sum(t.element_size() * t.nelement() for t in self._tensors.values())
+        if self._kdtree is not None:
+            # The tree keeps a float64 copy of the points plus an index per point (and some node overhead)
+            total += len(self.points) * (3 * 8 + 8 + 16)
+        if self._grids is not None:
+            total += sum(grid.nbytes for grid in self._grids)
+        total += sum(indices.nbytes for indices in self._samples.values())
+        return total
+
+def nearest_neighbor_distances(pred_pts: np.ndarray | PreparedCloud, gt_pts: np.ndarray | PreparedCloud,
+                               backend: str = "torch", memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB,
+                               ) -> tuple[torch.Tensor, torch.Tensor, str]:
+    """
+    Squared nearest-neighbour distances pred→gt and gt→pred with the chosen backend.
+    Plain arrays must already be normalized; PreparedClouds reuse their cached tensors and KD-trees.
+    Returns both distance vectors and the device they were computed on.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown evaluation backend '{backend}', expected one of {BACKENDS}")
+
+    pred = pred_pts if isinstance(pred_pts, PreparedCloud) else PreparedCloud(pred_pts, normalize=False)
+    gt = gt_pts if isinstance(gt_pts, PreparedCloud) else PreparedCloud(gt_pts, normalize=False)
+
+    if backend == "kdtree":
+        min_ab, min_ba = kdtree_nearest_neighbor_sq_dists(pred.points, gt.points,
+                                                          tree_a=pred.kdtree(), tree_b=gt.kdtree())
+        return min_ab, min_ba, "cpu"
+    if backend == "grid":
+        min_ab, min_ba = grid_nearest_neighbor_sq_dists(pred.points, gt.points, grids_a=pred.grids(),
+                                                        grids_b=gt.grids(), memory_budget_mb=memory_budget_mb)
+        return min_ab, min_ba, "cpu"
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
     try:
-        # Calculate metrics
-        cd = chamfer_distance(pred_pts, gt_pts, device=device)
-        prec, rec, f = fscore(pred_pts, gt_pts, tau=tau, device=device)
-        return {
-            "chamfer_distance": float(cd),
-            "precision": prec,
-            "recall": rec,
-            "fscore": f,
-            "device_used": device,
-        }
+        min_ab, min_ba = nearest_neighbor_sq_dists(pred.tensor(device), gt.tensor(device), device, memory_budget_mb)
+    except RuntimeError:
+        # Fallback to CPU if something goes wrong
+        print("WARNING: Evaluation failed, falling back to CPU")
+        device = "cpu"
+        min_ab, min_ba = nearest_neighbor_sq_dists(pred.tensor(device), gt.tensor(device), device, memory_budget_mb)
+    return min_ab, min_ba, device
 
+
+def directed_nearest_neighbor_distances(queries: PreparedCloud, targets: PreparedCloud, backend: str = "torch",
+                                        memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB,
+                                        ) -> tuple[torch.Tensor, str]:
+    """
+    Squared nearest-neighbour distances queries→targets only (e.g. a small sample against a whole cloud, where the
+    other direction isn't needed). The distances are the same as the matching direction of nearest_neighbor_distances.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown evaluation backend '{backend}', expected one of {BACKENDS}")
+
+    if backend in ("kdtree", "grid"):
+        if backend == "kdtree":
+            _, idx = targets.kdtree().query(queries.points, k=1, workers=-1)
+        else:
+            idx = grid_nearest_neighbor_indices(queries.points, targets.points, targets.grids(), memory_budget_mb)
+        # Recompute the distances in float32, exactly as the torch path does
+        return torch.sum((to_tensor(queries.points) - to_tensor(targets.points[idx])) ** 2, dim=1), "cpu"
+
+    def run(device):
+        pcl_a, pcl_b = queries.tensor(device), targets.tensor(device)
+        tile = _tile_rows(len(pcl_b), memory_budget_mb)
+        min_ab = torch.empty(len(pcl_a), device=pcl_a.device)
+        for start in range(0, len(pcl_a), tile):
+            diff = pcl_a[start:start + tile].unsqueeze(1) - pcl_b.unsqueeze(0)
+            min_ab[start:start + tile] = torch.min(torch.sum(diff ** 2, dim=2), dim=1)[0]
+            del diff
+        return min_ab
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    try:
+        return run(device), device
     except RuntimeError:
         # Fallback to CPU if something goes wrong
         print("WARNING: Evaluation failed, falling back to CPU")
+        return run("cpu"), "cpu"
 
-        # Re-calculate metrics
-        device = "cpu"
-        cd = chamfer_distance(pred_pts, gt_pts, device=device)
-        prec, rec, f = fscore(pred_pts, gt_pts, tau=tau, device=device)
 
-        return {
-            "chamfer_distance": float(cd),
+def metrics_from_sq_dists(min_ab: torch.Tensor, min_ba: torch.Tensor, taus: list[float], device: str) -> list[dict]:
+    """Derives Chamfer distance and precision/recall/F-score for every tau from one nearest-neighbour pass."""
+    # CD = mean(min(dist(a→b))) + mean(min(dist(b→a))), the same for every tau
+    cd = float(torch.mean(min_ab) + torch.mean(min_ba))
+
+    results = []
+    for tau in taus:
+        prec, rec, f = scores_from_sq_dists(min_ab, min_ba, tau)
+        results.append({
+            "chamfer_distance": cd,
             "precision": prec,
             "recall": rec,
             "fscore": f,
             "device_used": device,
+        })
+    return results
+
+
+@traced("taus", "backend")
+def evaluate_pointcloud_multi(pred_pts: np.ndarray | PreparedCloud, gt_pts: np.ndarray | PreparedCloud,
+                              taus: list[float], backend: str = "torch",
+                              memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB, nn_store_path=None,
+                              approximate: int | dict | None = None) -> list[dict]:
+    """
+    Calculates metrics between pred_pts and gt_pts for several taus at once.
+    The clouds are normalized and the nearest-neighbour distances computed only once; returns one metrics dict
+    per tau, in the same order as taus. If nn_store_path is given, the distances are also saved there so later
+    tau sweeps can skip the point clouds entirely (see distance_store).
+    Either cloud may be a PreparedCloud (already normalized, e.g. a cached ground truth).
+    approximate estimates the metrics from a downsampled subset of each cloud instead, with an error estimate next to
+    each one: a sample size, or a dict of approximate.DEFAULT_APPROXIMATE settings (size, method "fps"/"voxel"/
+    "random", bootstrap rounds, seed). Approximate distances are never saved to nn_store_path.
+    """
+    # Normalize point clouds to match the coordinates
+    if not isinstance(pred_pts, PreparedCloud):
+        pred_pts = PreparedCloud(pred_pts)
+    if not isinstance(gt_pts, PreparedCloud):
+        gt_pts = PreparedCloud(gt_pts)
+
+    if approximate is not None:
+        from approximate import approximate_metrics, approximate_settings
+        return approximate_metrics(pred_pts, gt_pts, taus, backend, memory_budget_mb=memory_budget_mb,
+                                   **approximate_settings(approximate))
+
+    min_ab, min_ba, device = nearest_neighbor_distances(pred_pts, gt_pts, backend, memory_budget_mb)
+    if nn_store_path is not None:
+        from distance_store import save_nn_distances
+        save_nn_distances(nn_store_path, min_ab, min_ba, chamfer=float(torch.mean(min_ab) + torch.mean(min_ba)))
+    return metrics_from_sq_dists(min_ab, min_ba, taus, device)
+
+
+@traced("tau", "backend")
+def evaluate_pointcloud(pred_pts: np.ndarray | PreparedCloud, gt_pts: np.ndarray | PreparedCloud, tau=0.01,
+                        backend: str = "torch", memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB,
+                        approximate: int | dict | None = None) -> dict:
+    """
+    Main evaluation function; calculates metrics between pred_pts and gt_pts.
+    backend is "torch" (tiled brute force, GPU if available), "kdtree" (scipy KD-tree on all CPU cores), or "grid"
+    (uniform-grid spatial hash on the CPU, no scipy needed).
+    approximate (e.g. 1024) estimates the metrics from that many sampled points of each cloud, with error estimates
+    (see evaluate_pointcloud_multi).
+    """
+    return evaluate_pointcloud_multi(pred_pts, gt_pts, [tau], backend, memory_budget_mb, approximate=approximate)[0]
+
+
+DISTANCE_DTYPES = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+
+
+def batched_nearest_neighbor_sq_dists(preds: torch.Tensor, mask: torch.Tensor, gt: torch.Tensor,
+                                      distance_dtype: str = "fp32",
+                                      memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB,
+                                      ) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    Squared nearest-neighbour distances of a batch of padded clouds (B, N, 3) against one cloud gt (M, 3), in both
+    directions: (B, N) pred→gt (padding rows are left at inf) and (B, M) gt→pred (padding never matches).
+    Row tiles of all B distance matrices are computed together, within memory_budget_mb. With distance_dtype "fp16"
+    or "bf16", coordinate differences and squares are computed at that precision and summed in float32.
+    """
+    dtype = DISTANCE_DTYPES[distance_dtype]
+    preds, gt = preds.to(dtype), gt.to(dtype)
+    batch, n_rows, n_cols = preds.shape[0], preds.shape[1], gt.shape[0]
+
+    # Each row of a tile holds an (M x 3) difference and its square at the distance precision, plus M float32 distances
+    bytes_per_row = batch * n_cols * (3 * 2 * preds.element_size() + 4)
+    tile = max(1, int(memory_budget_mb * 1024 ** 2) // bytes_per_row)
+
+    min_ab = torch.full((batch, n_rows), float("inf"), device=preds.device)
+    min_ba = torch.full((batch, n_cols), float("inf"), device=preds.device)
+    for start in range(0, n_rows, tile):
+        diff = preds[:, start:start + tile].unsqueeze(2) - gt.view(1, 1, n_cols, 3)
+        if dtype == torch.float32:
+            dist = torch.sum(diff ** 2, dim=3)  # (the same arithmetic as nearest_neighbor_sq_dists)
+        else:
+            dist = torch.sum(diff * diff, dim=3, dtype=torch.float32)
+        dist.masked_fill_(~mask[:, start:start + tile].unsqueeze(2), float("inf"))
+
+        min_ab[:, start:start + tile] = torch.min(dist, dim=2)[0]
+        torch.minimum(min_ba, torch.min(dist, dim=1)[0], out=min_ba)
+        del diff, dist
+
+    min_ab.masked_fill_(~mask, float("inf"))
+    return min_ab, min_ba
+
+
+@traced("taus", "distance_dtype")
+def evaluate_pointclouds_batched(preds: list[np.ndarray | PreparedCloud], gt_pts: np.ndarray | PreparedCloud,
+                                 taus: list[float], distance_dtype: str = "fp32",
+                                 memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB,
+                                 nn_store_paths: list | None = None) -> list[list[dict]]:
+    """
+    Evaluates many predicted clouds (of any sizes) against one ground truth in a single batched pass, e.g. every
+    distortion of an object. The clouds are padded to the largest one and masked, and all metrics are gathered on
+    the device and copied back together, so there is one host sync per batch instead of several per cloud.
+    Returns one list of metrics dicts per cloud (one per tau, as from evaluate_pointcloud_multi). In "fp32" the
+    metrics are the same as the torch backend's; "fp16"/"bf16" compute the distances at reduced precision (see
+    batched_nearest_neighbor_sq_dists, and compare_distance_dtypes for how far the metrics move).
+    nn_store_paths (one per cloud) saves each cloud's distances, as nn_store_path does in evaluate_pointcloud_multi.
+    """
+    if distance_dtype not in DISTANCE_DTYPES:
+        raise ValueError(f"Unknown distance dtype '{distance_dtype}', expected one of {tuple(DISTANCE_DTYPES)}")
+    if not preds:
+        return []
+    preds = [pred if isinstance(pred, PreparedCloud) else PreparedCloud(pred) for pred in preds]
+    if not isinstance(gt_pts, PreparedCloud):
+        gt_pts = PreparedCloud(gt_pts)
+
+    def run(device):
+        # Pad the clouds into one (B, N, 3) tensor, with a mask of the real points
+        sizes = torch.tensor([len(pred) for pred in preds], device=device)
+        padded = torch.zeros((len(preds), int(sizes.max()), 3), device=device)
+        for b, pred in enumerate(preds):
+            padded[b, :len(pred)] = pred.tensor(device)
+        mask = torch.arange(padded.shape[1], device=device).unsqueeze(0) < sizes.unsqueeze(1)
+
+        min_ab, min_ba = batched_nearest_neighbor_sq_dists(padded, mask, gt_pts.tensor(device), distance_dtype,
+                                                           memory_budget_mb)
+
+        # Every metric stays on the device until the end (torch.mean over each cloud's own points, like the torch
+        # backend, so fp32 Chamfer distances come out identical)
+        cd = torch.stack([torch.mean(min_ab[b, :len(pred)]) + torch.mean(min_ba[b]) for b, pred in enumerate(preds)])
+        taus_t = torch.tensor(taus, device=device, dtype=torch.float32).view(1, -1, 1)
+        n_pred = sizes.to(torch.float32).unsqueeze(1)
+        precision = (torch.sqrt(min_ab).unsqueeze(1) < taus_t).sum(dim=2, dtype=torch.float32) / n_pred
+        recall = (torch.sqrt(min_ba).unsqueeze(1) < taus_t).float().mean(dim=2)
+        total = precision + recall
+        f = torch.where(total == 0, torch.zeros_like(total), 2 * precision * recall / total)
+        table = torch.stack([cd.unsqueeze(1).expand_as(f), precision, recall, f], dim=2).cpu()  # (the one sync)
+        if nn_store_paths is None:
+            return table, None
+        return table, (min_ab.cpu(), min_ba.cpu(), cd.cpu())
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    try:
+        table, distances = run(device)
+    except RuntimeError:
+        # Fallback to CPU if something goes wrong
+        print("WARNING: Batched evaluation failed, falling back to CPU")
+        device = "cpu"
+        table, distances = run(device)
+
+    if distances is not None:
+        from distance_store import save_nn_distances
+        min_ab, min_ba, cd = distances
+        for b, (pred, path) in enumerate(zip(preds, nn_store_paths)):
+            save_nn_distances(path, min_ab[b, :len(pred)], min_ba[b], chamfer=float(cd[b]))
+
+    results = []
+    for b in range(len(preds)):
+        pred_results = []
+        for t in range(len(taus)):
+            cd, prec, rec, f = table[b, t].tolist()
+            metrics = dict(chamfer_distance=cd, precision=prec, recall=rec, fscore=f, device_used=device)
+            if distance_dtype != "fp32":
+                metrics["distance_dtype"] = distance_dtype
+            pred_results.append(metrics)
+        results.append(pred_results)
+    return results
+
+
+def compare_distance_dtypes(preds: list[np.ndarray], gt_pts: np.ndarray, taus: list[float]) -> dict:
+    """
+    Times the batched evaluation at each distance precision and prints (and returns) the largest difference from
+    fp32 in each metric.
+    """
+    differences = {}
+    for distance_dtype in DISTANCE_DTYPES:
+        start_time = time.perf_counter()
+        results = evaluate_pointclouds_batched(preds, gt_pts, taus, distance_dtype=distance_dtype)
+        elapsed = time.perf_counter() - start_time
+
+        if distance_dtype == "fp32":
+            reference = results
+        differences[distance_dtype] = {
+            key: max(abs(r[key] - ref[key]) for rs, refs in zip(results, reference) for r, ref in zip(rs, refs))
+            for key in ("chamfer_distance", "precision", "recall", "fscore")
         }
+        print(f"Distances in {distance_dtype}: {elapsed:.3f} seconds for {len(preds)} clouds, "
+              f"max diff vs fp32: {differences[distance_dtype]}")
+    return differences
 
 
+def compare_backends(pred_pts: np.ndarray, gt_pts: np.ndarray, taus: list[float]) -> None:
+    """Times every backend against the torch path and prints the largest difference in each metric."""
+    for backend in BACKENDS:
+        start_time = time.perf_counter()
+        results = evaluate_pointcloud_multi(pred_pts, gt_pts, taus, backend=backend)
+        elapsed = time.perf_counter() - start_time
+
+        if backend == "torch":
+            reference = results
+        max_diff = {
+            key: max(abs(r[key] - ref[key]) for r, ref in zip(results, reference))
+            for key in ("chamfer_distance", "precision", "recall", "fscore")
+        }
+        print(f"Backend {backend}: {elapsed:.3f} seconds for {len(taus)} taus, max diff vs torch: {max_diff}")
+
 
 if __name__ == "__main__":
     TESTING_FOLDER = os.path.join(os.getcwd(), "examples_for_testing\\")
@@ -117,4 +671,12 @@ if __name__ == "__main__":
         results = evaluate_pointcloud(pred, gt, tau)
         print(f"Results (tau = {tau}): {results}")
 
+    # Check the other backends against the torch path
+    compare_backends(pred, gt, taus_to_test)
+
+    # Check reduced-precision distances (batched, against a few perturbed copies of the reconstruction)
+    rng = np.random.default_rng(0)
+    noisy_preds = [pred + rng.normal(scale=scale, size=pred.shape).astype(np.float32) for scale in (0, 0.01, 0.05)]
+    compare_distance_dtypes(noisy_preds, gt, taus_to_test)
+
     
\ No newline at end of file
@@ -0,0 +1,164 @@
+import argparse
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from recon_cache import unit_id
+from results_store import ResultsStore, is_results_store, open_results
+
+# A sweep is planned as work units (one object image at one distortion level). Units are sharded by object, so an
+# object's images and distortions stay together (one GT load, one decode per image, batched reconstruction)
+
+
+@dataclass(frozen=True)
+class WorkUnit:
+    category: str
+    object_id: str
+    image_idx: int
+    distortion: dict
+
+    @property
+    def unit(self) -> str:
+        return unit_id(self.object_id, self.image_idx, self.distortion)
+
+
+def plan_experiment(grouped_data: dict, distortion_levels: list[dict], objects_per_group: int,
+                    images_per_object: int) -> list[WorkUnit]:
+    """Expands the sweep into its work units, in the order main.py runs them"""
+    units = []
+    for group_name, group_objs in grouped_data.items():
+        for obj_id, fields in list(group_objs.items())[:objects_per_group]:
+            images = sorted(list(Path(fields["images"]).glob("*.png")))[:images_per_object]
+            for i in range(len(images)):
+                for distortion in distortion_levels:
+                    units.append(WorkUnit(group_name, obj_id, i, dict(distortion)))
+    return units
+
+
+def _stable_hash(*parts) -> int:
+    return int.from_bytes(hashlib.sha256("/".join(map(str, parts)).encode()).digest()[:8], "big")
+
+
+def shard_of(category: str, object_id: str, shard_count: int) -> int:
+    """
+    The shard an object belongs to, by rendezvous hashing: each shard scores the object and the highest score wins.
+    The result depends only on the object and shard_count (not on what else is in the sweep), so adding objects
+    never moves finished ones, and going from n to n+1 shards only moves about 1/(n+1) of them.
+    """
+    return max(range(shard_count), key=lambda shard: _stable_hash(category, object_id, shard))
+
+
+def shard_grouped_data(grouped_data: dict, objects_per_group: int, shard_index: int, shard_count: int) -> dict:
+    """The part of the sweep (grouped_data limited to objects_per_group per group) that belongs to one shard"""
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Shard index {shard_index} is out of range for {shard_count} shards")
+    return {
+        group_name: {
+            obj_id: fields for obj_id, fields in list(group_objs.items())[:objects_per_group]
+            if shard_of(group_name, obj_id, shard_count) == shard_index
+        }
+        for group_name, group_objs in grouped_data.items()
+    }
+
+
+def save_plan(units: list[WorkUnit], path: Path, shard_count: int = 1):
+    """Saves the planned units (and their shards) for merge_results to check against"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(dict(
+            shard_count=shard_count,
+            units=[
+                dict(unit=u.unit, shard=shard_of(u.category, u.object_id, shard_count), **asdict(u))
+                for u in units
+            ],
+        ), f, indent=2)
+
+
+def load_plan(path: Path) -> list[WorkUnit]:
+    with open(path, "r") as f:
+        plan = json.load(f)
+    return [WorkUnit(u["category"], u["object_id"], u["image_idx"], u["distortion"]) for u in plan["units"]]
+
+
+def _remove_store(path: Path):
+    """Deletes a SQLite results store along with its -wal and -shm files"""
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{path}{suffix}").unlink(missing_ok=True)
+
+
+def merge_results(result_paths: list[Path], output_path: Path, plan_path: Path | None = None) -> dict:
+    """
+    Combines per-shard results (JSONs or results stores) into one results file (a store if output_path is
+    .sqlite/.db, otherwise a JSON), and reports units that are missing (planned but in no shard), duplicated (in more
+    than one place; the first one is kept), or unexpected (not in the plan).
+    With a plan, records are written in plan order; without one, in the order the inputs list them.
+    """
+    # Collect every record, by unit
+    found = {}
+    duplicates = []
+    categories = {}  # (in the order they were first seen, including ones without any results)
+    for path in result_paths:
+        with open_results(path) as results:
+            categories.update(dict.fromkeys(results.categories()))
+            for record in results.distortions():
+                record["evaluations"] = results.evaluations(record.pop("id"))
+                unit = unit_id(record["object_id"], record["image_idx"], record["distortion"])
+                if unit in found:
+                    duplicates.append((unit, str(path)))
+                    continue
+                found[unit] = record
+
+    # Decide the order of the merged records
+    planned = [u.unit for u in load_plan(plan_path)] if plan_path is not None else []
+    planned_set = set(planned)
+    missing = [unit for unit in planned if unit not in found]
+    unexpected = [unit for unit in found if plan_path is not None and unit not in planned_set]
+    order = [unit for unit in planned if unit in found] + [unit for unit in found if unit not in planned_set]
+
+    # Write the merged results (positions count up within each image, in merge order). A store is built aside and
+    # moved into place, so no -wal/-shm left over from an earlier, interrupted merge is applied to it
+    output_path = Path(output_path)
+    store_path = output_path.with_name(output_path.stem + ".merging" + output_path.suffix)
+    if is_results_store(output_path):
+        _remove_store(store_path)
+    with ResultsStore(store_path if is_results_store(output_path) else ":memory:") as merged:
+        for category in categories:
+            merged.add_category(category)
+        positions = {}
+        for unit in order:
+            record = dict(found[unit])
+            category, object_id = record.pop("category"), record.pop("object_id")
+            image_idx, original_image = record.pop("image_idx"), record.pop("original_image")
+            position = positions.get((category, object_id, image_idx), 0)
+            positions[(category, object_id, image_idx)] = position + 1
+            merged.add_record(category, object_id, image_idx, original_image, record, position)
+        if not is_results_store(output_path):
+            merged.export_json(output_path)
+    if is_results_store(output_path):
+        _remove_store(output_path)
+        os.replace(store_path, output_path)
+
+    report = dict(merged=len(order), missing=missing, duplicates=duplicates, unexpected=unexpected)
+    print(f"Merged {len(order)} units from {len(result_paths)} files → {output_path}")
+    for unit in missing:
+        print(f"WARNING: Missing unit {unit}")
+    for unit, path in duplicates:
+        print(f"WARNING: Duplicate unit {unit} in {path} (kept the first)")
+    for unit in unexpected:
+        print(f"WARNING: Unit {unit} is not in the plan")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge per-shard pipeline results into one results file")
+    parser.add_argument("results", nargs="+", type=Path, help="Per-shard results (.json or .sqlite)")
+    parser.add_argument("--output", "-o", type=Path, required=True, help="Merged results (.json or .sqlite)")
+    parser.add_argument("--plan", type=Path, help="Plan saved by main.py, to check for missing units")
+    args = parser.parse_args()
+
+    report = merge_results(args.results, args.output, args.plan)
+    if report["missing"] or report["duplicates"]:
+        raise SystemExit(1)
@@ -0,0 +1,156 @@
+import json
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from loading_things import load_ply_pointcloud, ply_vertex_count
+
+# An archive is two files: <name>.npy holds every ground truth (normalized, float32) stacked into one (N, 3) array,
+# and <name>.json maps each object id to its rows
+ARCHIVE_VERSION = 2  # (2: each entry records its source PLY's size and mtime)
+
+if TYPE_CHECKING:
+    from evaluation import PreparedCloud
+
+
+def _archive_paths(archive_path: Path) -> tuple[Path, Path]:
+    archive_path = Path(archive_path)
+    return archive_path.with_suffix(".npy"), archive_path.with_suffix(".json")
+
+
+def find_gt_pointclouds(pointcloud_root: Path) -> dict[str, tuple[str, Path]]:
+    """Finds the ground truth of every object under <pointcloud_root>/<category>/<object_id>/*.ply"""
+    found = {}
+    for category_entry in sorted(os.scandir(pointcloud_root), key=lambda e: e.name):
+        if not category_entry.is_dir():
+            continue
+        for object_entry in sorted(os.scandir(category_entry.path), key=lambda e: e.name):
+            if not object_entry.is_dir():
+                continue
+            ply_files = sorted(e.name for e in os.scandir(object_entry.path) if e.name.endswith(".ply"))
+            if not ply_files:
+                print(f"WARNING: No .ply files for {object_entry.name}")
+                continue
+            found[object_entry.name] = (category_entry.name, Path(object_entry.path) / ply_files[0])
+    return found
+
+
+def build_gt_archive(pointcloud_root: Path, archive_path: Path) -> "GroundTruthArchive":
+    """
+    One-time build step: packs every ground truth under pointcloud_root into one archive, normalized the same way
+    as evaluation.normalize_points (so they can be used without any parsing or preparing). Each entry records the
+    size and mtime of its PLY, so a ground truth that changes later is read from its PLY again.
+    """
+    from evaluation import normalize_points
+
+    npy_path, index_path = _archive_paths(archive_path)
+    npy_path.parent.mkdir(parents=True, exist_ok=True)
+    sources = find_gt_pointclouds(pointcloud_root)
+
+    # Lay out the rows from the PLY headers, then fill the array one cloud at a time
+    objects = {}
+    offset = 0
+    for object_id, (category, ply_path) in sources.items():
+        count = ply_vertex_count(ply_path)
+        stat = os.stat(ply_path)
+        objects[object_id] = dict(category=category, source=str(ply_path), file=ply_path.name, offset=offset,
+                                 count=count, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        offset += count
+
+    tmp_path = npy_path.with_name(npy_path.name + ".tmp")
+    packed = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(offset, 3))
+    for i, (object_id, entry) in enumerate(objects.items()):
+        points = load_ply_pointcloud(entry["source"])
+        packed[entry["offset"]:entry["offset"] + entry["count"]] = normalize_points(points)
+        if (i + 1) % 500 == 0:
+            print(f"Packed {i + 1}/{len(objects)} ground truths")
+    packed.flush()
+    del packed
+    os.replace(tmp_path, npy_path)
+
+    with open(index_path, "w") as f:
+        json.dump(dict(version=ARCHIVE_VERSION, normalized=True, objects=objects), f)
+    print(f"Packed {len(objects)} ground truths ({offset} points) → {npy_path}")
+    return GroundTruthArchive(archive_path)
+
+
+class GroundTruthArchive:
+    """
+    Read side of a packed ground-truth archive. The array is memory-mapped (copy-on-write), so fetching a cloud is
+    an O(1) slice, and worker processes opening the same archive share its pages through the OS page cache.
+    """
+
+    def __init__(self, archive_path: Path):
+        npy_path, index_path = _archive_paths(archive_path)
+        with open(index_path, "r") as f:
+            index = json.load(f)
+        if index.get("version") != ARCHIVE_VERSION:
+            raise ValueError(f"{index_path} is an archive version {index.get('version')}, expected {ARCHIVE_VERSION}")
+        self.objects = index["objects"]
+        self.points = np.load(npy_path, mmap_mode="c")
+        self._stale = set()
+
+    @classmethod
+    def exists(cls, archive_path: Path) -> bool:
+        return all(p.exists() for p in _archive_paths(archive_path))
+
+    @classmethod
+    def is_current(cls, archive_path: Path) -> bool:
+        """Whether an archive exists and was built by this version (older ones need rebuilding)"""
+        if not cls.exists(archive_path):
+            return False
+        try:
+            with open(_archive_paths(archive_path)[1], "r") as f:
+                return json.load(f).get("version") == ARCHIVE_VERSION
+        except (OSError, ValueError):
+            return False
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __contains__(self, object_id: str) -> bool:
+        return object_id in self.objects
+
+    def get(self, object_id: str) -> np.ndarray:
+        """The normalized ground truth of an object (a view into the archive, not a copy)"""
+        entry = self.objects[object_id]
+        return self.points[entry["offset"]:entry["offset"] + entry["count"]].view(np.ndarray)
+
+    def prepared(self, object_id: str) -> "PreparedCloud":
+        from evaluation import PreparedCloud  # (evaluation loads torch, which reading the archive doesn't need)
+        return PreparedCloud(self.get(object_id), normalize=False)
+
+    def source_path(self, object_id: str) -> Path:
+        """The PLY an object's ground truth was packed from"""
+        return Path(self.objects[object_id]["source"])
+
+    def object_for_path(self, gt_path: Path) -> str | None:
+        """
+        The object id packed from gt_path (matched on the <object_id>/<file>.ply end of the path, so the same archive
+        works with Windows and WSL style relation files), or None if it isn't in the archive or the PLY has changed
+        since it was packed (then it has to be read from the PLY).
+        """
+        gt_path = Path(gt_path)
+        object_id = gt_path.parent.name
+        entry = self.objects.get(object_id)
+        if entry is None or entry["file"] != gt_path.name:
+            return None
+        try:
+            stat = os.stat(gt_path)
+        except FileNotFoundError:
+            return object_id  # (the archive can stand in for PLYs that are gone)
+        if (stat.st_size, stat.st_mtime_ns) != (entry["size"], entry["mtime_ns"]):
+            if object_id not in self._stale:
+                self._stale.add(object_id)
+                print(f"WARNING: {gt_path} changed since the GT archive was built, reading it from the PLY")
+            return None
+        return object_id
+
+
+if __name__ == "__main__":
+    from paths import fix_path
+
+    BASE_DB_PATH = fix_path(Path(os.getcwd()) / "datasets" / "omniobject3d")
+    build_gt_archive(BASE_DB_PATH / "ply_16384" / "extracted" / "16384", BASE_DB_PATH / "gt_archive")
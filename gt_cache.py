@@ -0,0 +1,83 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from gt_archive import GroundTruthArchive
+from loading_things import load_ply_pointcloud
+
+if TYPE_CHECKING:
+    from evaluation import PreparedCloud
+
+
+class GroundTruthCache:
+    """
+    LRU cache of prepared ground-truth clouds, keyed by GT path.
+    Each entry holds the normalized cloud plus any device tensors and KD-tree built while evaluating against it, so
+    every distortion and tau of an object reuses one prepared GT. Entries are evicted (least recently used first)
+    when there are more than max_entries of them or they hold more than max_mb in total.
+    With a packed archive (see gt_archive.py), ground truths in it are taken from the archive instead of parsed.
+    """
+
+    def __init__(self, max_entries: int = 8, max_mb: float | None = 1024, archive: GroundTruthArchive | None = None):
+        self.max_entries = max_entries
+        self.max_mb = max_mb
+        self.archive = archive
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, "PreparedCloud"] = OrderedDict()
+        self._lock = threading.Lock()  # (the staged pipeline evaluates from worker threads)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, gt_path) -> bool:
+        return str(Path(gt_path)) in self._entries
+
+    def get(self, gt_path) -> "PreparedCloud":
+        """Returns the prepared GT for gt_path, loading and normalizing it on a miss."""
+        key = str(Path(gt_path))
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            else:
+                self.misses += 1
+                self._entries[key] = self._load(gt_path)
+
+            # Tensors and trees are added to entries after they are returned, so re-check the limits on every access
+            self._evict()
+            return self._entries[key]
+
+    def _load(self, gt_path) -> "PreparedCloud":
+        from evaluation import PreparedCloud  # (torch is only loaded once a GT is actually needed)
+
+        object_id = None if self.archive is None else self.archive.object_for_path(gt_path)
+        if object_id is not None:
+            return self.archive.prepared(object_id)
+        return PreparedCloud(load_ply_pointcloud(gt_path, sidecar=True))
+
+    def put(self, gt_path, cloud: "PreparedCloud"):
+        """Adds an already-prepared GT (e.g. from a packed archive) to the cache."""
+        key = str(Path(gt_path))
+        with self._lock:
+            self._entries[key] = cloud
+            self._entries.move_to_end(key)
+            self._evict()
+
+    @property
+    def nbytes(self) -> int:
+        return sum(cloud.nbytes for cloud in self._entries.values())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache is within its limits (never drops the newest one)."""
+        while len(self._entries) > 1:
+            over_count = len(self._entries) > self.max_entries
+            over_memory = self.max_mb is not None and self.nbytes > self.max_mb * 1024 ** 2
+            if not (over_count or over_memory):
+                break
+            self._entries.popitem(last=False)
@@ -0,0 +1,174 @@
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # (Windows)
+    resource = None
+
+# Per-stage measurements of the pipeline. Every distortion record gets a "timings" block:
+#   {stage: {wall_s, cpu_s, rss_mb, rss_delta_mb, peak_gpu_mb[, shared_by]}}
+# with the stages load_image, distort, save_image, reconstruct, load_ply, and evaluate.
+# A stage done once for several records (decoding an image for all of its distortions, a batched SPAR3D call) is
+# split evenly between them, and shared_by says between how many. cpu_s is the CPU time of the whole process (all
+# threads, plus any subprocess that finished during the stage), so stages that overlap (staged_pipeline.py) overlap
+# in it too. rss_mb is the process's resident memory when the stage ended and rss_delta_mb how much it grew during
+# the stage (None where it can't be read); peak_gpu_mb is None without CUDA. The process's lifetime peak RSS is only
+# reported once, by print_timing_summary, since after the first large stage every stage would show the same peak.
+# CUDA only keeps one peak per process, so peak_gpu_mb is only measured for a stage that ran alone: a stage that
+# overlapped another one (in another thread) gets None, rather than a peak that may be the other stage's.
+
+STAGES = ("load_image", "distort", "save_image", "reconstruct", "load_ply", "evaluate")
+
+_active_timers = set()  # StageTimers currently running, in any thread
+_active_lock = threading.Lock()
+
+
+def _cpu_time() -> float:
+    """CPU time of this process and its finished subprocesses"""
+    if resource is None:
+        return time.process_time()
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def peak_rss_mb() -> float | None:
+    """Peak resident memory of this process so far (ru_maxrss is in KB on Linux)"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_rss_mb() -> float | None:
+    """Resident memory of this process right now (from /proc on Linux, psutil elsewhere if it is installed)"""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, AttributeError, ValueError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / 1024 ** 2
+
+
+def _cuda():
+    """torch.cuda if torch is already loaded and has a GPU (measuring never imports torch itself)"""
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available():
+        return None
+    return torch.cuda
+
+
+class StageTimer:
+    """
+    Measures one stage: wall time, CPU time, RSS (and its growth), and peak GPU memory.
+        with StageTimer("distort") as timer:
+            ...
+        timer.add_to(record)
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.metrics = {}
+        self._overlapped = False
+
+    def __enter__(self):
+        cuda = _cuda()
+        with _active_lock:
+            # (resetting the peak while another stage runs would wipe out that stage's peak)
+            if _active_timers:
+                self._overlapped = True
+                for other in _active_timers:
+                    other._overlapped = True
+            elif cuda is not None:
+                cuda.reset_peak_memory_stats()
+            _active_timers.add(self)
+        self._start_rss = current_rss_mb()
+        self._start_cpu = _cpu_time()
+        self._start_wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self._start_wall
+        cuda = _cuda()
+        with _active_lock:
+            _active_timers.discard(self)
+            peak_gpu_mb = cuda.max_memory_allocated() / 1024 ** 2 if cuda is not None and not self._overlapped else None
+        rss = current_rss_mb()
+        self.metrics = dict(
+            wall_s=wall,
+            cpu_s=_cpu_time() - self._start_cpu,
+            rss_mb=rss,
+            rss_delta_mb=rss - self._start_rss if rss is not None and self._start_rss is not None else None,
+            peak_gpu_mb=peak_gpu_mb,
+        )
+
+    def update(self, usage: dict | None):
+        """Takes the CPU and memory use measured elsewhere (e.g. by the SPAR3D worker process), keeping the wall time"""
+        if usage:
+            self.metrics.update({k: v for k, v in usage.items() if k != "wall_s"})
+
+    def add_to(self, *records: dict):
+        """Adds the measurements to the timings of the records (split evenly if there are several)"""
+        share = dict(self.metrics)
+        share["wall_s"] /= len(records)
+        share["cpu_s"] /= len(records)
+        if len(records) > 1:
+            share["shared_by"] = len(records)
+        for record in records:
+            record.setdefault("timings", {})[self.stage] = dict(share)
+
+
+def summarize_timings(records) -> dict:
+    """Per-stage totals and percentiles over distortion records (records without timings are skipped)"""
+    by_stage = {}
+    for record in records:
+        for stage, metrics in (record.get("timings") or {}).items():
+            by_stage.setdefault(stage, []).append(metrics)
+
+    summary = {}
+    for stage in sorted(by_stage, key=lambda s: (STAGES.index(s) if s in STAGES else len(STAGES), s)):
+        metrics = by_stage[stage]
+        wall = np.array([m["wall_s"] for m in metrics])
+        rss = [m["rss_mb"] for m in metrics if m.get("rss_mb") is not None]
+        rss_delta = [m["rss_delta_mb"] for m in metrics if m.get("rss_delta_mb") is not None]
+        gpu = [m["peak_gpu_mb"] for m in metrics if m.get("peak_gpu_mb") is not None]
+        summary[stage] = dict(
+            count=len(metrics),
+            total_wall_s=float(wall.sum()),
+            total_cpu_s=float(sum(m["cpu_s"] for m in metrics)),
+            p50_wall_s=float(np.percentile(wall, 50)),
+            p90_wall_s=float(np.percentile(wall, 90)),
+            p99_wall_s=float(np.percentile(wall, 99)),
+            max_wall_s=float(wall.max()),
+            max_rss_mb=max(rss) if rss else None,
+            max_rss_delta_mb=max(rss_delta) if rss_delta else None,
+            peak_gpu_mb=max(gpu) if gpu else None,
+        )
+    return summary
+
+
+def print_timing_summary(summary: dict):
+    if not summary:
+        print("No timings recorded")
+        return
+    total = sum(s["total_wall_s"] for s in summary.values())
+    print(f"\n{'stage':<12} {'count':>6} {'total':>10} {'share':>7} {'cpu':>10} {'p50':>9} {'p90':>9} {'p99':>9} "
+          f"{'RSS MB':>8} {'+RSS MB':>8} {'GPU MB':>8}")
+    for stage, s in summary.items():
+        rss = f"{s['max_rss_mb']:.0f}" if s["max_rss_mb"] is not None else "-"
+        rss_delta = f"{s['max_rss_delta_mb']:+.0f}" if s["max_rss_delta_mb"] is not None else "-"
+        gpu = f"{s['peak_gpu_mb']:.0f}" if s["peak_gpu_mb"] is not None else "-"
+        print(f"{stage:<12} {s['count']:>6} {s['total_wall_s']:9.1f}s {s['total_wall_s'] / max(total, 1e-9):7.1%} "
+              f"{s['total_cpu_s']:9.1f}s {s['p50_wall_s']:8.3f}s {s['p90_wall_s']:8.3f}s {s['p99_wall_s']:8.3f}s "
+              f"{rss:>8} {rss_delta:>8} {gpu:>8}")
+    print(f"{'total':<12} {'':>6} {total:9.1f}s")
+    process_peak = peak_rss_mb()
+    if process_peak is not None:
+        print(f"Peak RSS of this process: {process_peak:.0f} MB")
@@ -1,9 +1,10 @@
 import json
+import os
 from pathlib import Path
-from plyfile import PlyData
 import numpy as np
 
 from paths import fix_path
+from tracing import traced
 
 
 def load_dataset_relations(json_path) -> dict[str, dict[str, Path]]:
@@ -30,9 +31,163 @@ def load_dataset_relations(json_path) -> dict[str, dict[str, Path]]:
     return grouped_data
 
 
-def load_ply_pointcloud(path) -> np.ndarray:
-    """Load a .ply file into a numpy array of points"""
-    ply = PlyData.read(path)
-    data = ply['vertex']
-    points = np.vstack([data['x'], data['y'], data['z']]).T
+# PLY property types → numpy dtype codes (without byte order)
+_PLY_TYPES = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4", "double": "f8", "float64": "f8",
+}
+_PLY_BYTE_ORDERS = {"binary_little_endian": "<", "binary_big_endian": ">"}
+
+
+def _parse_ply_header(path) -> tuple[int, str, list] | None:
+    """
+    Reads a PLY header and returns (header size in bytes, format, [(element name, count, [(property, dtype)])]),
+    or None if it has list properties or types this reader doesn't handle (those files go through plyfile).
+    """
+    elements = []
+    with open(path, "rb") as f:
+        if f.readline().strip() != b"ply":
+            raise ValueError(f"{path} is not a PLY file")
+        fmt = None
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f"{path} has no end_header")
+            words = line.decode("ascii", errors="replace").split()
+            if not words or words[0] in ("comment", "obj_info"):
+                continue
+            if words[0] == "end_header":
+                return f.tell(), fmt, elements
+            if words[0] == "format":
+                fmt = words[1]
+            elif words[0] == "element":
+                elements.append((words[1], int(words[2]), []))
+            elif words[0] == "property":
+                if words[1] == "list" or words[1] not in _PLY_TYPES or not elements:
+                    return None
+                elements[-1][2].append((words[2], _PLY_TYPES[words[1]]))
+
+
+def ply_vertex_count(path) -> int:
+    """Number of vertices in a PLY file, from its header alone"""
+    with open(path, "rb") as f:
+        for line in f:
+            words = line.split()
+            if words[:2] == [b"element", b"vertex"]:
+                return int(words[2])
+            if words[:1] == [b"end_header"]:
+                break
+    raise ValueError(f"{path} has no vertex element")
+
+
+def _map_ply_vertices(path, mmap: bool = False) -> np.ndarray | None:
+    """
+    The vertex block of a binary PLY as a structured array (memory-mapped copy-on-write, so nothing is read until
+    used and nothing is copied), or None if the file isn't a binary PLY with fixed-size vertices.
+    """
+    header = _parse_ply_header(path)
+    if header is None:
+        return None
+    header_size, fmt, elements = header
+    if fmt not in _PLY_BYTE_ORDERS:
+        return None  # (ASCII)
+
+    # Skip any elements stored before the vertices
+    offset = header_size
+    for name, count, properties in elements:
+        dtype = np.dtype([(prop, _PLY_BYTE_ORDERS[fmt] + code) for prop, code in properties])
+        if name == "vertex":
+            if not {"x", "y", "z"} <= set(dtype.names or ()):
+                return None
+            if count == 0:
+                return np.zeros(0, dtype=dtype)
+            if mmap:
+                return np.memmap(path, dtype=dtype, mode="c", offset=offset, shape=(count,))
+            with open(path, "rb") as f:
+                f.seek(offset)
+                return np.fromfile(f, dtype=dtype, count=count)
+        offset += count * dtype.itemsize
+    return None
+
+
+_XYZ_FLOAT32 = np.dtype([("x", "<f4"), ("y", "<f4"), ("z", "<f4")])
+
+
+def _xyz_float32(vertices: np.ndarray) -> np.ndarray:
+    """Copies xyz out of a structured vertex array into a contiguous float32 (N, 3) array"""
+    points = np.empty((len(vertices), 3), dtype=np.float32)
+    for i, axis in enumerate("xyz"):
+        points[:, i] = vertices[axis]
+    return points
+
+
+def _sidecar_paths(path: Path) -> tuple[Path, Path]:
+    return path.with_name(path.name + ".npy"), path.with_name(path.name + ".npy.json")
+
+
+def _file_stamp(path: Path) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _load_sidecar(path: Path, mmap: bool) -> np.ndarray | None:
+    """The cached xyz array of a PLY, if there is one and the PLY hasn't changed since it was written"""
+    npy_path, stamp_path = _sidecar_paths(path)
+    try:
+        with open(stamp_path, "r") as f:
+            if json.load(f) != _file_stamp(path):
+                return None
+        return np.load(npy_path, mmap_mode="c" if mmap else None).view(np.ndarray)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_sidecar(path: Path, points: np.ndarray):
+    npy_path, stamp_path = _sidecar_paths(path)
+    try:
+        # (written aside and moved into place, so arrays still mapping an old sidecar keep their data)
+        tmp_path = npy_path.with_name(f"{npy_path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, points)
+        os.replace(tmp_path, npy_path)
+        with open(stamp_path, "w") as f:
+            json.dump(_file_stamp(path), f)
+    except OSError as e:
+        print(f"WARNING: Couldn't write point cache for {path}: {e}")
+
+
+@traced("path")
+def load_ply_pointcloud(path, sidecar: bool = False, mmap: bool = False) -> np.ndarray:
+    """
+    Load a .ply file into a contiguous float32 (N, 3) array of points.
+    Binary PLYs are read straight from their vertex block in one read (no per-property parsing). With mmap=True,
+    little-endian float xyz files (as SPAR3D writes them) come back as a copy-on-write memory map of the file instead,
+    with no copy at all; only use that for files nothing will replace or delete while the array is alive (Windows
+    can't unlink or relink a mapped file, which the pipeline and the reconstruction cache do with its outputs).
+    ASCII files and layouts this reader doesn't handle go through plyfile.
+    With sidecar=True, files that need converting are cached as float32 in a <name>.ply.npy next to the PLY, which is
+    reused until the PLY's size or mtime changes.
+    """
+    path = Path(path)
+    vertices = _map_ply_vertices(path, mmap=mmap)
+    if vertices is not None and vertices.dtype == _XYZ_FLOAT32:
+        return vertices.view(np.float32).reshape(-1, 3).view(np.ndarray)
+
+    if sidecar:
+        points = _load_sidecar(path, mmap)
+        if points is not None:
+            return points
+
+    if vertices is not None:
+        points = _xyz_float32(vertices)
+    else:
+        from plyfile import PlyData  # (only needed for the files the direct reader can't handle)
+        ply = PlyData.read(path)
+        data = ply['vertex']
+        points = np.ascontiguousarray(np.vstack([data['x'], data['y'], data['z']]).T, dtype=np.float32)
+
+    if sidecar:
+        _save_sidecar(path, points)
     return points
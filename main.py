@@ -1,19 +1,33 @@
+import argparse
+import atexit
 import datetime
-import json
 import os
 from pathlib import Path
 
-import torch
-
+from dataset_manifest import DatasetManifest
 from download_drive_images import download_files
+from experiment_plan import plan_experiment, save_plan, shard_grouped_data
+from gt_archive import GroundTruthArchive, build_gt_archive
+from gt_cache import GroundTruthCache
+from instrumentation import print_timing_summary, summarize_timings
 from loading_things import load_dataset_relations
 from paths import fix_path
-from pipeline import process_one_object
+from pipeline import SPAR3D_DIR, process_one_object
+from recon_cache import ReconstructionCache, spar3d_fingerprint
+from results_store import ResultsStore
 from restructure_files import move_images_and_build_full_relations
+from spar3d_worker import Spar3dWorker, spar3d_model_factory
+from staged_pipeline import run_staged_pipeline
+from tracing import start_tracing, stop_tracing
 
 DESIRED_FILE_COUNT = 9  # How many item files (tar.gzip) to download
 OBJECTS_PER_GROUP = 1  # How many objects from each group to process
 IMAGES_PER_OBJECT = 1  # How many images per object to process
+USE_SPAR3D_WORKER = True  # Keep SPAR3D loaded in one worker process (False runs run.py once per image)
+USE_STAGED_PIPELINE = False  # Overlap distortion, reconstruction, and evaluation across objects
+SEED = 0  # Base seed for the noise distortion (None = unseeded, so noisy images can't be cached)
+RECON_CACHE_MAX_GB = 20  # Size limit of the reconstruction cache (None = unlimited)
+SPAR3D_BATCH_SIZE = None  # Reconstruct all distortions of an object in one SPAR3D call, this many per pass (None = one at a time)
 
 distortion_levels = [
     {"blur": 0, "noise": 0, "exposure": 1.0},
@@ -26,6 +40,20 @@ distortion_levels = [
 ]
 
 # SPAR3D will run this many times: DESIRED_FILE_COUNT * OBJECTS_PER_GROUP * IMAGES_PER_OBJECT * len(distortion_levels)
+# (split across machines with --shard-index/--shard-count; merge the shards' results with experiment_plan.py)
+parser = argparse.ArgumentParser(description="Run the SPAR3D distortion sweep (or one shard of it)")
+parser.add_argument("--shard-index", type=int, default=0, help="Which shard of the sweep this machine runs")
+parser.add_argument("--shard-count", type=int, default=1, help="How many machines the sweep is split across")
+parser.add_argument("--trace", type=Path, help="Save a Chrome/Perfetto trace of the run (see tracing.py)")
+parser.add_argument("--profile", nargs="+", default=[], metavar="SPAN", help="Also cProfile these traced spans")
+parser.add_argument("--torch-profile", nargs="+", default=[], metavar="SPAN",
+                    help="Also run these traced spans under the torch profiler")
+args = parser.parse_args()
+
+# Tracing is off unless asked for (the trace is saved at exit, also when the run fails or is interrupted)
+if args.trace is not None:
+    start_tracing(args.trace, profile=args.profile, torch_profile=args.torch_profile)
+    atexit.register(stop_tracing)
 
 # Constructing paths
 ROOT_DIR = Path(os.getcwd())
@@ -35,21 +63,30 @@ RAW_IMAGES_PATH = BASE_DB_PATH / "images_raw"
 IMAGES_PATH = BASE_DB_PATH / "images"
 POINTCLOUD_ROOT = BASE_DB_PATH / "ply_16384" / "extracted" / "16384"
 FINAL_RELATION_FILE_PATH = BASE_DB_PATH / "object_relations.json"
+MANIFEST_PATH = BASE_DB_PATH / "dataset_manifest.json"
 OUTPUT_ROOT = BASE_DB_PATH / "spar3d_outputs"
+RECON_CACHE_ROOT = BASE_DB_PATH / "recon_cache"
+GT_ARCHIVE_PATH = BASE_DB_PATH / "gt_archive"
 
 # Ensure output folder exists
 OUTPUT_ROOT.mkdir(parents=True, exist_ok=True)
 
 # Create a new results file with timestamp
 timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-RESULTS_PATH = OUTPUT_ROOT / f"pipeline_results_{timestamp}.json"
-
-# Test code for PyTorch/GPU
-print("CUDA available:", torch.cuda.is_available())
-print("GPU:", torch.cuda.get_device_name(0) if torch.cuda.is_available() else None)
+shard_suffix = f"_shard{args.shard_index}of{args.shard_count}" if args.shard_count > 1 else ""
+RESULTS_PATH = OUTPUT_ROOT / f"pipeline_results_{timestamp}{shard_suffix}.json"
+RESULTS_STORE_PATH = OUTPUT_ROOT / f"pipeline_results_{timestamp}{shard_suffix}.sqlite"
+PLAN_PATH = OUTPUT_ROOT / f"experiment_plan_{timestamp}.json"
 
 ############# DOWNLOADING DATABASE FILES #############
 SKIP_DOWNLOAD = True
+BUILD_GT_ARCHIVE = True  # Pack the ground truths into one memory-mapped archive (once; skipped if it already exists)
+
+# Load (or build) the packed ground-truth archive
+# (an archive from an older version is rebuilt)
+if BUILD_GT_ARCHIVE and not GroundTruthArchive.is_current(GT_ARCHIVE_PATH) and POINTCLOUD_ROOT.is_dir():
+    build_gt_archive(POINTCLOUD_ROOT, GT_ARCHIVE_PATH)
+gt_archive = GroundTruthArchive(GT_ARCHIVE_PATH) if GroundTruthArchive.is_current(GT_ARCHIVE_PATH) else None
 
 if not SKIP_DOWNLOAD:
     # Read file IDs
@@ -57,14 +94,18 @@ if not SKIP_DOWNLOAD:
 
     # Download selected ones
     wanted_files = urls[:DESIRED_FILE_COUNT]
-    download_files(wanted_files, RAW_IMAGES_PATH, unzip=True)
+    # (only the renders that will be processed are extracted; raising IMAGES_PER_OBJECT extracts the kept .tar.gz
+    # files again, with the extra renders)
+    download_files(wanted_files, RAW_IMAGES_PATH, unzip=True, images_per_object=IMAGES_PER_OBJECT)
 
     # Move files and build relations
     move_images_and_build_full_relations(
         move_source_path=RAW_IMAGES_PATH,
         move_dest_path=IMAGES_PATH,
         pointcloud_root=POINTCLOUD_ROOT,
-        relation_output_path=FINAL_RELATION_FILE_PATH
+        relation_output_path=FINAL_RELATION_FILE_PATH,
+        gt_archive=gt_archive,
+        manifest_path=MANIFEST_PATH,
     )
 
 ############# LOADING/TESTING #############
@@ -77,53 +118,111 @@ print("Loaded:", len(grouped_data.keys()), "objects")
 
 prune_files = False
 if prune_files:
-    # Identify all images that will actually be processed
-    images_to_keep = set()
-    for group_objs in grouped_data.values():
+    # Identify all images that will actually be processed (across all shards), from the dataset manifest
+    manifest = DatasetManifest(MANIFEST_PATH)
+    manifest.adopt(grouped_data)  # (objects restructured before there was a manifest)
+    manifest.refresh()
+    images_to_keep = manifest.select(grouped_data, OBJECTS_PER_GROUP, IMAGES_PER_OBJECT)
+
+    # Delete unneeded images in the main image folder (and folders left empty)
+    deleted = manifest.prune(images_to_keep)
+    kept = sum(len(names) for names in images_to_keep.values())
+    print(f"Kept {kept} images, deleted {deleted} unused images from {IMAGES_PATH}")
+
+# Plan the whole sweep (every shard plans the same one), then keep this shard's objects
+plan = plan_experiment(grouped_data, distortion_levels, OBJECTS_PER_GROUP, IMAGES_PER_OBJECT)
+save_plan(plan, PLAN_PATH, shard_count=args.shard_count)
+grouped_data = shard_grouped_data(grouped_data, OBJECTS_PER_GROUP, args.shard_index, args.shard_count)
+shard_objects = sum(len(group_objs) for group_objs in grouped_data.values())
+print(f"Shard {args.shard_index}/{args.shard_count}: {shard_objects} objects ({len(plan)} units in the full plan)")
+
+# Test code for PyTorch/GPU (torch is only imported once the sweep is about to run, so the planning above and
+# --help don't wait for it)
+import torch
+print("CUDA available:", torch.cuda.is_available())
+print("GPU:", torch.cuda.get_device_name(0) if torch.cuda.is_available() else None)
+
+# Prepared ground truths are cached across process_one_object calls (and come from the archive when there is one)
+gt_cache = GroundTruthCache(max_entries=4, archive=gt_archive)
+
+# Reconstructions (and finished units) from previous runs are reused, so an interrupted sweep picks up where it stopped
+recon_cache = ReconstructionCache(
+    RECON_CACHE_ROOT, max_gb=RECON_CACHE_MAX_GB, fingerprint=spar3d_fingerprint(SPAR3D_DIR)
+)
+
+# Start the SPAR3D worker (falls back to a subprocess per image if the model can't be loaded in-process)
+spar3d_worker = None
+if USE_SPAR3D_WORKER:
+    try:
+        spar3d_worker = Spar3dWorker(spar3d_model_factory(SPAR3D_DIR)).start()
+    except RuntimeError as e:
+        print(f"WARNING: Could not start SPAR3D worker, using subprocesses instead: {e}")
+
+# Results are saved to the store as each object finishes (and exported to the results JSON at the end)
+results_store = ResultsStore(RESULTS_STORE_PATH)
+for group_name in grouped_data:
+    results_store.add_category(group_name)  # (so a group with no finished objects is still in the results JSON)
+
+if USE_STAGED_PIPELINE:
+    def save_object_results(group_name, obj_id, result):
+        """Save after each object"""
+        results_store.add_object_result(group_name, result)
+        print(f"Saved results for {obj_id} → {RESULTS_STORE_PATH}")
+
+    results = run_staged_pipeline(
+        grouped_data,
+        distortion_levels=distortion_levels,
+        taus=taus,
+        objects_per_group=OBJECTS_PER_GROUP,
+        images_per_object=IMAGES_PER_OBJECT,
+        output_root=Path(OUTPUT_ROOT),
+        keep_distorted=False,
+        gt_cache=gt_cache,
+        spar3d_worker=spar3d_worker,
+        recon_cache=recon_cache,
+        seed=SEED,
+        on_object_done=save_object_results,
+    )
+else:
+    results = {}
+    for group_name, group_objs in grouped_data.items():
+        results[group_name] = {}
+        # Run the pipeline on each object
         for obj_id, fields in list(group_objs.items())[:OBJECTS_PER_GROUP]:
-            img_files = sorted(list(Path(fields["images"]).glob("*.png")))[:IMAGES_PER_OBJECT]
-            for img_file in img_files:
-                images_to_keep.add(img_file.resolve())
-
-    # Delete unneeded images in the main image folder
-    for img_file in Path(IMAGES_PATH).rglob("*.png"):
-        if img_file.resolve() not in images_to_keep:
-            img_file.unlink()
-
-    # Delete empty folders after purging unused images
-    for dirpath, dirnames, filenames in os.walk(IMAGES_PATH, topdown=False):
-        if not dirnames and not filenames:  # empty folder
-            Path(dirpath).rmdir()
-
-    print(f"Kept {len(images_to_keep)} images, deleted unused images from {IMAGES_PATH}")
-
-results = {}
-for group_name, group_objs in grouped_data.items():
-    results[group_name] = {}
-    # Run the pipeline on each object
-    for obj_id, fields in list(group_objs.items())[:OBJECTS_PER_GROUP]:
-        print(f"\n=== Processing object: {obj_id} ===")
-        try:
-            result = process_one_object(
-                object_id=obj_id,
-                img_dir=fields["images"],
-                gt_pointcloud_path=fields["point_cloud"],
-                distortion_levels=distortion_levels,
-                taus=taus,
-                images_per_object=IMAGES_PER_OBJECT,
-                keep_distorted=False,
-                output_root=Path(OUTPUT_ROOT)
-            )
-
-            # Save result for this object
-            results[group_name][obj_id] = result
-
-            # Save after each object
-            with open(RESULTS_PATH, "w") as f:
-                json.dump(results, f, indent=4)
-            print(f"Saved results for {obj_id} → {RESULTS_PATH}")
-
-        except Exception as e:
-            print(f"Failed processing {obj_id}: {e}")
-
-print(f"\nAll results saved → {RESULTS_PATH}")
+            print(f"\n=== Processing object: {obj_id} ===")
+            try:
+                result = process_one_object(
+                    object_id=obj_id,
+                    img_dir=fields["images"],
+                    gt_pointcloud_path=fields["point_cloud"],
+                    distortion_levels=distortion_levels,
+                    taus=taus,
+                    images_per_object=IMAGES_PER_OBJECT,
+                    keep_distorted=False,
+                    output_root=Path(OUTPUT_ROOT),
+                    gt_cache=gt_cache,
+                    spar3d_worker=spar3d_worker,
+                    batch_size=SPAR3D_BATCH_SIZE,
+                    recon_cache=recon_cache,
+                    seed=SEED,
+                )
+
+                # Save result for this object
+                results[group_name][obj_id] = result
+
+                # Save after each object
+                results_store.add_object_result(group_name, result)
+                print(f"Saved results for {obj_id} → {RESULTS_STORE_PATH}")
+
+            except Exception as e:
+                print(f"Failed processing {obj_id}: {e}")
+
+if spar3d_worker is not None:
+    spar3d_worker.close()
+
+# Where the sweep's time went: per-stage totals and percentiles over every distortion record
+print_timing_summary(summarize_timings(results_store.distortions()))
+
+results_store.export_json(RESULTS_PATH)
+results_store.close()
+print(f"\nAll results saved → {RESULTS_PATH} (and {RESULTS_STORE_PATH})")
@@ -1,5 +1,9 @@
 import csv
 import json
+import re
+from pathlib import Path
+
+from results_store import ResultsStore, is_results_store, iter_results_json, iter_results_jsonl
 
 def map_blur_level(blur):
     if blur == 0 or blur == 0.0:
@@ -25,24 +29,18 @@ def map_exposure_level(exp):
     else:
         return "high"
 
-def parse_results(json_path, csv_path):
-    """Parses the results JSON into an R-Studio compatible .csv for statistical analysis."""
-    # Load JSON
-    with open(json_path, "r") as f:
-        data = json.load(f)
-
-    rows = []
-
-    # Collect all the unique tau values
-    tau_values = set()
-    for item_name, item_data in data.items():
-        for obj_id, obj_data in item_data.items():
-            for img in obj_data["images"]:
-                for dist in img["distortions"]:
-                    for ev in dist["evaluations"]:
-                        tau_values.add(ev["tau"])
-
-    tau_values = sorted(tau_values)
+def parse_results(json_path, csv_path, taus: list[float] | None = None, columnar_path=None):
+    """
+    Parses the results JSON into an R-Studio compatible .csv for statistical analysis.
+    json_path can also be a results .jsonl or a results store (.sqlite/.db, see results_store.py).
+    Results are streamed: rows are written as each object (or record) is read, so memory use doesn't grow with the
+    size of the results. The F-score columns come from taus (other taus in the file are left out), or from a quick scan
+    of the file for its tau values.
+    columnar_path optionally also writes the table as Parquet (.parquet) or Feather (.feather), which needs pyarrow.
+    """
+    if taus is None:
+        taus = collect_taus(json_path)
+    tau_values = sorted(taus)
 
     # Build the table header
     header = [
@@ -53,46 +51,149 @@ def parse_results(json_path, csv_path):
         "chamferDistance",
     ] + [f"F{tau}" for tau in tau_values]
 
-    # Build the data rows
-    for item_name, item_data in data.items():
-        for obj_id, obj_data in item_data.items():
-            for img in obj_data["images"]:
-                for dist in img["distortions"]:
-                    # Distortion details
-                    distortion = dist["distortion"]
-                    blur_level = map_blur_level(distortion["blur"])
-                    exposure_level = map_exposure_level(distortion["exposure"])
-                    noise_level = map_noise_level(distortion["noise"])
-
-                    # Chamfer distance (same for each distortion)
-                    chamfer = dist["evaluations"][0]["metrics"]["chamfer_distance"]
-
-                    # Build the row
-                    row = {
-                        "object": item_name,
-                        "blurLevel": blur_level,
-                        "exposureLevel": exposure_level,
-                        "noiseLevel": noise_level,
-                        "chamferDistance": chamfer,
-                    }
-
-                    # Insert F-scores for each tau
-                    for ev in dist["evaluations"]:
-                        tau = ev["tau"]
-                        row[f"F{tau}"] = ev["metrics"]["fscore"]
-
-                    # Save the result
-                    rows.append(row)
-
-    # Write the results to the CSV
+    # Write the results to the CSV (and the columnar file) as they are read
+    columnar = _ColumnarWriter(columnar_path, header) if columnar_path is not None else None
     with open(csv_path, "w", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=header)
+        writer = csv.DictWriter(f, fieldnames=header, extrasaction="ignore")  # (F-scores at taus not asked for)
         writer.writeheader()
-        writer.writerows(rows)
+        for row in iter_rows(json_path):
+            writer.writerow(row)
+            if columnar is not None:
+                columnar.add(row)
+    if columnar is not None:
+        columnar.close()
+        print(f"Saved {columnar.kind} to {columnar_path}")
 
     print(f"Saved CSV to {csv_path}")
 
 
+# Matches each "tau": <number> in a results file
+_TAU_PATTERN = re.compile(rb'"tau"\s*:\s*(-?[0-9][0-9.eE+-]*)')
+
+
+def collect_taus(results_path, chunk_size: int = 1 << 22) -> list[float]:
+    """The tau values in a results file, found without parsing it (a regex scan, in chunks)"""
+    if is_results_store(results_path):
+        with ResultsStore(results_path) as store:
+            return store.taus()
+
+    taus = set()
+    tail = b""
+    with open(results_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            buf = tail + chunk
+            for match in _TAU_PATTERN.finditer(buf):
+                # (a number running up to the end of the chunk may continue in the next one)
+                if chunk and match.end() == len(buf):
+                    break
+                taus.add(json.loads(match.group(1)))
+            if not chunk:
+                break
+            tail = buf[-64:]  # (matches are shorter than this, so one cut off by the chunk is found next time)
+    return sorted(taus)
+
+
+def iter_rows(results_path):
+    """The CSV rows of a results JSON, .jsonl, or store, one at a time"""
+    if is_results_store(results_path):
+        with ResultsStore(results_path) as store:
+            yield from _rows_from_store(store)
+    elif Path(results_path).suffix == ".jsonl":
+        for record in iter_results_jsonl(results_path):
+            if record["evaluations"]:
+                yield _record_row(record["category"], record)
+    else:
+        for item_name, obj_id, obj_data in iter_results_json(results_path):
+            for img in obj_data["images"]:
+                for dist in img["distortions"]:
+                    if dist["evaluations"]:
+                        yield _record_row(item_name, dist)
+
+
+def _distortion_row(category, distortion, chamfer) -> dict:
+    return {
+        "object": category,
+        "blurLevel": map_blur_level(distortion["blur"]),
+        "exposureLevel": map_exposure_level(distortion["exposure"]),
+        "noiseLevel": map_noise_level(distortion["noise"]),
+        "chamferDistance": chamfer,
+    }
+
+
+def _record_row(category, dist: dict) -> dict:
+    """The CSV row of one distortion record"""
+    # Chamfer distance (same for each distortion)
+    chamfer = dist["evaluations"][0]["metrics"]["chamfer_distance"]
+    row = _distortion_row(category, dist["distortion"], chamfer)
+
+    # Insert F-scores for each tau
+    for ev in dist["evaluations"]:
+        tau = ev["tau"]
+        row[f"F{tau}"] = ev["metrics"]["fscore"]
+    return row
+
+
+def _rows_from_store(store: ResultsStore):
+    """The same rows as for a results JSON, from one query over the store's indexed columns"""
+    current, current_id = None, None
+    for ev in store.iter_query(
+        "SELECT d.id, o.category, d.record, e.tau, e.chamfer_distance, e.fscore "
+        "FROM evaluations e JOIN distortions d ON d.id = e.distortion_row JOIN objects o ON o.id = d.object_row "
+        "ORDER BY o.id, d.image_idx, d.position, e.position"
+    ):
+        if ev["id"] != current_id:
+            # First evaluation of a new distortion (its Chamfer distance is the same for each tau)
+            if current is not None:
+                yield current
+            current_id = ev["id"]
+            current = _distortion_row(ev["category"], json.loads(ev["record"])["distortion"], ev["chamfer_distance"])
+        current[f"F{ev['tau']}"] = ev["fscore"]
+    if current is not None:
+        yield current
+
+
+class _ColumnarWriter:
+    """Writes rows to a Parquet or Feather file in batches (R reads both with the arrow package)"""
+
+    def __init__(self, path, header: list[str], batch_size: int = 65536):
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("Columnar output needs pyarrow (pip install pyarrow)") from None
+
+        self.path = Path(path)
+        self.header = header
+        self.batch_size = batch_size
+        self.kind = "Feather" if self.path.suffix in (".feather", ".arrow") else "Parquet"
+        self.schema = pa.schema(
+            [(name, pa.string()) for name in header[:4]] + [(name, pa.float64()) for name in header[4:]]
+        )
+        self.batch = {name: [] for name in header}
+        self._pa = pa
+        if self.kind == "Feather":
+            self.writer = pa.ipc.new_file(str(self.path), self.schema)
+        else:
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(str(self.path), self.schema)
+
+    def add(self, row: dict):
+        # (only the header's columns are kept, like the CSV)
+        for name in self.header:
+            self.batch[name].append(row.get(name))
+        if len(self.batch["object"]) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self.batch["object"]:
+            self.writer.write_table(self._pa.Table.from_pydict(self.batch, schema=self.schema))
+            self.batch = {name: [] for name in self.header}
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
 if __name__ == "__main__":
     parse_results(
         r"C:\Users\joshu\PycharmProjects\CS5404-Final-Project\pipeline_results_re-evaluated.json",
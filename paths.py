@@ -1,15 +1,20 @@
 import platform
+from functools import lru_cache
 from pathlib import Path
 
+
+@lru_cache(maxsize=None)
+def is_wsl() -> bool:
+    """Whether this is running under WSL (detected once; the kernel doesn't change while running)"""
+    return "microsoft" in platform.uname().release.lower()
+
+
 def fix_path(p: str | Path) -> Path:
     """Converts paths to the correct format (WSL vs Windows)."""
     p = str(p)
 
-    # Detect WSL
-    is_wsl = "microsoft" in platform.uname().release.lower()
-
     # If not WSL, return normal Path()
-    if not is_wsl:
+    if not is_wsl():
         return Path(p)
 
     # If WSL, handle it:
@@ -1,65 +1,161 @@
 import json
+import multiprocessing as mp
+import os
 import shutil
 import subprocess
 import tempfile
-import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import numpy as np
-from PIL import Image
 
-from distortion import distort_image
-from evaluation import evaluate_pointcloud
+from distance_store import evaluate_from_store, nn_store_path
+from distortion import derive_seed, distort_image_levels
+from gt_archive import GroundTruthArchive
+from gt_cache import GroundTruthCache
+from instrumentation import StageTimer
 from loading_things import load_dataset_relations, load_ply_pointcloud
 from parse_results import parse_results
 from paths import fix_path
+from recon_cache import ReconstructionCache, unit_id
+from results_store import is_results_store, open_results
+from spar3d_worker import Spar3dWorker
+from tracing import span, traced
+
+if TYPE_CHECKING:
+    from evaluation import PreparedCloud
+
+# torch (through evaluation.py) and PIL are imported where they are used, so tools that only read or merge results
+# (parse_results, re-evaluating from saved distances) start without loading them
 
 SPAR3D_DIR = fix_path(Path("/mnt/c/Users/joshu/PycharmProjects/CS5404-Final-Project/stable-point-aware-3d"))
 
 
-def run_spar3d_reconstruction(image_path: Path, output_file_path: Path) -> np.ndarray:
-    """Run SPAR3D on the provided image, and output the resulting point cloud"""
+def write_spar3d_point_clouds(image_paths: list[Path], output_file_paths: list[Path],
+                              worker: Spar3dWorker | None = None, batch_size: int = 1) -> dict | None:
+    """
+    Run SPAR3D on several images in one invocation (batch_size images per forward pass), and save each resulting
+    point cloud. SPAR3D writes the result for the i-th image to "<i>/", which goes to output_file_paths[i].
+    Uses the warm worker process if one is given, otherwise runs SPAR3D's run.py in a new subprocess.
+    Returns the worker's measurements of the job (None for a subprocess, whose CPU time StageTimer already counts).
+    """
+    usage = None
     # Create a temporary folder for SPAR3D output
     with tempfile.TemporaryDirectory() as tmpdir:
         tmpdir_path = Path(tmpdir)
-        # Run the SPAR3D command
-        cmd = [
-            "python", str((SPAR3D_DIR / "run.py").resolve()), str(image_path),
-            "--output-dir", str(tmpdir_path)
-        ]
-        print(f"SPAR3D: Running command: {' '.join(cmd)}")
-        subprocess.run(cmd, check=True)
-
-        # (SPAR3D creates a folder named "0/" in the output directory)
-        output_subfolder = tmpdir_path / "0"
-        ply_files = list(output_subfolder.glob("*.ply"))
-        if not ply_files:
-            raise RuntimeError(f"No .ply file generated for {image_path}")
-
-        # Move the .ply file to the output folder (it persists after the test)
-        output_file_path.parent.mkdir(parents=True, exist_ok=True)
-        shutil.move(str(ply_files[0]), str(output_file_path))
-        print(f"SPAR3D: Saved point cloud to {output_file_path}")
-
-    # Load the point cloud as numpy array
-    pts = load_ply_pointcloud(output_file_path)
-    return pts
+        if worker is not None:
+            # Send the job to the already-loaded model
+            print(f"SPAR3D: Sending {len(image_paths)} image(s) to worker")
+            with span("spar3d_worker", images=len(image_paths), batch_size=batch_size):
+                usage = worker.reconstruct(image_paths, tmpdir_path, batch_size=batch_size)
+        else:
+            # Run the SPAR3D command
+            cmd = [
+                "python", str((SPAR3D_DIR / "run.py").resolve()), *[str(p) for p in image_paths],
+                "--output-dir", str(tmpdir_path),
+            ]
+            if batch_size != 1:
+                cmd += ["--batch-size", str(batch_size)]
+            print(f"SPAR3D: Running command: {' '.join(cmd)}")
+            with span("spar3d_subprocess", images=len(image_paths), batch_size=batch_size):
+                subprocess.run(cmd, check=True)
+
+        for i, (image_path, output_file_path) in enumerate(zip(image_paths, output_file_paths)):
+            # (SPAR3D creates a folder named "<i>/" in the output directory for each image)
+            output_subfolder = tmpdir_path / str(i)
+            ply_files = list(output_subfolder.glob("*.ply"))
+            if not ply_files:
+                raise RuntimeError(f"No .ply file generated for {image_path}")
+
+            # Move the .ply file to the output folder (it persists after the test)
+            output_file_path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(ply_files[0]), str(output_file_path))
+            print(f"SPAR3D: Saved point cloud to {output_file_path}")
+
+    return usage
+
+
+def run_spar3d_reconstruction_batch(image_paths: list[Path], output_file_paths: list[Path],
+                                    worker: Spar3dWorker | None = None, batch_size: int = 1) -> list[np.ndarray]:
+    """Run SPAR3D on several images in one invocation, and output the resulting point clouds"""
+    write_spar3d_point_clouds(image_paths, output_file_paths, worker=worker, batch_size=batch_size)
+
+    # Load the point clouds as numpy arrays
+    return [load_ply_pointcloud(p) for p in output_file_paths]
+
+
+@traced("image_path")
+def run_spar3d_reconstruction(image_path: Path, output_file_path: Path,
+                              worker: Spar3dWorker | None = None) -> np.ndarray:
+    """Run SPAR3D on the provided image, and output the resulting point cloud"""
+    return run_spar3d_reconstruction_batch([image_path], [output_file_path], worker=worker)[0]
+
+
+def evaluate_distortion_record(record: dict, pred_pts: np.ndarray, gt_pts: "PreparedCloud", taus: list[float],
+                               out_ply: Path, eval_backend: str):
+    """Evaluate one reconstruction once and add the results for each tau to its distortion record"""
+    from evaluation import evaluate_pointcloud_multi
+
+    with StageTimer("evaluate") as timer:
+        all_metrics = evaluate_pointcloud_multi(pred_pts, gt_pts, taus=taus, backend=eval_backend,
+                                                nn_store_path=nn_store_path(out_ply))
+    timer.add_to(record)
+    for tau, metrics in zip(taus, all_metrics):
+        record["evaluations"].append(dict(
+            tau=tau,
+            metrics=metrics,
+        ))
+
+
+def evaluate_distortion_records_batched(records: list[dict], all_pred_pts: list[np.ndarray], gt_pts: "PreparedCloud",
+                                        taus: list[float], out_plys: list[Path], distance_dtype: str = "fp32"):
+    """Evaluate several reconstructions of one object against its ground truth in one batched pass (torch backend)"""
+    from evaluation import evaluate_pointclouds_batched
+
+    with StageTimer("evaluate") as timer:
+        all_metrics = evaluate_pointclouds_batched(all_pred_pts, gt_pts, taus, distance_dtype=distance_dtype,
+                                                   nn_store_paths=[nn_store_path(p) for p in out_plys])
+    timer.add_to(*records)
+    for record, metrics_list in zip(records, all_metrics):
+        for tau, metrics in zip(taus, metrics_list):
+            record["evaluations"].append(dict(
+                tau=tau,
+                metrics=metrics,
+            ))
 
 
+@traced("object_id")
 def process_one_object(object_id: str, img_dir: Path, gt_pointcloud_path: Path, distortion_levels: list[dict],
                        taus: list[float], images_per_object: int = 1, keep_distorted: bool = False,
-                       output_root: Path | None = None) -> dict:
+                       output_root: Path | None = None, eval_backend: str = "torch",
+                       gt_cache: GroundTruthCache | None = None, spar3d_worker: Spar3dWorker | None = None,
+                       batch_size: int | None = None, recon_cache: ReconstructionCache | None = None,
+                       seed: int | None = None) -> dict:
     """
     Runs the full testing pipeline:
         1. distort images for each distortion level
         2. run SPAR3D on each distortion
         3. evaluate results at each tolerance (tau)
         4. collect and return results
+    If batch_size is set, every distorted image of the object is made first and then reconstructed in a single
+    SPAR3D invocation (batch_size images per forward pass), instead of one invocation per distortion. With the torch
+    backend, the reconstructions are then also evaluated against the ground truth in one batched pass.
+    With a recon_cache, finished units are taken from its manifest and cached reconstructions skip SPAR3D. Noise is
+    only reproducible (and so only cached) when a seed is given.
+    Each distortion record gets the timings of the stages run for it in this call (see instrumentation.py).
     """
+    from PIL import Image
+
+    from evaluation import PreparedCloud
+
     results = dict(object_id=object_id, images=[])
 
-    # Load ground truth
-    gt_pts = load_ply_pointcloud(gt_pointcloud_path)
+    # Load and prepare the ground truth once (normalized, with its tensors/KD-tree kept across distortions)
+    if gt_cache is not None:
+        gt_pts = gt_cache.get(gt_pointcloud_path)
+    else:
+        gt_pts = PreparedCloud(load_ply_pointcloud(gt_pointcloud_path, sidecar=True))
 
     # Load the database images to be processed
     images = sorted(list(Path(img_dir).glob("*.png")))[:images_per_object]
@@ -71,61 +167,157 @@ def process_one_object(object_id: str, img_dir: Path, gt_pointcloud_path: Path,
     output_root = Path(output_root)
     (output_root / object_id).mkdir(parents=True, exist_ok=True)
 
-    for i, img_path in enumerate(images):
-        img_results = dict(
-            image_idx=i,
-            original_image=str(img_path),
-            distortions=[],
-        )
-
-        for distortion in distortion_levels:
-            blur, noise, exposure = distortion["blur"], distortion["noise"], distortion["exposure"]
-            print(f"\nImage {i}, Distortion: blur={blur}, noise={noise}, exposure={exposure}")
-
-            # Make a temporary folder for this distortion
-            distort_dir = (output_root / object_id / f"blur{blur}_noise{noise}_exp{exposure}")
-            distort_dir.mkdir(parents=True, exist_ok=True)
-
-            # Distort the image
-            img = Image.open(img_path).convert("RGB")
-            img = distort_image(img, blur=blur, noise=noise, exposure=exposure)
-
-            # Save the distorted image to the directory
-            dist_path = distort_dir / f"img_{i}.png"
-            img.save(dist_path)
-
-            # Run SPAR3D on the distorted image
-            out_ply = output_root / object_id / f"pts_img{i}_blur{blur}_noise{noise}_exp{exposure}.ply"
-            start_time = time.perf_counter()
-            pred_pts = run_spar3d_reconstruction(dist_path, output_file_path=out_ply)
-            spar3d_time = time.perf_counter() - start_time
-            print(f"SPAR3D: Finished in {spar3d_time:.2f} seconds")
-
-            # Update results for this distortion
-            img_results["distortions"].append(dict(
-                distorted_image=str(dist_path),
-                distortion=dict(blur=blur, noise=noise, exposure=exposure),
-                evaluations=[],
-            ))
+    # Distortions waiting for the batched reconstruction
+    pending = []
 
-            # Evaluate and save results for each tau
-            for tau in taus:
-                metrics = evaluate_pointcloud(pred_pts, gt_pts, tau=tau)
-                img_results["distortions"][-1]["evaluations"].append(dict(
-                    tau=tau,
-                    metrics=metrics,
-                ))
+    for i, img_path in enumerate(images):
+        with span("image", object_id=object_id, image_idx=i):
+            img_results = dict(
+                image_idx=i,
+                original_image=str(img_path),
+                distortions=[],
+            )
+
+            # Distortions of this image that still need to be made and reconstructed
+            todo = []
+
+            for distortion in distortion_levels:
+                with span("distortion", object_id=object_id, image_idx=i, **distortion):
+                    blur, noise, exposure = distortion["blur"], distortion["noise"], distortion["exposure"]
+                    print(f"\nImage {i}, Distortion: blur={blur}, noise={noise}, exposure={exposure}")
+
+                    # Paths for this distortion (with a temporary folder for the distorted image)
+                    distort_dir = (output_root / object_id / f"blur{blur}_noise{noise}_exp{exposure}")
+                    dist_path = distort_dir / f"img_{i}.png"
+                    out_ply = output_root / object_id / f"pts_img{i}_blur{blur}_noise{noise}_exp{exposure}.ply"
+                    item_seed = None if seed is None else derive_seed(seed, object_id, i, blur, noise, exposure)
+
+                    # Update results for this distortion
+                    record = dict(
+                        distorted_image=str(dist_path),
+                        distortion=dict(blur=blur, noise=noise, exposure=exposure),
+                        evaluations=[],
+                    )
+                    img_results["distortions"].append(record)
+
+                    # Check the cache (skips distorting the image too, since the key only depends on the source image)
+                    key = unit = None
+                    if recon_cache is not None and (noise == 0 or item_seed is not None):
+                        key = recon_cache.key_for(img_path, distortion, item_seed)
+                        unit = unit_id(object_id, i, distortion)
+
+                        saved_record = recon_cache.completed_record(unit, key, taus)
+                        if saved_record is not None and out_ply.exists():
+                            print("Already finished in a previous run, reusing its results")
+                            # (without the old timings, since nothing ran now)
+                            record.update({k: v for k, v in saved_record.items() if k != "timings"})
+                            continue
+
+                        if recon_cache.lookup(key, out_ply):
+                            print(f"SPAR3D: Reusing cached reconstruction {key[:12]}")
+                            with StageTimer("load_ply") as timer:
+                                pred_pts = load_ply_pointcloud(out_ply)
+                            timer.add_to(record)
+                            evaluate_distortion_record(record, pred_pts, gt_pts, taus, out_ply, eval_backend)
+                            recon_cache.record_unit(unit, key, taus, record)
+                            continue
+
+                    todo.append(dict(distortion=distortion, seed=item_seed, record=record, dist_path=dist_path,
+                                     out_ply=out_ply, distort_dir=distort_dir, key=key, unit=unit))
+
+            if not todo:
+                results["images"].append(img_results)
+                continue
 
-            # Clean up the distorted image folder
-            if not keep_distorted:
+            # Decode the image once and make all of its distortions together
+            todo_records = [item["record"] for item in todo]
+            with StageTimer("load_image") as timer:
+                img = Image.open(img_path).convert("RGB")
+            timer.add_to(*todo_records)
+            with StageTimer("distort") as timer:
+                distorted_images = distort_image_levels(img, [item["distortion"] for item in todo],
+                                                        [item["seed"] for item in todo])
+            timer.add_to(*todo_records)
+
+            for item, distorted in zip(todo, distorted_images):
+                with span("distortion", object_id=object_id, image_idx=i, **item["distortion"]):
+                    record, dist_path, out_ply = item["record"], item["dist_path"], item["out_ply"]
+                    distort_dir, key, unit = item["distort_dir"], item["key"], item["unit"]
+
+                    # Save the distorted image to the directory
+                    with StageTimer("save_image") as timer:
+                        distort_dir.mkdir(parents=True, exist_ok=True)
+                        distorted.save(dist_path)
+                    timer.add_to(record)
+
+                    if batch_size is not None:
+                        # Reconstruct later, together with the other distortions
+                        pending.append(item)
+                        continue
+
+                    # Run SPAR3D on the distorted image
+                    with StageTimer("reconstruct") as timer:
+                        usage = write_spar3d_point_clouds([dist_path], [out_ply], worker=spar3d_worker)
+                    timer.update(usage)
+                    timer.add_to(record)
+                    print(f"SPAR3D: Finished in {timer.metrics['wall_s']:.2f} seconds")
+                    with StageTimer("load_ply") as timer:
+                        pred_pts = load_ply_pointcloud(out_ply)
+                    timer.add_to(record)
+
+                    # Evaluate once and save results for each tau
+                    evaluate_distortion_record(record, pred_pts, gt_pts, taus, out_ply, eval_backend)
+                    if key is not None:
+                        recon_cache.store(key, out_ply)
+                        recon_cache.record_unit(unit, key, taus, record)
+
+                    # Clean up the distorted image folder
+                    if not keep_distorted:
+                        print(f"Removing folder: {distort_dir}")
+                        shutil.rmtree(distort_dir, ignore_errors=True)
+
+            results["images"].append(img_results)
+
+    if pending:
+        # Run SPAR3D once on all the distorted images
+        with StageTimer("reconstruct") as timer:
+            usage = write_spar3d_point_clouds(
+                [item["dist_path"] for item in pending],
+                [item["out_ply"] for item in pending],
+                worker=spar3d_worker,
+                batch_size=batch_size,
+            )
+        timer.update(usage)
+        timer.add_to(*[item["record"] for item in pending])
+        print(f"SPAR3D: Finished {len(pending)} images in {timer.metrics['wall_s']:.2f} seconds")
+
+        # Map each output back to its distortion, and evaluate them
+        all_pred_pts = []
+        for item in pending:
+            with StageTimer("load_ply") as timer:
+                all_pred_pts.append(load_ply_pointcloud(item["out_ply"]))
+            timer.add_to(item["record"])
+        if eval_backend == "torch":
+            evaluate_distortion_records_batched([item["record"] for item in pending], all_pred_pts, gt_pts, taus,
+                                                [item["out_ply"] for item in pending])
+        else:
+            for item, pred_pts in zip(pending, all_pred_pts):
+                evaluate_distortion_record(item["record"], pred_pts, gt_pts, taus, item["out_ply"], eval_backend)
+        for item in pending:
+            if item["key"] is not None:
+                recon_cache.store(item["key"], item["out_ply"])
+                recon_cache.record_unit(item["unit"], item["key"], taus, item["record"])
+
+        # Clean up the distorted image folders
+        if not keep_distorted:
+            for distort_dir in sorted({item["distort_dir"] for item in pending}):
                 print(f"Removing folder: {distort_dir}")
                 shutil.rmtree(distort_dir, ignore_errors=True)
 
-        results["images"].append(img_results)
-
     return results
 
 
+@traced("path")
 def save_results_json(results: dict, path: Path):
     """Save the pipeline results to a json"""
     path.parent.mkdir(parents=True, exist_ok=True)
@@ -133,57 +325,176 @@ def save_results_json(results: dict, path: Path):
         json.dump(results, f, indent=2)
 
 
+def _file_stamp(path: Path) -> list[int] | None:
+    """[size, mtime_ns] of a file (None if it doesn't exist), recorded to notice when an input changes"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+_worker_gt_cache = None  # Each re-evaluation worker process prepares its ground truths once
+
+
+def _init_reevaluation_worker(gt_archive_path: Path | None = None):
+    global _worker_gt_cache
+    import torch
+    torch.set_num_threads(1)  # (one process per core already)
+    # (every worker maps the same archive, so its pages are shared through the OS page cache)
+    archive = GroundTruthArchive(gt_archive_path) if gt_archive_path is not None else None
+    _worker_gt_cache = GroundTruthCache(max_entries=2, archive=archive)
+
+
+def _reevaluate_object(object_folder: Path, gt_path: Path, entries: list[dict], new_taus: list[float],
+                       eval_backend: str, gt_cache: GroundTruthCache | None = None) -> list[tuple[int, list, dict]]:
+    """
+    Re-evaluates one object's distortion records (run in a worker process). Each entry has the record's store row
+    id, PLY file name, evaluations, and the eval_inputs stamps it was last evaluated with.
+    Only missing taus are computed for records whose PLY and GT are unchanged; records whose inputs changed (or were
+    never stamped) are recomputed for both their old taus and the new ones.
+    Returns (row id, merged evaluations, eval_inputs) for every record that changed.
+    """
+    if gt_cache is None:
+        gt_cache = _worker_gt_cache
+    gt_stamp = _file_stamp(gt_path)
+    if gt_stamp is None:
+        print(f"WARNING: Ground truth {gt_path} not found, skipping {object_folder.name}")
+        return []
+    updates = []
+    for entry in entries:
+        ply_path = object_folder / entry["ply_name"]
+        inputs = {"ply": _file_stamp(ply_path), "gt": gt_stamp}
+        if inputs["ply"] is None:
+            continue
+
+        # Keep the evaluations that are still valid, and work out which taus are left
+        evaluations = {ev["tau"]: ev for ev in entry["evaluations"]}
+        if entry["eval_inputs"] != inputs:
+            todo = sorted(set(evaluations) | set(new_taus))
+            evaluations = {}
+        else:
+            todo = [tau for tau in new_taus if tau not in evaluations]
+        if not todo:
+            continue
+
+        store_path = nn_store_path(ply_path)
+        if store_path.exists() and os.stat(store_path).st_mtime_ns >= max(inputs["ply"][1], gt_stamp[1]):
+            # Use the saved nearest-neighbour distances (saved after the PLY and GT last changed)
+            all_metrics = evaluate_from_store(store_path, todo)
+        else:
+            # Recompute for each tau (sharing one nearest-neighbour pass), saving the distances
+            from evaluation import evaluate_pointcloud_multi
+            points = load_ply_pointcloud(ply_path)
+            all_metrics = evaluate_pointcloud_multi(points, gt_cache.get(gt_path), taus=todo, backend=eval_backend,
+                                                    nn_store_path=store_path)
+
+        for tau, metrics in zip(todo, all_metrics):
+            evaluations[tau] = {"tau": tau, "metrics": metrics}
+        updates.append((entry["id"], [evaluations[tau] for tau in sorted(evaluations)], inputs))
+    return updates
+
+
 def reevaluate_results_with_folder(
         old_json_path: Path,
         new_json_path: Path,
         new_taus: list[float],
         spar3d_outputs_root: Path,
         object_relations_path: Path,
+        eval_backend: str = "torch",
+        gt_cache: GroundTruthCache | None = None,
+        max_workers: int | None = None,
+        gt_archive_path: Path | None = None,
 ):
     """
     Re-run evaluations for new tau values using already-generated point clouds in spar3d_outputs.
-    - Uses the previous JSON to know which objects/images/distortions exist
+    - Uses the previous results (a JSON, or a results store) to know which objects/images/distortions exist
     - Finds PLY files in spar3d_outputs/<object_id>/
+    - Merges the new taus into each record's evaluations, only computing what is missing: every record stores the
+      size/mtime of the PLY and GT it was evaluated with (eval_inputs), and is recomputed in full when those change
+    - Uses the saved nearest-neighbour distances (.nn.npz) next to each PLY when they are newer than the PLY and GT
+    - Objects are spread over max_workers processes (default: one per core; 1 runs everything in this process,
+      using gt_cache)
+    - With gt_archive_path, ground truths come from that packed archive (see gt_archive.py) instead of their PLYs
+    - Writes a results store if new_json_path is a .sqlite/.db path, otherwise a JSON
     """
 
-    # Load old results JSON
-    with open(old_json_path, "r") as f:
-        data = json.load(f)
-
-    for category_name, category_objs in data.items():
-        for object_id, obj_data in category_objs.items():
-            # Find the object folder in the spar3d_outputs folder
-            object_folder = spar3d_outputs_root / object_id
-            if not object_folder.exists():
-                continue
-
-            # Find the ground truth point cloud from the relations file
-            grouped_data = load_dataset_relations(object_relations_path)
-            gt_path = grouped_data[category_name][object_id]["point_cloud"]
-            gt_points = load_ply_pointcloud(gt_path)
-
-            for img_data in obj_data["images"]:
-                for dist_data in img_data["distortions"]:
-                    # Reconstruct the point cloud file name
-                    pts_file_name = f"pts_img{img_data['image_idx']}_blur{dist_data['distortion']['blur']}_noise{dist_data['distortion']['noise']}_exp{dist_data['distortion']['exposure']}.ply"
-                    points = load_ply_pointcloud(object_folder / pts_file_name)
-
-                    # Clear old evaluations
-                    dist_data["evaluations"] = []
-
-                    # Recompute for each new tau
-                    for tau in new_taus:
-                        metrics = evaluate_pointcloud(points, gt_points, tau=tau)
-                        dist_data["evaluations"].append({
-                            "tau": tau,
-                            "metrics": metrics
-                        })
-
-    # Save updated JSON
-    new_json_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(new_json_path, "w") as f:
-        json.dump(data, f, indent=2)
-
+    # Load the old results as a store (a results JSON is loaded into an in-memory one)
+    source = open_results(old_json_path)
+    if is_results_store(new_json_path):
+        new_json_path.parent.mkdir(parents=True, exist_ok=True)
+        same_file = Path(new_json_path).exists() and Path(new_json_path).samefile(old_json_path)
+        store = source if same_file else source.copy_to(new_json_path)
+    else:
+        store = source.copy_to(":memory:") if is_results_store(old_json_path) else source
+
+    # Load the relations file once
+    grouped_data = load_dataset_relations(object_relations_path)
+
+    # Group the records by object (each object is one job)
+    records = {dist_data["id"]: dist_data for dist_data in store.distortions()}
+    jobs = {}
+    for dist_data in records.values():
+        category_name, object_id = dist_data["category"], dist_data["object_id"]
+
+        # Find the object folder in the spar3d_outputs folder
+        object_folder = spar3d_outputs_root / object_id
+        if not object_folder.exists():
+            continue
+        if object_id not in grouped_data.get(category_name, {}):
+            print(f"WARNING: {object_id} is not in the relations file, skipping")
+            continue
+
+        # Reconstruct the point cloud file name
+        distortion = dist_data["distortion"]
+        pts_file_name = f"pts_img{dist_data['image_idx']}_blur{distortion['blur']}_noise{distortion['noise']}_exp{distortion['exposure']}.ply"
+        jobs.setdefault((category_name, object_id), []).append(dict(
+            id=dist_data["id"],
+            ply_name=pts_file_name,
+            evaluations=store.evaluations(dist_data["id"]),
+            eval_inputs=dist_data.get("eval_inputs"),
+        ))
+
+    def save_updates(updates):
+        for row_id, evaluations, inputs in updates:
+            record = {k: v for k, v in records[row_id].items()
+                      if k not in ("id", "category", "object_id", "image_idx", "original_image")}
+            record["eval_inputs"] = inputs
+            store.set_evaluations(row_id, evaluations, record=record)
+        return len(updates)
+
+    job_args = [
+        (spar3d_outputs_root / object_id, grouped_data[category_name][object_id]["point_cloud"], entries)
+        for (category_name, object_id), entries in jobs.items()
+    ]
+    updated = 0
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_workers == 1 or len(job_args) <= 1:
+        if gt_cache is None:
+            archive = GroundTruthArchive(gt_archive_path) if gt_archive_path is not None else None
+            gt_cache = GroundTruthCache(archive=archive)
+        for object_folder, gt_path, entries in job_args:
+            updated += save_updates(_reevaluate_object(object_folder, gt_path, entries, new_taus, eval_backend,
+                                                       gt_cache))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp.get_context("spawn"),
+                                 initializer=_init_reevaluation_worker, initargs=(gt_archive_path,)) as pool:
+            futures = [
+                pool.submit(_reevaluate_object, object_folder, gt_path, entries, new_taus, eval_backend)
+                for object_folder, gt_path, entries in job_args
+            ]
+            for future in as_completed(futures):
+                updated += save_updates(future.result())
+
+    # Save updated results
+    if not is_results_store(new_json_path):
+        store.export_json(new_json_path, indent=2)
+    store.close()
+    if source is not store:
+        source.close()
+
+    print(f"Re-evaluated {updated} of {len(records)} records ({len(job_args)} objects)")
     print(f"Saved updated results → {new_json_path}")
 
 
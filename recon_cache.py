@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from distortion import DISTORTION_VERSION
+
+MANIFEST_COMPACT_LINES = 1000  # Rewrite the manifest mid-run once this many of its lines (and over half) are stale
+
+
+def file_digest(path: Path) -> str:
+    """SHA-256 of a file's contents"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _git_revision(repo_dir: Path) -> str | None:
+    """Commit checked out in a git repo (read straight from .git, no subprocess), or None"""
+    git_dir = Path(repo_dir) / ".git"
+    try:
+        head = (git_dir / "HEAD").read_text().strip()
+        if not head.startswith("ref: "):
+            return head
+        ref = head[len("ref: "):]
+        if (git_dir / ref).exists():
+            return (git_dir / ref).read_text().strip()
+        for line in (git_dir / "packed-refs").read_text().splitlines():
+            if line.endswith(" " + ref):
+                return line.split()[0]
+    except OSError:
+        pass
+    return None
+
+
+def spar3d_fingerprint(spar3d_dir: Path, **config) -> str:
+    """Identifies the SPAR3D code (git commit) and settings that produce a reconstruction"""
+    return json.dumps({"revision": _git_revision(spar3d_dir), **config}, sort_keys=True, default=str)
+
+
+def reconstruction_key(image_digest: str, distortion: dict, seed: int | None, fingerprint: str) -> str:
+    """Content address of a reconstruction: source image bytes, distortion, RNG seed, and SPAR3D version/config"""
+    payload = json.dumps({
+        "image": image_digest,
+        "distortion": {k: float(distortion[k]) for k in ("blur", "noise", "exposure")},
+        "seed": seed,
+        "distortion_version": DISTORTION_VERSION,
+        "spar3d": fingerprint,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def unit_id(object_id: str, image_idx: int, distortion: dict) -> str:
+    """Identifies one (object, image, distortion) of a sweep"""
+    blur, noise, exposure = distortion["blur"], distortion["noise"], distortion["exposure"]
+    return f"{object_id}/img{image_idx}/blur{blur}_noise{noise}_exp{exposure}"
+
+
+class ReconstructionCache:
+    """
+    Content-addressed store of SPAR3D output point clouds, plus a manifest of finished sweep units.
+      - objects/<key>.ply: one reconstruction per key (see reconstruction_key); least recently used ones are evicted
+        once the store grows past max_gb
+      - manifest.jsonl: append-only journal of finished units and their result records (without timings), so an
+        interrupted sweep resumes exactly where it stopped (the last line for a unit wins). It is compacted to the
+        latest line of each unit whose reconstruction is still cached, on load and once enough lines are stale, and
+        counts towards max_gb.
+    """
+
+    def __init__(self, root: Path, max_gb: float | None = 20.0, fingerprint: str = ""):
+        self.root = Path(root)
+        self.objects_dir = self.root / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.root / "manifest.jsonl"
+        self.max_bytes = None if max_gb is None else int(max_gb * 1024 ** 3)
+        self.fingerprint = fingerprint
+        self.hits = 0
+        self.misses = 0
+
+        # Sizes of the cached reconstructions, least recently used first. Use is tracked here rather than in the
+        # files' mtimes: a hit hard-links the file into the outputs, and touching it would change the output PLY's
+        # mtime too (which the eval_inputs stamps and .nn.npz freshness checks rely on). Across runs, the order starts
+        # from when each reconstruction was stored.
+        entries = sorted((entry.stat().st_mtime_ns, entry.name[:-4], entry.stat().st_size)
+                         for entry in os.scandir(self.objects_dir) if entry.name.endswith(".ply"))
+        self._sizes = OrderedDict((key, size) for _, key, size in entries)
+        self._image_digests = {}
+        self._lock = threading.Lock()  # (the staged pipeline uses the cache from several threads)
+        self._manifest_lines = 0
+        self._manifest_bytes = 0
+        self._units = self._load_manifest()
+        if self._manifest_lines > len(self._units):
+            self.compact()
+
+    def _load_manifest(self) -> dict:
+        units = {}
+        if self.manifest_path.exists():
+            with open(self.manifest_path, "rb") as f:
+                for line in f:
+                    self._manifest_lines += 1
+                    self._manifest_bytes += len(line)
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # (a line cut short by a crash)
+                    units[entry["unit"]] = entry
+        # (a unit whose reconstruction was evicted is dropped too, so the manifest can't outgrow the store)
+        return {unit: entry for unit, entry in units.items() if entry["key"] in self._sizes}
+
+    def compact(self):
+        """Rewrites the manifest with only the latest line of each unit whose reconstruction is still cached."""
+        with self._lock:
+            self._units = {unit: entry for unit, entry in self._units.items() if entry["key"] in self._sizes}
+            lines = [(json.dumps(entry) + "\n").encode() for entry in self._units.values()]
+            tmp = self.manifest_path.with_suffix(".jsonl.tmp")
+            with open(tmp, "wb") as f:
+                f.writelines(lines)
+            os.replace(tmp, self.manifest_path)  # (atomic, so a crash leaves either the old or the new manifest)
+            self._manifest_lines = len(lines)
+            self._manifest_bytes = sum(len(line) for line in lines)
+
+    def key_for(self, image_path: Path, distortion: dict, seed: int | None) -> str:
+        """Cache key for reconstructing image_path at this distortion (the image is hashed once per run)"""
+        stat = os.stat(image_path)
+        digest_key = (str(image_path), stat.st_size, stat.st_mtime_ns)
+        if digest_key not in self._image_digests:
+            self._image_digests[digest_key] = file_digest(image_path)
+        return reconstruction_key(self._image_digests[digest_key], distortion, seed, self.fingerprint)
+
+    def _object_path(self, key: str) -> Path:
+        return self.objects_dir / f"{key}.ply"
+
+    def lookup(self, key: str, output_file_path: Path) -> bool:
+        """Puts the cached reconstruction at output_file_path and returns True on a hit."""
+        cached = self._object_path(key)
+        with self._lock:
+            if key not in self._sizes or not cached.exists():
+                self.misses += 1
+                return False
+            self.hits += 1
+            # Mark as recently used
+            self._sizes.move_to_end(key)
+
+        # Link (or copy) it into place
+        output_file_path = Path(output_file_path)
+        output_file_path.parent.mkdir(parents=True, exist_ok=True)
+        output_file_path.unlink(missing_ok=True)
+        try:
+            os.link(cached, output_file_path)
+        except OSError:
+            shutil.copyfile(cached, output_file_path)
+        return True
+
+    def store(self, key: str, ply_path: Path):
+        """Adds a reconstruction to the cache, evicting old ones if it is over its size limit."""
+        cached = self._object_path(key)
+        tmp = cached.with_suffix(f".{threading.get_ident()}.tmp")
+        shutil.copyfile(ply_path, tmp)
+        os.replace(tmp, cached)  # (atomic, so a crash never leaves half a file under a valid key)
+        with self._lock:
+            self._sizes[key] = cached.stat().st_size
+            self._sizes.move_to_end(key)
+            self.evict()
+
+    def completed_record(self, unit: str, key: str, taus: list[float]) -> dict | None:
+        """The saved result record of a finished unit, if it was made from the same inputs and taus."""
+        entry = self._units.get(unit)
+        if entry is None or entry["key"] != key or entry["taus"] != list(taus):
+            return None
+        return entry["record"]
+
+    def record_unit(self, unit: str, key: str, taus: list[float], record: dict):
+        """Marks a unit as finished (appends one line to the manifest)."""
+        # (timings describe the run that made the record, and are never reused on resume)
+        record = {k: v for k, v in record.items() if k != "timings"}
+        entry = dict(unit=unit, key=key, taus=list(taus), record=record)
+        line = (json.dumps(entry) + "\n").encode()
+        with self._lock:
+            self._units[unit] = entry
+            with open(self.manifest_path, "ab") as f:
+                f.write(line)
+            self._manifest_lines += 1
+            self._manifest_bytes += len(line)
+            stale = self._manifest_lines - len(self._units)
+            self.evict()
+        if stale > MANIFEST_COMPACT_LINES and stale > len(self._units):
+            self.compact()
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the cached reconstructions plus the manifest"""
+        return sum(self._sizes.values()) + self._manifest_bytes
+
+    def evict(self):
+        """Deletes least recently used reconstructions until the cache is under max_gb."""
+        if self.max_bytes is None:
+            return
+        while self._sizes and self.nbytes > self.max_bytes:
+            key, _ = self._sizes.popitem(last=False)
+            self._object_path(key).unlink(missing_ok=True)
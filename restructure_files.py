@@ -4,6 +4,8 @@ import json
 from collections import defaultdict
 from pathlib import Path
 
+from dataset_manifest import DatasetManifest
+
 
 def move_images_and_build_image_relations(source_root: Path, dest_root: Path) -> dict[str, str]:
     """Moves images from source_root to dest_root and organizes/names them for processing."""
@@ -53,13 +55,24 @@ def move_images_and_build_image_relations(source_root: Path, dest_root: Path) ->
     return relations
 
 
-def merge_with_pointclouds(image_map, pointcloud_root, output_path):
-    """Build the relations between image_id, point_cloud_path, and image_path"""
+def merge_with_pointclouds(image_map, pointcloud_root, output_path, gt_archive=None):
+    """
+    Build the relations between image_id, point_cloud_path, and image_path
+    (objects in gt_archive, a gt_archive.GroundTruthArchive, are looked up in its index instead of globbed for)
+    """
     pointcloud_root = Path(pointcloud_root)
     final_map = defaultdict(dict)
     for object_id, img_path in image_map.items():
         # Get the category and paths
         category = "_".join(object_id.split("_")[:-1])
+        if gt_archive is not None and object_id in gt_archive:
+            final_map[category][object_id] = {
+                "point_cloud": str(gt_archive.source_path(object_id)),
+                "images": img_path
+            }
+            print(f"Linked {object_id}")
+            continue
+
         category_dir = pointcloud_root / category
         object_dir = category_dir / object_id
 
@@ -85,11 +98,23 @@ def merge_with_pointclouds(image_map, pointcloud_root, output_path):
 
 
 def move_images_and_build_full_relations(move_source_path: Path, move_dest_path: Path, pointcloud_root: Path,
-                                         relation_output_path: Path):
-    """Get the image map and build the full mapping"""
+                                         relation_output_path: Path, gt_archive=None, manifest_path: Path | None = None):
+    """
+    Get the image map and build the full mapping
+    With a manifest (see dataset_manifest.py), only newly extracted folders are processed, and the relations cover
+    every object ingested so far.
+    """
+    if manifest_path is not None:
+        manifest = DatasetManifest(manifest_path)
+        manifest.ingest_extracted(move_source_path, move_dest_path)
+        manifest.link_point_clouds(pointcloud_root, gt_archive=gt_archive)
+        manifest.write_relations(relation_output_path)
+        return
+
     image_map = move_images_and_build_image_relations(move_source_path, move_dest_path)
     merge_with_pointclouds(
         image_map=image_map,
         pointcloud_root=pointcloud_root,
         output_path=relation_output_path,
+        gt_archive=gt_archive,
     )
@@ -0,0 +1,383 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+from tracing import traced
+
+RESULTS_STORE_SUFFIXES = (".sqlite", ".db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS categories (
+    id INTEGER PRIMARY KEY,
+    category TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS objects (
+    id INTEGER PRIMARY KEY,
+    category TEXT NOT NULL,
+    object_id TEXT NOT NULL,
+    UNIQUE (category, object_id)
+);
+CREATE TABLE IF NOT EXISTS distortions (
+    id INTEGER PRIMARY KEY,
+    object_row INTEGER NOT NULL REFERENCES objects (id),
+    image_idx INTEGER NOT NULL,
+    original_image TEXT,
+    position INTEGER NOT NULL,
+    blur REAL NOT NULL,
+    noise REAL NOT NULL,
+    exposure REAL NOT NULL,
+    record TEXT NOT NULL,
+    UNIQUE (object_row, image_idx, position)
+);
+CREATE TABLE IF NOT EXISTS evaluations (
+    id INTEGER PRIMARY KEY,
+    distortion_row INTEGER NOT NULL REFERENCES distortions (id),
+    position INTEGER NOT NULL,
+    tau REAL NOT NULL,
+    chamfer_distance REAL,
+    precision REAL,
+    recall REAL,
+    fscore REAL,
+    device_used TEXT,
+    metrics TEXT NOT NULL,
+    UNIQUE (distortion_row, tau)
+);
+CREATE INDEX IF NOT EXISTS distortions_by_level ON distortions (blur, noise, exposure);
+CREATE INDEX IF NOT EXISTS evaluations_by_tau ON evaluations (tau);
+"""
+
+
+def is_results_store(path: Path) -> bool:
+    """Whether a results path is a ResultsStore database (rather than a results JSON)"""
+    return Path(path).suffix in RESULTS_STORE_SUFFIXES
+
+
+class ResultsStore:
+    """
+    SQLite store of pipeline results, written one distortion record at a time (each in its own transaction), so
+    saving an object costs the same however many came before it, and a crash never loses what was already saved.
+    Every record is stored whole (as JSON) for export, with category/object, distortion level, and tau (plus the
+    metrics) as indexed columns for queries. export_json writes the nested results JSON that main.py used to write.
+    """
+
+    def __init__(self, path: Path | str):
+        self.path = path
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()  # (on_object_done may be called from another thread than the one that opened it)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode = WAL")
+            self._conn.executescript(_SCHEMA)
+            # (a store from before categories were registered has them only on its objects)
+            self._conn.execute("INSERT OR IGNORE INTO categories (category) SELECT category FROM objects ORDER BY id")
+
+    # Writing
+
+    def _object_row(self, category: str, object_id: str) -> int:
+        self._conn.execute("INSERT OR IGNORE INTO categories (category) VALUES (?)", (category,))
+        self._conn.execute("INSERT OR IGNORE INTO objects (category, object_id) VALUES (?, ?)", (category, object_id))
+        return self._conn.execute(
+            "SELECT id FROM objects WHERE category = ? AND object_id = ?", (category, object_id)
+        ).fetchone()[0]
+
+    def add_category(self, category: str):
+        """Registers a category (so categories without any finished objects are exported too, as {})."""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO categories (category) VALUES (?)", (category,))
+
+    def add_object(self, category: str, object_id: str):
+        """Registers an object (so objects without any results are exported too)."""
+        with self._lock, self._conn:
+            self._object_row(category, object_id)
+
+    def add_record(self, category: str, object_id: str, image_idx: int, original_image: str, record: dict,
+                   position: int = 0):
+        """
+        Saves one distortion record (as built by pipeline.process_one_object) and its evaluations. position is the
+        record's index in its image's distortion list; saving the same object, image, and position again replaces it.
+        """
+        distortion = record["distortion"]
+        with self._lock, self._conn:
+            object_row = self._object_row(category, object_id)
+            row = self._conn.execute(
+                "SELECT id FROM distortions WHERE object_row = ? AND image_idx = ? AND position = ?",
+                (object_row, image_idx, position),
+            ).fetchone()
+            if row is not None:
+                self._conn.execute("DELETE FROM evaluations WHERE distortion_row = ?", (row[0],))
+                self._conn.execute("DELETE FROM distortions WHERE id = ?", (row[0],))
+
+            fields = {k: v for k, v in record.items() if k != "evaluations"}
+            distortion_row = self._conn.execute(
+                "INSERT INTO distortions (object_row, image_idx, original_image, position, blur, noise, exposure, "
+                "record) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (object_row, image_idx, original_image, position, distortion["blur"], distortion["noise"],
+                 distortion["exposure"], json.dumps(fields)),
+            ).lastrowid
+            self._insert_evaluations(distortion_row, record["evaluations"])
+
+    @traced("category")
+    def add_object_result(self, category: str, result: dict):
+        """Saves every record of one object's result (the dict returned by pipeline.process_one_object)."""
+        self.add_object(category, result["object_id"])
+        for img in result["images"]:
+            for position, record in enumerate(img["distortions"]):
+                self.add_record(category, result["object_id"], img["image_idx"], img["original_image"], record,
+                                position)
+
+    def set_evaluations(self, distortion_row: int, evaluations: list[dict], record: dict | None = None):
+        """
+        Replaces the evaluations of one stored distortion record (e.g. after re-evaluating with new taus), and
+        optionally its other fields (record, without evaluations).
+        """
+        with self._lock, self._conn:
+            if record is not None:
+                self._conn.execute("UPDATE distortions SET record = ? WHERE id = ?", (json.dumps(record), distortion_row))
+            self._conn.execute("DELETE FROM evaluations WHERE distortion_row = ?", (distortion_row,))
+            self._insert_evaluations(distortion_row, evaluations)
+
+    def _insert_evaluations(self, distortion_row: int, evaluations: list[dict]):
+        self._conn.executemany(
+            "INSERT INTO evaluations (distortion_row, position, tau, chamfer_distance, precision, recall, fscore, "
+            "device_used, metrics) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (distortion_row, position, ev["tau"], ev["metrics"].get("chamfer_distance"),
+                 ev["metrics"].get("precision"), ev["metrics"].get("recall"), ev["metrics"].get("fscore"),
+                 ev["metrics"].get("device_used"), json.dumps(ev["metrics"]))
+                for position, ev in enumerate(evaluations)
+            ],
+        )
+
+    # Reading
+
+    def distortions(self, category: str | None = None, object_id: str | None = None) -> list[dict]:
+        """
+        Stored distortion records (without their evaluations), in the order they were saved, optionally for one
+        category/object. Each has the row id (for set_evaluations), category, object_id, image_idx, original_image,
+        and the record fields (distorted_image, distortion, ...).
+        """
+        query = (
+            "SELECT d.id, o.category, o.object_id, d.image_idx, d.original_image, d.record "
+            "FROM distortions d JOIN objects o ON o.id = d.object_row"
+        )
+        conditions, params = [], []
+        if category is not None:
+            conditions.append("o.category = ?")
+            params.append(category)
+        if object_id is not None:
+            conditions.append("o.object_id = ?")
+            params.append(object_id)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY o.id, d.image_idx, d.position"
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [
+            dict(id=row["id"], category=row["category"], object_id=row["object_id"], image_idx=row["image_idx"],
+                 original_image=row["original_image"], **json.loads(row["record"]))
+            for row in rows
+        ]
+
+    def evaluations(self, distortion_row: int) -> list[dict]:
+        """The evaluations of one stored distortion record, as {tau, metrics} dicts"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT tau, metrics FROM evaluations WHERE distortion_row = ? ORDER BY position", (distortion_row,)
+            ).fetchall()
+        return [dict(tau=row["tau"], metrics=json.loads(row["metrics"])) for row in rows]
+
+    def categories(self) -> list[str]:
+        """Every registered category, in the order they were added"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT category FROM categories ORDER BY id")]
+
+    def taus(self) -> list[float]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT tau FROM evaluations ORDER BY tau")]
+
+    def query(self, sql: str, params=()) -> list[sqlite3.Row]:
+        """Runs a read query against the store (tables: categories, objects, distortions, evaluations)."""
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def iter_query(self, sql: str, params=()):
+        """Like query, but yields rows as they are read (for results too big to hold at once; single thread only)."""
+        yield from self._conn.execute(sql, params)
+
+    # Export/import
+
+    def to_nested(self) -> dict:
+        """The stored results in the nested {category: {object_id: {object_id, images: [...]}}} layout"""
+        with self._lock:
+            categories = self._conn.execute("SELECT category FROM categories ORDER BY id").fetchall()
+            objects = self._conn.execute("SELECT id, category, object_id FROM objects ORDER BY id").fetchall()
+            distortions = self._conn.execute(
+                "SELECT id, object_row, image_idx, original_image, record FROM distortions "
+                "ORDER BY object_row, image_idx, position"
+            ).fetchall()
+            evaluations = self._conn.execute(
+                "SELECT distortion_row, tau, metrics FROM evaluations ORDER BY distortion_row, position"
+            ).fetchall()
+
+        evals_by_row = {}
+        for row in evaluations:
+            evals_by_row.setdefault(row["distortion_row"], []).append(
+                dict(tau=row["tau"], metrics=json.loads(row["metrics"]))
+            )
+
+        results = {row["category"]: {} for row in categories}
+        by_row = {}
+        for row in objects:
+            result = dict(object_id=row["object_id"], images=[])
+            results.setdefault(row["category"], {})[row["object_id"]] = result
+            by_row[row["id"]] = result
+        for row in distortions:
+            images = by_row[row["object_row"]]["images"]
+            if not images or images[-1]["image_idx"] != row["image_idx"]:
+                images.append(dict(image_idx=row["image_idx"], original_image=row["original_image"], distortions=[]))
+            record = json.loads(row["record"])
+            record["evaluations"] = evals_by_row.get(row["id"], [])
+            images[-1]["distortions"].append(record)
+        return results
+
+    @traced("json_path")
+    def export_json(self, json_path: Path, indent: int | None = 4):
+        """Writes the results JSON (written aside first, so an existing file is never left half-written)."""
+        json_path = Path(json_path)
+        json_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = json_path.with_name(json_path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_nested(), f, indent=indent)
+        tmp_path.replace(json_path)
+
+    def export_jsonl(self, jsonl_path: Path):
+        """
+        Writes the results as JSON lines, one distortion record per line (with its category, object_id, image_idx,
+        original_image, and evaluations), which can be read back a line at a time.
+        """
+        jsonl_path = Path(jsonl_path)
+        jsonl_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = jsonl_path.with_name(jsonl_path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            for record in self.distortions():
+                record["evaluations"] = self.evaluations(record.pop("id"))
+                f.write(json.dumps(record) + "\n")
+        tmp_path.replace(jsonl_path)
+
+    def import_results(self, results: dict):
+        """Adds a nested results dict (e.g. a results JSON from before there was a store)."""
+        for category, category_objs in results.items():
+            self.add_category(category)
+            for result in category_objs.values():
+                self.add_object_result(category, result)
+
+    def copy_to(self, path: Path | str) -> "ResultsStore":
+        """A copy of this store at path (":memory:" for an in-memory scratch copy)."""
+        copy = ResultsStore(path)
+        with self._lock:
+            self._conn.backup(copy._conn)
+        return copy
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_results(path: Path) -> ResultsStore:
+    """Opens results as a store: a store database directly, or a results JSON loaded into an in-memory store"""
+    if is_results_store(path):
+        return ResultsStore(path)
+    with open(path, "r") as f:
+        results = json.load(f)
+    store = ResultsStore(":memory:")
+    store.import_results(results)
+    return store
+
+
+class _JsonStream:
+    """Reads JSON values one at a time from a file, keeping only a small window of it in memory"""
+
+    def __init__(self, f, chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """The next non-whitespace character ("" at the end of the file)"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def consume(self, char: str) -> bool:
+        if self.peek() == char:
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, char: str):
+        if not self.consume(char):
+            raise ValueError(f"Expected {char!r} in results JSON, found {self.peek()!r}")
+
+    def value(self):
+        """Decodes the next value (reading more of the file until the whole value is in the window)"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            self.pos = end
+            return value
+
+
+def iter_results_json(json_path: Path, chunk_size: int = 1 << 20):
+    """
+    Streams a nested results JSON one object at a time, yielding (category, object_id, result), so only one
+    object's results are in memory at once however big the file is.
+    """
+    with open(json_path, "r") as f:
+        stream = _JsonStream(f, chunk_size)
+        stream.expect("{")
+        while not stream.consume("}"):
+            category = stream.value()
+            stream.expect(":")
+            stream.expect("{")
+            while not stream.consume("}"):
+                object_id = stream.value()
+                stream.expect(":")
+                yield category, object_id, stream.value()
+                stream.consume(",")
+            stream.consume(",")
+
+
+def iter_results_jsonl(jsonl_path: Path):
+    """Streams the distortion records of a results .jsonl (see ResultsStore.export_jsonl) one line at a time"""
+    with open(jsonl_path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
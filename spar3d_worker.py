@@ -0,0 +1,205 @@
+import multiprocessing as mp
+import queue
+import sys
+import traceback
+from contextlib import nullcontext
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+
+from instrumentation import StageTimer
+
+# Model factories run inside the worker process and return a reconstruct(image_paths, output_dir, batch_size)
+# function, which writes output_dir/<i>/points.ply for the i-th image (the same layout as SPAR3D's run.py)
+
+
+def _load_spar3d_reconstructor(spar3d_dir: Path, device: str | None = None, foreground_ratio: float = 1.3,
+                               texture_resolution: int = 1024, remesh: str = "none", target_vertex_count: int = -1,
+                               low_vram_mode: bool = False):
+    """Loads the SPAR3D model once and returns a function that reconstructs images with it (mirrors run.py)"""
+    sys.path.insert(0, str(spar3d_dir))
+    import torch
+    from PIL import Image
+    from spar3d.system import SPAR3D
+    from spar3d.utils import foreground_crop, get_device, remove_background
+    from transparent_background import Remover
+
+    device = device or get_device()
+    model = SPAR3D.from_pretrained(
+        "stabilityai/stable-point-aware-3d",
+        config_name="config.yaml",
+        weight_name="model.safetensors",
+        low_vram_mode=low_vram_mode,
+    )
+    model.to(device)
+    model.eval()
+    bg_remover = Remover()  # (as run.py makes it, on transparent_background's default device)
+
+    def reconstruct(image_paths: list[Path], output_dir: Path, batch_size: int = 1):
+        images = [
+            foreground_crop(remove_background(Image.open(p).convert("RGBA"), bg_remover), foreground_ratio)
+            for p in image_paths
+        ]
+
+        for start in range(0, len(images), batch_size):
+            batch = images[start:start + batch_size]
+            autocast = torch.autocast(device_type=device, dtype=torch.bfloat16) if "cuda" in device else nullcontext()
+            with torch.no_grad(), autocast:
+                meshes, glob_dict = model.run_image(
+                    batch,
+                    bake_resolution=texture_resolution,
+                    remesh=remesh,
+                    vertex_count=target_vertex_count,
+                    return_points=True,
+                )
+            if len(batch) == 1:
+                meshes = [meshes]
+
+            # Save each result in its own numbered folder
+            for j, mesh in enumerate(meshes):
+                out_dir = Path(output_dir) / str(start + j)
+                out_dir.mkdir(parents=True, exist_ok=True)
+                mesh.export(out_dir / "mesh.glb", include_normals=True)
+                glob_dict["point_clouds"][j].export(out_dir / "points.ply")
+
+    return reconstruct
+
+
+def spar3d_model_factory(spar3d_dir: Path, **kwargs):
+    """Picklable factory for the real SPAR3D model (kwargs are passed to the loader)"""
+    return partial(_load_spar3d_reconstructor, Path(spar3d_dir), **kwargs)
+
+
+def _stub_reconstruct(image_paths: list[Path], output_dir: Path, batch_size: int = 1, num_points: int = 512):
+    """Stand-in for SPAR3D: writes a random point cloud (seeded by the image name) for each image"""
+    for i, image_path in enumerate(image_paths):
+        rng = np.random.default_rng(sum(Path(image_path).name.encode()))
+        points = rng.normal(size=(num_points, 3)).astype("<f4")
+
+        out_dir = Path(output_dir) / str(i)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        with open(out_dir / "points.ply", "wb") as f:
+            f.write(
+                b"ply\nformat binary_little_endian 1.0\n"
+                + f"element vertex {num_points}\n".encode()
+                + b"property float x\nproperty float y\nproperty float z\nend_header\n"
+            )
+            f.write(points.tobytes())
+
+
+def stub_model_factory():
+    """Model factory for testing the worker without SPAR3D (no model, no GPU)"""
+    return _stub_reconstruct
+
+
+def _worker_main(model_factory, jobs, results):
+    """Worker process loop: load the model once, then run jobs until told to stop."""
+    try:
+        reconstruct = model_factory()
+    except Exception:
+        results.put(("ready", traceback.format_exc(), None))
+        return
+    results.put(("ready", None, None))
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+
+        job_id, image_paths, output_dir, batch_size = job
+        try:
+            # (measured here, since the parent process can't see the worker's CPU time or GPU memory)
+            with StageTimer("reconstruct") as timer:
+                reconstruct([Path(p) for p in image_paths], Path(output_dir), batch_size=batch_size)
+            results.put((job_id, None, timer.metrics))
+        except Exception:
+            results.put((job_id, traceback.format_exc(), None))
+
+
+class Spar3dWorker:
+    """
+    A long-lived process that loads SPAR3D once and reconstructs the images sent to it over a multiprocessing queue,
+    avoiding the Python startup, CUDA init, and weight loading that every `python run.py` call pays.
+    """
+
+    def __init__(self, model_factory=None, start_timeout: float = 600):
+        self.model_factory = model_factory
+        self.start_timeout = start_timeout
+        self._ctx = mp.get_context("spawn")  # (CUDA can't be used in forked processes)
+        self._process = None
+        self._jobs = None
+        self._results = None
+        self._next_job_id = 0
+
+    def start(self):
+        """Starts the worker and waits until the model is loaded."""
+        if self._process is not None:
+            return self
+        if self.model_factory is None:
+            raise ValueError("Spar3dWorker needs a model_factory (e.g. spar3d_model_factory(SPAR3D_DIR))")
+
+        self._jobs = self._ctx.Queue()
+        self._results = self._ctx.Queue()
+        self._process = self._ctx.Process(
+            target=_worker_main, args=(self.model_factory, self._jobs, self._results), daemon=True
+        )
+        self._process.start()
+
+        _, error, _ = self._wait_for("ready", self.start_timeout)
+        if error is not None:
+            self.close()
+            raise RuntimeError(f"SPAR3D worker failed to load the model:\n{error}")
+        print("SPAR3D worker: Model loaded")
+        return self
+
+    def reconstruct(self, image_paths: list[Path], output_dir: Path, batch_size: int = 1,
+                    timeout: float | None = None) -> dict:
+        """
+        Reconstructs the images into output_dir/<i>/ (blocking), batch_size images per forward pass,
+        like `python run.py <images> --output-dir <output_dir> --batch-size <batch_size>`.
+        Returns the worker's measurements of the job (see instrumentation.StageTimer).
+        """
+        if self._process is None:
+            self.start()
+
+        job_id = self._next_job_id
+        self._next_job_id += 1
+        self._jobs.put((job_id, [str(p) for p in image_paths], str(output_dir), batch_size))
+
+        _, error, usage = self._wait_for(job_id, timeout)
+        if error is not None:
+            raise RuntimeError(f"SPAR3D worker failed on {[str(p) for p in image_paths]}:\n{error}")
+        return usage
+
+    def close(self):
+        """Stops the worker process."""
+        if self._process is None:
+            return
+        if self._process.is_alive():
+            self._jobs.put(None)
+            self._process.join(timeout=30)
+            if self._process.is_alive():
+                self._process.terminate()
+        self._process = None
+
+    def _wait_for(self, job_id, timeout: float | None):
+        """Waits for a job's result, noticing if the worker process dies in the meantime."""
+        waited = 0.0
+        while timeout is None or waited < timeout:
+            try:
+                result = self._results.get(timeout=1.0)
+            except queue.Empty:
+                waited += 1.0
+                if not self._process.is_alive():
+                    raise RuntimeError(f"SPAR3D worker exited unexpectedly (exit code {self._process.exitcode})")
+                continue
+            if result[0] == job_id:
+                return result
+        raise TimeoutError(f"SPAR3D worker did not finish job {job_id} within {timeout} seconds")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
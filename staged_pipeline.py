@@ -0,0 +1,294 @@
+import asyncio
+import shutil
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+from distortion import derive_seed, distort_image_levels
+from gt_cache import GroundTruthCache
+from instrumentation import StageTimer
+from loading_things import load_ply_pointcloud
+from pipeline import evaluate_distortion_record, write_spar3d_point_clouds
+from recon_cache import ReconstructionCache, unit_id
+from spar3d_worker import Spar3dWorker
+from tracing import span
+
+# How many items each stage works on at once. Reconstruction stays at 1: there is one GPU (and a Spar3dWorker
+# handles one job at a time)
+DEFAULT_STAGE_CONCURRENCY = {
+    "distort": 4,
+    "reconstruct": 1,
+    "load_ply": 2,
+    "evaluate": 1,
+}
+
+_DONE = object()  # Queue sentinel: the previous stage has finished
+
+
+@dataclass
+class _WorkItem:
+    """One (object, image, distortion) moving through the stages"""
+    group_name: str
+    object_id: str
+    gt_path: Path
+    image_idx: int
+    image_path: Path
+    distortion_idx: int
+    distortion: dict
+    record: dict = field(default_factory=dict)
+    distorted_path: Path | None = None
+    out_ply: Path | None = None
+    pred_pts: np.ndarray | None = None
+    cache_key: str | None = None
+    cached: bool = False  # Reconstruction came from the cache
+    resumed: bool = False  # Whole item was finished in a previous run
+    error: Exception | None = None
+    stage: str = ""
+
+
+async def _run_stage(name: str, fn, inbox: asyncio.Queue, outbox: asyncio.Queue, concurrency: int,
+                     next_concurrency: int):
+    """
+    Runs fn (in a thread) on every item from inbox with `concurrency` workers, passing items on to outbox.
+    An inbox entry can also be a list of items that fn works on together (all distortions of one image), which are
+    then passed on one by one. Items that already failed are passed through untouched; a failure is stored on the
+    item instead of stopping the pipeline. The bounded outbox makes a fast stage wait for a slow one (backpressure).
+    """
+    async def worker():
+        while True:
+            work = await inbox.get()
+            if work is _DONE:
+                return
+            items = work if isinstance(work, list) else [work]
+            if all(item.error is None for item in items):
+                try:
+                    await asyncio.to_thread(_run_item, name, fn, work)
+                except Exception as e:
+                    for item in items:
+                        item.error, item.stage = e, name
+            for item in items:
+                await outbox.put(item)
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+    # Tell every worker of the next stage that there is nothing more coming
+    for _ in range(next_concurrency):
+        await outbox.put(_DONE)
+
+
+def _run_item(name: str, fn, work: _WorkItem | list[_WorkItem]):
+    """Runs one stage on one item or image (traced as a span of that stage, labelled with the item's distortion)"""
+    if isinstance(work, list):
+        with span(name, object_id=work[0].object_id, image_idx=work[0].image_idx, levels=len(work)):
+            fn(work)
+        return
+    with span(name, object_id=work.object_id, image_idx=work.image_idx, **work.distortion):
+        fn(work)
+
+
+async def _run_pipeline(jobs: list[tuple[str, str, dict]], distortion_levels: list[dict], taus: list[float],
+                        images_per_object: int, output_root: Path, keep_distorted: bool, eval_backend: str,
+                        gt_cache: GroundTruthCache, spar3d_worker: Spar3dWorker | None,
+                        recon_cache: ReconstructionCache | None, seed: int | None, concurrency: dict,
+                        queue_size: int, on_object_done) -> dict:
+    # Plan the work: every image of every object, at every distortion level (an image's levels are distorted together)
+    image_items = []
+    for group_name, obj_id, fields in jobs:
+        images = sorted(list(Path(fields["images"]).glob("*.png")))[:images_per_object]
+        (output_root / obj_id).mkdir(parents=True, exist_ok=True)
+        for i, img_path in enumerate(images):
+            image_items.append([_WorkItem(group_name, obj_id, Path(fields["point_cloud"]), i, img_path, d, distortion)
+                                for d, distortion in enumerate(distortion_levels)])
+    items = [item for image in image_items for item in image]
+
+    # Track how many items of each object are still in flight
+    results = {group_name: {} for group_name, _, _ in jobs}
+    remaining = {obj_id: 0 for _, obj_id, _ in jobs}
+    for item in items:
+        remaining[item.object_id] += 1
+    failed = set()
+    finished = {}
+    distort_dirs = {}  # Distorted-image folders of each object (shared by its images, so removed once it's done)
+
+    # (objects without any images have nothing to run)
+    for group_name, obj_id, _ in jobs:
+        if remaining[obj_id] == 0:
+            results[group_name][obj_id] = dict(object_id=obj_id, images=[])
+            if on_object_done is not None:
+                on_object_done(group_name, obj_id, results[group_name][obj_id])
+
+    def prepare(item: _WorkItem) -> int | None:
+        """Names the item's outputs and checks the cache; returns the item's seed"""
+        blur, noise, exposure = item.distortion["blur"], item.distortion["noise"], item.distortion["exposure"]
+        distort_dir = output_root / item.object_id / f"blur{blur}_noise{noise}_exp{exposure}"
+        item.distorted_path = distort_dir / f"img_{item.image_idx}.png"
+        ply_name = f"pts_img{item.image_idx}_blur{blur}_noise{noise}_exp{exposure}.ply"
+        item.out_ply = output_root / item.object_id / ply_name
+        item_seed = None if seed is None else derive_seed(seed, item.object_id, item.image_idx, blur, noise, exposure)
+        item.record = dict(
+            distorted_image=str(item.distorted_path),
+            distortion=dict(blur=blur, noise=noise, exposure=exposure),
+            evaluations=[],
+        )
+
+        # Check the cache (noise is only reproducible, and so only cached, with a seed)
+        if recon_cache is not None and (noise == 0 or item_seed is not None):
+            item.cache_key = recon_cache.key_for(item.image_path, item.distortion, item_seed)
+            saved_record = recon_cache.completed_record(_unit(item), item.cache_key, taus)
+            if saved_record is not None and item.out_ply.exists():
+                item.record.update({k: v for k, v in saved_record.items() if k != "timings"})
+                item.resumed = True
+            elif recon_cache.lookup(item.cache_key, item.out_ply):
+                item.cached = True
+        return item_seed
+
+    def distort(image: list[_WorkItem]):
+        seeds = [prepare(item) for item in image]
+        todo = [(item, item_seed) for item, item_seed in zip(image, seeds) if not (item.resumed or item.cached)]
+        if not todo:
+            return
+
+        # Decode the image once and make all of its (uncached) distortions together, then save them
+        from PIL import Image
+        todo_records = [item.record for item, _ in todo]
+        with StageTimer("load_image") as timer:
+            img = Image.open(image[0].image_path).convert("RGB")
+        timer.add_to(*todo_records)
+        with StageTimer("distort") as timer:
+            distorted_images = distort_image_levels(img, [item.distortion for item, _ in todo],
+                                                    [item_seed for _, item_seed in todo])
+        timer.add_to(*todo_records)
+        for (item, _), distorted in zip(todo, distorted_images):
+            with StageTimer("save_image") as timer:
+                distort_dir = item.distorted_path.parent
+                distort_dirs.setdefault(item.object_id, set()).add(distort_dir)
+                distort_dir.mkdir(parents=True, exist_ok=True)
+                distorted.save(item.distorted_path)
+            timer.add_to(item.record)
+
+    def reconstruct(item: _WorkItem):
+        if item.resumed or item.cached:
+            return
+        with StageTimer("reconstruct") as timer:
+            usage = write_spar3d_point_clouds([item.distorted_path], [item.out_ply], worker=spar3d_worker)
+        timer.update(usage)
+        timer.add_to(item.record)
+        print(f"SPAR3D: Finished in {timer.metrics['wall_s']:.2f} seconds")
+        if item.cache_key is not None:
+            recon_cache.store(item.cache_key, item.out_ply)
+
+        # Clean up the distorted image (its folder goes once the whole object is through, see collect)
+        if not keep_distorted:
+            item.distorted_path.unlink(missing_ok=True)
+
+    def load_ply(item: _WorkItem):
+        if not item.resumed:
+            with StageTimer("load_ply") as timer:
+                item.pred_pts = load_ply_pointcloud(item.out_ply)
+            timer.add_to(item.record)
+
+    def evaluate(item: _WorkItem):
+        if item.resumed:
+            return
+        gt_pts = gt_cache.get(item.gt_path)
+        evaluate_distortion_record(item.record, item.pred_pts, gt_pts, taus, item.out_ply, eval_backend)
+        item.pred_pts = None
+        if item.cache_key is not None:
+            recon_cache.record_unit(_unit(item), item.cache_key, taus, item.record)
+
+    # Queues between the stages
+    stage_fns = [("distort", distort), ("reconstruct", reconstruct), ("load_ply", load_ply), ("evaluate", evaluate)]
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in range(len(stage_fns) + 1)]
+
+    async def produce():
+        for image in image_items:
+            await queues[0].put(image)
+        for _ in range(concurrency["distort"]):
+            await queues[0].put(_DONE)
+
+    async def collect():
+        while True:
+            item = await queues[-1].get()
+            if item is _DONE:
+                return
+            if item.error is not None:
+                print(f"Failed processing {item.object_id} (image {item.image_idx}, distortion "
+                      f"{item.distortion}) in stage '{item.stage}': {item.error}")
+                failed.add(item.object_id)
+            else:
+                finished.setdefault(item.object_id, []).append(item)
+
+            # Assemble an object's results once all of its items are through
+            remaining[item.object_id] -= 1
+            if remaining[item.object_id] == 0 and not keep_distorted:
+                # (no other image of the object can still be writing into these folders now)
+                for distort_dir in distort_dirs.pop(item.object_id, ()):
+                    shutil.rmtree(distort_dir, ignore_errors=True)
+            if remaining[item.object_id] == 0 and item.object_id not in failed:
+                result = _assemble_object(item.object_id, finished.pop(item.object_id))
+                results[item.group_name][item.object_id] = result
+                if on_object_done is not None:
+                    on_object_done(item.group_name, item.object_id, result)
+
+    stages = []
+    for s, (name, fn) in enumerate(stage_fns):
+        next_concurrency = concurrency[stage_fns[s + 1][0]] if s + 1 < len(stage_fns) else 1
+        stages.append(_run_stage(name, fn, queues[s], queues[s + 1], concurrency[name], next_concurrency))
+    await asyncio.gather(produce(), *stages, collect())
+
+    # Keep the planned object order (objects finish out of order)
+    return {
+        group_name: {obj_id: group[obj_id] for _, obj_id, _ in jobs if obj_id in group}
+        for group_name, group in results.items()
+    }
+
+
+def _unit(item: _WorkItem) -> str:
+    return unit_id(item.object_id, item.image_idx, item.distortion)
+
+
+def _assemble_object(object_id: str, items: list[_WorkItem]) -> dict:
+    """Builds the same result dict as pipeline.process_one_object from an object's finished items"""
+    result = dict(object_id=object_id, images=[])
+    for item in sorted(items, key=lambda it: (it.image_idx, it.distortion_idx)):
+        if not result["images"] or result["images"][-1]["image_idx"] != item.image_idx:
+            result["images"].append(dict(
+                image_idx=item.image_idx,
+                original_image=str(item.image_path),
+                distortions=[],
+            ))
+        result["images"][-1]["distortions"].append(item.record)
+    return result
+
+
+def run_staged_pipeline(grouped_data: dict, distortion_levels: list[dict], taus: list[float],
+                        objects_per_group: int, images_per_object: int = 1, output_root: Path | None = None,
+                        keep_distorted: bool = False, eval_backend: str = "torch",
+                        gt_cache: GroundTruthCache | None = None, spar3d_worker: Spar3dWorker | None = None,
+                        recon_cache: ReconstructionCache | None = None, seed: int | None = None,
+                        stage_concurrency: dict | None = None, queue_size: int = 4, on_object_done=None) -> dict:
+    """
+    Runs the testing pipeline on every object as overlapping stages (distort → reconstruct → load PLY → evaluate),
+    so the CPU stages run while SPAR3D is busy on the GPU. Each stage has its own concurrency limit and a bounded
+    queue in front of the next one. A failure only drops the object it belongs to.
+    Returns the same {group: {object_id: result}} dict that main.py builds with process_one_object;
+    on_object_done(group_name, object_id, result) is called as each object completes.
+    recon_cache and seed work as in pipeline.process_one_object.
+    """
+    concurrency = dict(DEFAULT_STAGE_CONCURRENCY, **(stage_concurrency or {}))
+    if output_root is None:
+        output_root = Path("spar3d_outputs")
+    if gt_cache is None:
+        gt_cache = GroundTruthCache()
+
+    jobs = [
+        (group_name, obj_id, fields)
+        for group_name, group_objs in grouped_data.items()
+        for obj_id, fields in list(group_objs.items())[:objects_per_group]
+    ]
+    results = asyncio.run(_run_pipeline(
+        jobs, distortion_levels, taus, images_per_object, Path(output_root), keep_distorted, eval_backend,
+        gt_cache, spar3d_worker, recon_cache, seed, concurrency, queue_size, on_object_done,
+    ))
+    return {group_name: results.get(group_name, {}) for group_name in grouped_data}
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The modules live at the repository root (run the tests with `python -m pytest tests` from there, or from anywhere)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
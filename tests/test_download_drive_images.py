@@ -0,0 +1,72 @@
+import io
+import tarfile
+
+from download_drive_images import download_files, extract_archive, read_extracted_marker
+
+
+def _make_archive(path, members: dict[str, bytes]):
+    """A .tar.gz with the given members, in the given order"""
+    with tarfile.open(path, "w:gz") as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+# Renders out of order (as they can be in the real archives), in both layouts, plus a member escaping the archive
+MEMBERS = {
+    "obj_001/render/images/r_3.png": b"3" * 30,
+    "obj_001/render/images/r_1.png": b"1" * 10,
+    "obj_001/render/images/r_2.png": b"2" * 20,
+    "obj_001/render/images/r_0.png": b"0" * 5,
+    "obj_001/render/transforms.json": b"{}",
+    "obj_002/r_1.png": b"b" * 7,
+    "obj_002/r_0.png": b"a" * 3,
+    "../evil.png": b"x",
+}
+
+
+def test_extract_archive_keeps_first_renders_per_object(tmp_path):
+    archive = tmp_path / "a.tar.gz"
+    _make_archive(archive, MEMBERS)
+    out = tmp_path / "out" / "a"
+    out.mkdir(parents=True)
+
+    written = extract_archive(str(archive), str(out), images_per_object=2)
+
+    assert sorted(p.name for p in (out / "obj_001" / "render" / "images").iterdir()) == ["r_0.png", "r_1.png"]
+    assert sorted(p.name for p in (out / "obj_002").iterdir()) == ["r_0.png", "r_1.png"]
+    assert not (out / "obj_001" / "render" / "transforms.json").exists()
+    assert written == 5 + 10 + 3 + 7
+
+
+def test_extract_archive_rejects_members_outside(tmp_path):
+    archive = tmp_path / "a.tar.gz"
+    _make_archive(archive, MEMBERS)
+    out = tmp_path / "out" / "a"
+    out.mkdir(parents=True)
+
+    extract_archive(str(archive), str(out))
+
+    assert not (tmp_path / "out" / "evil.png").exists()
+    assert (out / "obj_001" / "render" / "transforms.json").exists()
+    assert len(list((out / "obj_001" / "render" / "images").iterdir())) == 4
+
+
+def test_download_files_extracts_again_for_more_renders(tmp_path):
+    archive = tmp_path / "arch.tar.gz"
+    _make_archive(archive, MEMBERS)
+    out_dir = tmp_path / "images_raw"
+    url = archive.as_uri()
+
+    assert download_files([url], out_dir, unzip=True, images_per_object=1)["arch"] > 0
+    assert read_extracted_marker(out_dir, "arch") == {"images_per_object": 1}
+    assert len(list((out_dir / "arch" / "obj_002").iterdir())) == 1
+
+    # Same setting (or fewer renders): nothing to do
+    assert download_files([url], out_dir, unzip=True, images_per_object=1)["arch"] == 0
+
+    # More renders per object: extracted again
+    assert download_files([url], out_dir, unzip=True, images_per_object=2)["arch"] > 0
+    assert read_extracted_marker(out_dir, "arch") == {"images_per_object": 2}
+    assert len(list((out_dir / "arch" / "obj_002").iterdir())) == 2
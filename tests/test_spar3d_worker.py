@@ -0,0 +1,26 @@
+from loading_things import load_ply_pointcloud
+from spar3d_worker import Spar3dWorker, stub_model_factory
+
+
+def test_worker_round_trip_and_shutdown(tmp_path):
+    image_paths = [tmp_path / "r_0.png", tmp_path / "r_1.png"]  # (the stub model only uses their names)
+    worker = Spar3dWorker(stub_model_factory)
+
+    with worker:
+        process = worker._process
+        assert process.is_alive()
+        usage = worker.reconstruct(image_paths, tmp_path / "out", batch_size=2)
+        # (a second job on the same, already loaded, worker)
+        worker.reconstruct(image_paths[:1], tmp_path / "out_again")
+
+    for i in range(len(image_paths)):
+        points = load_ply_pointcloud(tmp_path / "out" / str(i) / "points.ply")
+        assert points.shape == (512, 3)
+    assert (load_ply_pointcloud(tmp_path / "out_again" / "0" / "points.ply") ==
+            load_ply_pointcloud(tmp_path / "out" / "0" / "points.ply")).all()
+    assert usage["wall_s"] >= 0
+
+    # Closing stopped the process cleanly (told to stop, not terminated)
+    assert worker._process is None
+    assert not process.is_alive()
+    assert process.exitcode == 0
@@ -0,0 +1,225 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+# Opt-in tracing of a run as Chrome trace events (open the JSON in https://ui.perfetto.dev or chrome://tracing):
+#   start_tracing("trace.json", profile=["evaluate_pointcloud_multi"])
+#   ...
+#   stop_tracing()
+# Spans nest per thread: process_one_object > image > distortion > the functions doing the work (distort_image,
+# the SPAR3D call, load_ply_pointcloud, evaluate_pointcloud_multi, ...), so gaps between them show where a sweep
+# stalls. Spans named in `profile` also get a cProfile .prof file (`torch_profile`: a torch profiler trace) written
+# next to the trace, linked from the span's args. Only the process that started tracing is traced (not the SPAR3D
+# worker or re-evaluation worker processes).
+# While tracing is off, span() hands back one shared no-op context and @traced functions call straight through.
+
+_tracer = None
+_NULL_SPAN = contextlib.nullcontext()
+_profiler_locks = {"cprofile": threading.Lock(), "torch": threading.Lock()}  # (one active profiler of each kind)
+
+
+class Tracer:
+    """Collects the spans of one run (from any thread) and saves them as a Chrome trace"""
+
+    def __init__(self, path: Path, profile=(), torch_profile=(), max_profiles: int = 3):
+        self.path = Path(path)
+        self.profile = set(profile)
+        self.torch_profile = set(torch_profile)
+        self.max_profiles = max_profiles  # Per span name, so profiling a span inside a loop stays bounded
+        self.events = []
+        self._threads = {}
+        self._profile_counts = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._start_ns = time.perf_counter_ns()
+
+    def now_us(self) -> float:
+        return (time.perf_counter_ns() - self._start_ns) / 1000
+
+    def add(self, name: str, start_us: float, end_us: float, args: dict):
+        thread = threading.current_thread()
+        event = dict(name=name, ph="X", ts=start_us, dur=end_us - start_us, pid=self._pid, tid=thread.ident,
+                     args=args)
+        with self._lock:
+            self.events.append(event)
+            self._threads.setdefault(thread.ident, thread.name)
+
+    def profile_path(self, name: str, suffix: str) -> Path | None:
+        """Where the next profile of a span goes (None once max_profiles of it were written)"""
+        with self._lock:
+            count = self._profile_counts.get(name, 0)
+            if count >= self.max_profiles:
+                return None
+            self._profile_counts[name] = count + 1
+        return self.path.with_name(f"{self.path.stem}.{name}.{count}{suffix}")
+
+    def save(self) -> Path:
+        """Writes the trace (written aside first, so an existing file is never left half-written)"""
+        with self._lock:
+            metadata = [dict(name="process_name", ph="M", pid=self._pid, args=dict(name="sweep"))]
+            metadata += [dict(name="thread_name", ph="M", pid=self._pid, tid=tid, args=dict(name=name))
+                         for tid, name in self._threads.items()]
+            trace = dict(traceEvents=metadata + self.events, displayTimeUnit="ms")
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(trace, f, default=str)  # (args like paths are written as strings)
+        os.replace(tmp_path, self.path)
+        return self.path
+
+
+class _Span:
+    """One traced span (with a profiler around it if its name was picked for profiling)"""
+
+    def __init__(self, tracer: Tracer, name: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self._cprofile = self._torch_profile = None
+
+    def __enter__(self):
+        if self.name in self.tracer.profile:
+            self._start_cprofile()
+        if self.name in self.tracer.torch_profile:
+            self._start_torch_profile()
+        self._start_us = self.tracer.now_us()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end_us = self.tracer.now_us()
+        if self._cprofile is not None:
+            self._stop_cprofile()
+        if self._torch_profile is not None:
+            self._stop_torch_profile()
+        if exc_type is not None:
+            self.args["error"] = repr(exc)
+        self.tracer.add(self.name, self._start_us, end_us, self.args)
+
+    def _start_cprofile(self):
+        # (profilers don't nest, so a span inside one being profiled, or on another thread, just isn't profiled)
+        if not _profiler_locks["cprofile"].acquire(blocking=False):
+            return
+        path = self.tracer.profile_path(self.name, ".prof")
+        if path is None:
+            _profiler_locks["cprofile"].release()
+            return
+        import cProfile
+        self._cprofile, self._cprofile_path = cProfile.Profile(), path
+        try:
+            self._cprofile.enable()
+        except ValueError as e:  # (another profiler is already active, e.g. python -m cProfile)
+            print(f"WARNING: Could not profile span '{self.name}': {e}")
+            self._cprofile = None
+            _profiler_locks["cprofile"].release()
+
+    def _stop_cprofile(self):
+        self._cprofile.disable()
+        self._cprofile_path.parent.mkdir(parents=True, exist_ok=True)
+        self._cprofile.dump_stats(self._cprofile_path)
+        self.args["cprofile"] = str(self._cprofile_path)
+        _profiler_locks["cprofile"].release()
+
+    def _start_torch_profile(self):
+        if not _profiler_locks["torch"].acquire(blocking=False):
+            return
+        path = self.tracer.profile_path(self.name, ".torch.json")
+        if path is None:
+            _profiler_locks["torch"].release()
+            return
+        import torch
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self._torch_profile, self._torch_profile_path = torch.profiler.profile(activities=activities), path
+        self._torch_profile.__enter__()
+
+    def _stop_torch_profile(self):
+        self._torch_profile.__exit__(None, None, None)
+        self._torch_profile_path.parent.mkdir(parents=True, exist_ok=True)
+        self._torch_profile.export_chrome_trace(str(self._torch_profile_path))
+        self.args["torch_profile"] = str(self._torch_profile_path)
+        _profiler_locks["torch"].release()
+
+
+def span(name: str, **args):
+    """
+    Context manager tracing a span of work (with args shown in the trace viewer):
+        with span("image", object_id=object_id, image_idx=i):
+            ...
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+    return _Span(_tracer, name, args)
+
+
+def traced(*arg_names: str, name: str | None = None):
+    """
+    Decorator tracing every call of a function as a span (named after the function), with the values of the
+    parameters named in arg_names as its args:
+        @traced("path")
+        def load_ply_pointcloud(path, ...):
+    """
+    def decorate(fn):
+        span_name = name or fn.__name__
+        signature = None
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            nonlocal signature
+            if _tracer is None:
+                return fn(*args, **kwargs)
+
+            span_args = {}
+            if arg_names:
+                if signature is None:
+                    import inspect
+                    signature = inspect.signature(fn)
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                span_args = {arg: bound.arguments[arg] for arg in arg_names}
+            with _Span(_tracer, span_name, span_args):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def is_tracing() -> bool:
+    return _tracer is not None
+
+
+def start_tracing(path: Path, profile=(), torch_profile=(), max_profiles: int = 3) -> Tracer:
+    """
+    Starts tracing this process to a Chrome trace at path (saved by stop_tracing). profile / torch_profile name the
+    spans to also run under cProfile / the torch profiler (at most max_profiles times each).
+    """
+    global _tracer
+    if _tracer is not None:
+        raise RuntimeError(f"Already tracing to {_tracer.path}")
+    _tracer = Tracer(path, profile, torch_profile, max_profiles)
+    return _tracer
+
+
+def stop_tracing() -> Path | None:
+    """Stops tracing and saves the trace; returns its path (None if tracing wasn't on)"""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is None:
+        return None
+    path = tracer.save()
+    print(f"Saved trace ({len(tracer.events)} spans) → {path}")
+    return path
+
+
+@contextlib.contextmanager
+def tracing(path: Path, **kwargs):
+    """start_tracing/stop_tracing around a block (the trace is saved even if the block fails)"""
+    start_tracing(path, **kwargs)
+    try:
+        yield
+    finally:
+        stop_tracing()